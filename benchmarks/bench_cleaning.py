@@ -0,0 +1,137 @@
+"""
+Worst case benchmark of the body cleaning rules in email_md.py: each rule
+is timed on bodies made to be as slow as possible for regular expressions,
+e.g. a long run of spaces or asterisks, at a few sizes. A rule whose time
+grows faster than the size of the body is listed at the end.
+
+Example:
+
+    python3 benchmarks/bench_cleaning.py --sizes 20000,40000,80000 --old
+"""
+
+import argparse
+import math
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a rule is super-linear if its time grows faster than size ** GROWTH_LIMIT
+GROWTH_LIMIT = 1.5
+
+# shorter times are mostly noise
+MIN_SECONDS = 0.005
+
+# bodies that make regular expressions backtrack, by size in characters
+BODIES = {
+    "spaces": lambda size: " " * size,
+    "newlines": lambda size: "\n" * size,
+    "dashes": lambda size: "-" * size,
+    "asterisks": lambda size: "*" * size,
+    "hashes": lambda size: "{margin:0;} NoSpacing " + "#" * size,
+    "on": lambda size: "On " * (size // 3),
+    "dash-words": lambda size: "a -- b " * (size // 7),
+    "quotes": lambda size: "> \n" * (size // 3),
+    "html-line": lambda size: '<td class="x">cell</td>' * (size // 23),
+    "words": lambda size: "word " * (size // 5),
+}
+
+# the patterns the rules used before they were rewritten, for --old
+OLD_RULES = {
+    "hash-margin": (r'#.*?\{margin:0;\}', '', re.DOTALL),
+    "hash-no-spacing": (r'#.*?NoSpacing', '', re.DOTALL),
+    "on-wrote": (r'(On .*? wrote:)', r'\n\1\n', re.DOTALL),
+    "forwarded": (r'\n?-*\s*-?Forwarded message?-*\s*-', '\n\n*- Forwarded message *-', re.IGNORECASE),
+    "original-message": (r'\n*\s*-{0,3}\s*Original Message\s*-{0,3}\s*\n*', '\n\n-- Original Message --\n\n', 0),
+    "this-email": (r'\*+.*?This e-mail.*?\*+', '', re.DOTALL),
+    "dash-line": (r'\s*-{2,}\s*--------------------------------\s*-{2,}\s*', '\n\n--------------------------------\n\n', 0),
+    "dashes-wrote": (r"(.*?)(?:\\s*>*)\\s*-{2,}\\s*(.*?\\s*wrote:)", r"\\1\\n\\2", re.IGNORECASE | re.MULTILINE | re.DOTALL),
+    "quoted-blank-lines": (r'\n\n+(?=>)', '\n', 0),
+}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", default="10000,20000,40000", help="sizes of the bodies in characters, separated by ','")
+    parser.add_argument("--rules", default="", help="names of the rules to time separated by ';', all of them if empty")
+    parser.add_argument("--old", action="store_true", help="also time the patterns the rewritten rules replaced")
+    parser.add_argument("--old-sizes", default="100,200,400",
+                        help="sizes for --old, much smaller as some take minutes on a few KB")
+    parser.add_argument("--max-seconds", type=float, default=2.0,
+                        help="stop growing a body once one run takes longer than this")
+    parser.add_argument("--message-md", default=os.path.join(ROOT, "..", "..", "github", "message_md"),
+                        help="folder with the message_md package")
+    return parser.parse_args()
+
+def timed(function, text):
+    start = time.perf_counter()
+    function(text)
+    return time.perf_counter() - start
+
+# Time a function on a body of each size, stopping once it's too slow
+def time_sizes(function, make_body, sizes, max_seconds):
+    times = []
+
+    for size in sizes:
+        seconds = timed(function, make_body(size))
+        times.append(seconds)
+        if seconds > max_seconds:
+            break
+
+    return times
+
+# How fast the time grows with the size, 1 for linear and 2 for quadratic
+def growth(times, sizes):
+    if len(times) < 2 or times[-1] < MIN_SECONDS or times[-2] <= 0:
+        return None
+
+    return math.log(times[-1] / times[-2]) / math.log(sizes[len(times) - 1] / sizes[len(times) - 2])
+
+def report(label, body, times, sizes):
+    exponent = growth(times, sizes)
+    columns = "".join(f"{seconds:10.4f}" for seconds in times) + " " * 10 * (len(sizes) - len(times))
+    slow = "" if len(times) == len(sizes) else "  (stopped, too slow)"
+    print(f"{label:28} {body:12}{columns}  {'' if exponent is None else f'n^{exponent:.1f}'}{slow}")
+
+    return (exponent is not None and exponent > GROWTH_LIMIT) or len(times) < len(sizes)
+
+def main():
+    args = parse_arguments()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    old_sizes = [int(size) for size in args.old_sizes.split(",")]
+    names = [name.strip() for name in args.rules.split(";") if name.strip()]
+
+    sys.path.insert(0, ROOT)
+    sys.path.insert(1, args.message_md)
+    import email_md
+
+    rules = [rule for rule in email_md.CLEAN_RULES.rules if rule.enabled and (not names or rule.name in names)]
+    slow = []
+
+    print(f"{'Rule':28} {'Body':12}" + "".join(f"{size:10}" for size in sizes) + "  growth")
+    for rule in rules:
+        for body, make_body in BODIES.items():
+            times = time_sizes(rule.apply, make_body, sizes, args.max_seconds)
+            if report(rule.name, body, times, sizes):
+                slow.append(f"{rule.name} on {body}")
+
+    for body, make_body in BODIES.items():
+        times = time_sizes(email_md.CLEAN_RULES.apply, make_body, sizes, args.max_seconds)
+        if report("(all rules)", body, times, sizes):
+            slow.append(f"all rules on {body}")
+
+    if args.old:
+        print(f"\n{'Old pattern':28} {'Body':12}" + "".join(f"{size:10}" for size in old_sizes) + "  growth")
+        for name, (pattern, replacement, flags) in OLD_RULES.items():
+            if names and name not in names:
+                continue
+            compiled = re.compile(pattern, flags)
+            for body, make_body in BODIES.items():
+                times = time_sizes(lambda text: compiled.sub(replacement, text), make_body, old_sizes, args.max_seconds)
+                report(name, body, times, old_sizes)
+
+    print("\nSuper-linear: " + (", ".join(slow) if slow else "none"))
+
+if __name__ == "__main__":
+    main()
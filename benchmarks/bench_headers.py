@@ -0,0 +1,80 @@
+"""
+Microbenchmark of the header path used to decide if an email is wanted:
+the old way, parsing the whole email, dateutil for the Date and only the
+first encoded-word of the Subject and From, against `read_header`,
+`parse_date` and `decode_header_value` in email_md.py.
+
+Example:
+
+    python3 benchmarks/bench_headers.py --messages 2000
+"""
+
+import argparse
+import email
+import os
+import sys
+import time
+from email.header import decode_header
+
+from dateutil import parser
+
+import corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--messages", type=int, default=2000, help="number of emails in the corpus")
+    parser.add_argument("--attachment-ratio", type=float, default=0.2, help="fraction of emails with an attachment")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each path, the fastest counts")
+    parser.add_argument("--message-md", default=os.path.join(ROOT, "..", "..", "github", "message_md"),
+                        help="folder with the message_md package")
+    return parser.parse_args()
+
+def old_path(raw):
+    the_email = email.message_from_bytes(raw)
+    subject = decode_header(the_email["Subject"])[0]
+    the_from = decode_header(the_email.get("From"))[0]
+    date = parser.parse(the_email.get("Date").split(' (', 1)[0])
+    return subject, the_from, date
+
+def new_path(raw, email_md):
+    the_email = email_md.read_header(raw)
+    subject = email_md.decode_header_value(the_email.get("Subject"))
+    the_from = email_md.decode_header_value(the_email.get("From"))
+    date = email_md.parse_date(the_email.get("Date"))
+    return subject, the_from, date
+
+def fastest(function, messages, repeat):
+    best = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        for raw in messages:
+            function(raw)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    return best
+
+def main():
+    args = parse_arguments()
+
+    sys.path.insert(0, ROOT)
+    sys.path.insert(1, args.message_md)
+    import email_md
+
+    the_corpus = corpus.Corpus(count=args.messages, attachment_ratio=args.attachment_ratio)
+    messages = [raw for folder, date, raw in the_corpus.messages]
+
+    old = fastest(old_path, messages, args.repeat)
+    new = fastest(lambda raw: new_path(raw, email_md), messages, args.repeat)
+
+    count = len(messages)
+    print(f"Messages: {count}  Average size: {the_corpus.total_bytes() // max(1, count)} bytes")
+    print(f"Whole email + dateutil:        {old / count * 1e6:8.1f} us per message")
+    print(f"Header only + parsedate:       {new / count * 1e6:8.1f} us per message")
+    print(f"Speed up:                      {old / new:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+End-to-end throughput benchmark: runs email_md.py against the IMAP
+stand-in serving a synthetic corpus and reports messages/s, bytes/s, the
+number of IMAP round trips, and the peak memory of the run.
+
+Example:
+
+    python3 benchmarks/bench_throughput.py --messages 2000 --latency-ms 30 -- --workers 4
+
+Anything after `--` is passed on to email_md.py so each setting can be
+compared, and `--output` saves the results as JSON for tracking them over
+time.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+import imap_stand_in
+
+EMAIL_MD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "email_md.py")
+
+CONFIG = {
+    "imap-server": "127.0.0.1",
+    "email-folders": "",
+    "not-email-folders": "",
+}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--messages", type=int, default=1000, help="number of emails in the corpus")
+    parser.add_argument("--folders", default="INBOX;Sent Items", help="folder names separated by ';'")
+    parser.add_argument("--people", type=int, default=50, help="number of people in people.json")
+    parser.add_argument("--known-ratio", type=float, default=0.5, help="fraction of emails with someone known")
+    parser.add_argument("--html-ratio", type=float, default=0.3, help="fraction of HTML emails")
+    parser.add_argument("--attachment-ratio", type=float, default=0.1, help="fraction of emails with an attachment")
+    parser.add_argument("--mean-kb", type=float, default=8, help="typical body size in KB")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the corpus")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every IMAP command")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="KB per second sent to each connection, 0 for no limit")
+    parser.add_argument("--no-compress", action="store_true", help="don't offer COMPRESS=DEFLATE")
+    parser.add_argument("--message-md", default="", help="folder with the message_md package, if not in ../../github/message_md")
+    parser.add_argument("--config-template", default="", help="a message_md config folder to copy config.json and groups.json from")
+    parser.add_argument("--keep", action="store_true", help="keep the output folder")
+    parser.add_argument("--output", default="", help="also write the results to this JSON file")
+    parser.add_argument("email_md_args", nargs="*", help="extra email_md.py arguments, after --")
+    return parser.parse_args()
+
+# Write the config folder email_md.py will use
+def write_config(folder, the_corpus, template):
+    if template:
+        for name in os.listdir(template):
+            if name.endswith(".json") and name != "people.json":
+                shutil.copy(os.path.join(template, name), folder)
+
+    config_path = os.path.join(folder, "config.json")
+    settings = {}
+
+    if os.path.exists(config_path):
+        with open(config_path) as config_file:
+            settings = json.load(config_file)
+
+    settings.update(CONFIG)
+
+    with open(config_path, "w") as config_file:
+        json.dump(settings, config_file, indent=4)
+
+    if not os.path.exists(os.path.join(folder, "groups.json")):
+        with open(os.path.join(folder, "groups.json"), "w") as groups_file:
+            json.dump([], groups_file)
+
+    the_corpus.write_people(folder)
+
+def count_files(folder, extension):
+    return sum(1 for path, folders, files in os.walk(folder) for name in files if name.endswith(extension))
+
+def main():
+    args = parse_arguments()
+
+    the_corpus = corpus.Corpus(count=args.messages, folders=args.folders.split(";"),
+        people=args.people, known_ratio=args.known_ratio, html_ratio=args.html_ratio,
+        attachment_ratio=args.attachment_ratio, mean_kb=args.mean_kb, seed=args.seed)
+
+    # UIDs go up with the date, like a real mailbox
+    mailbox = imap_stand_in.Mailbox()
+    for folder, date, raw in sorted(the_corpus.messages, key=lambda m: m[1]):
+        mailbox.add(folder, raw, date)
+
+    server = imap_stand_in.Server(mailbox, latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_kbps * 1024, compress=not args.no_compress)
+    server.start()
+
+    work_folder = tempfile.mkdtemp(prefix="email_md_bench_")
+    config_folder = os.path.join(work_folder, "config")
+    output_folder = os.path.join(work_folder, "output")
+    os.makedirs(config_folder)
+    os.makedirs(output_folder)
+    write_config(config_folder, the_corpus, args.config_template)
+
+    command = [sys.executable, EMAIL_MD,
+        "-c", config_folder, "-s", config_folder, "-o", output_folder,
+        "-m", corpus.MY_SLUG, "-e", corpus.MY_EMAIL, "-p", "bench",
+        "-i", "127.0.0.1", "-b", the_corpus.start.strftime("%Y-%m-%d"),
+        "--imap-port", str(server.port), "--no-imap-ssl"] + args.email_md_args
+
+    env = dict(os.environ)
+    if args.message_md:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [args.message_md, env.get("PYTHONPATH")]))
+
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=os.path.dirname(EMAIL_MD), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    seconds = time.perf_counter() - start
+
+    server.stop()
+
+    # on Linux ru_maxrss is in KB, it's the largest of email_md.py and its workers
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    stats = server.stats.as_dict()
+    results = {
+        "messages": args.messages,
+        "corpus_bytes": the_corpus.total_bytes(),
+        "latency_ms": args.latency_ms,
+        "bandwidth_kbps": args.bandwidth_kbps,
+        "email_md_args": args.email_md_args,
+        "exit_code": completed.returncode,
+        "seconds": round(seconds, 3),
+        "messages_fetched": stats["messages_sent"],
+        "markdown_files": count_files(output_folder, ".md"),
+        "messages_per_second": round(stats["messages_sent"] / seconds, 1) if seconds else 0,
+        "bytes_per_second": round(stats["bytes_sent"] / seconds) if seconds else 0,
+        "round_trips": stats["commands"],
+        "connections": stats["connections"],
+        "bytes_sent": stats["bytes_sent"],
+        "wire_bytes_sent": stats["wire_bytes_sent"],
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+    }
+
+    print(json.dumps(results, indent=4))
+
+    if completed.returncode:
+        print(completed.stderr.decode(errors="replace")[-2000:], file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    if args.keep:
+        print(f"Output in {work_folder}", file=sys.stderr)
+    else:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    return completed.returncode
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Generates a repeatable set of synthetic emails and the people.json that
+goes with them, for the benchmarks.
+"""
+
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import format_datetime, make_msgid
+
+MY_SLUG = "me"
+MY_EMAIL = "me@example.com"
+
+WORDS = ("the quick brown fox jumps over a lazy dog while we talk about lunch "
+         "meeting tomorrow project budget review thanks again see you soon "
+         "please let me know if that works for everyone cheers").split()
+
+class Corpus:
+    """
+    Synthetic emails spread over a few folders.
+    """
+
+    def __init__(self, count=1000, folders=("INBOX", "Sent Items"), people=50,
+                 known_ratio=0.5, html_ratio=0.3, attachment_ratio=0.1,
+                 mean_kb=8, start=datetime(2024, 1, 1), days=365, seed=1):
+        """
+        Args:
+            count: Number of emails
+            folders: The folder names, the emails are spread evenly
+            people: Number of people in people.json
+            known_ratio: Fraction of the emails from or to someone known
+            html_ratio: Fraction of the emails with only an HTML body
+            attachment_ratio: Fraction of the emails with an attachment
+            mean_kb: Typical size of a body in KB
+            start: Date of the oldest email
+            days: The emails are spread over this many days
+            seed: Random seed so every run gets the same emails
+        """
+
+        self.random = random.Random(seed)
+        self.folders = list(folders)
+        self.start = start
+        self.days = days
+        self.known_ratio = known_ratio
+        self.html_ratio = html_ratio
+        self.attachment_ratio = attachment_ratio
+        self.mean_kb = mean_kb
+
+        self.people = [{
+            "slug": f"person{i}",
+            "first-name": f"Person{i}",
+            "last-name": "Bench",
+            "email": f"person{i}@example.com",
+        } for i in range(people)]
+
+        self.messages = [self.message(i) for i in range(count)]
+
+    def text(self, size):
+        words = []
+        length = 0
+
+        while length < size:
+            word = self.random.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+            if self.random.random() < 0.08:
+                words.append("\n\n")
+
+        return ' '.join(words)
+
+    def message(self, i):
+        """
+        Make one email.
+
+        Returns:
+            tuple: (folder, date, raw RFC822 bytes)
+        """
+
+        folder = self.folders[i % len(self.folders)]
+        date = self.start + timedelta(seconds=self.random.randrange(self.days * 86400))
+
+        if self.random.random() < self.known_ratio:
+            other = self.random.choice(self.people)["email"]
+        else:
+            other = f"stranger{self.random.randrange(10000)}@elsewhere.example"
+
+        sender, recipient = (MY_EMAIL, other) if folder.lower().startswith("sent") else (other, MY_EMAIL)
+
+        # body sizes are skewed, most are short and a few are long
+        size = int(self.random.lognormvariate(0, 1) * self.mean_kb * 1024 / 1.65)
+        body = self.text(max(size, 40))
+
+        msg = EmailMessage(policy=SMTP)
+        msg["From"] = sender
+        msg["To"] = recipient
+        msg["Subject"] = f"Benchmark {i} " + ' '.join(self.random.sample(WORDS, 4))
+        msg["Date"] = format_datetime(date.astimezone())
+        msg["Message-ID"] = make_msgid(str(i), "bench.example")
+
+        if self.random.random() < self.html_ratio:
+            paragraphs = ''.join(f"<p>{p}</p>" for p in body.split("\n\n"))
+            msg.set_content(f"<html><body><div>{paragraphs}</div></body></html>", subtype="html")
+        else:
+            msg.set_content(body)
+            if self.random.random() < self.html_ratio:
+                msg.add_alternative(f"<html><body><pre>{body}</pre></body></html>", subtype="html")
+
+        if self.random.random() < self.attachment_ratio:
+            data = self.random.randbytes(self.random.randrange(1024, 256 * 1024))
+            msg.add_attachment(data, maintype="application", subtype="octet-stream",
+                               filename=f"file{i}.bin")
+
+        return folder, date, msg.as_bytes()
+
+    def total_bytes(self):
+        return sum(len(raw) for folder, date, raw in self.messages)
+
+    def write_people(self, folder):
+        """
+        Write people.json with the people in the corpus and myself.
+        """
+
+        people = self.people + [{
+            "slug": MY_SLUG,
+            "first-name": "Me",
+            "last-name": "Bench",
+            "email": MY_EMAIL,
+        }]
+
+        with open(os.path.join(folder, "people.json"), "w") as people_file:
+            json.dump(people, people_file, indent=4)
@@ -0,0 +1,526 @@
+"""
+A small IMAP server that serves an in-memory mailbox on the loopback
+interface, for benchmarking email_md without a real provider. It supports
+just the commands email_md uses and can add latency to every command, 
+and limit the bandwidth, to act like a remote server. It supports 
+COMPRESS=DEFLATE (RFC 4978).
+"""
+
+import email
+import re
+import socketserver
+import threading
+import time
+import zlib
+from datetime import datetime
+
+UIDVALIDITY = 1
+
+CAPABILITIES = "IMAP4rev1 UIDPLUS"
+COMPRESS_CAPABILITY = "COMPRESS=DEFLATE"
+
+TOKEN_PATTERN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"\[]+(?:\[[^\]]*\])?(?:<[^>]*>)?')
+
+class StoredMessage:
+    """
+    One message in a folder of the stand-in.
+    """
+
+    def __init__(self, uid, raw, internal_date):
+        self.uid = uid
+        self.raw = raw
+        self.internal_date = internal_date
+        self.headers = email.message_from_bytes(raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n')
+        self.parsed = None
+
+    @property
+    def message(self):
+        if self.parsed is None:
+            self.parsed = email.message_from_bytes(self.raw)
+        return self.parsed
+
+class Mailbox:
+    """
+    The folders and their messages.
+    """
+
+    def __init__(self):
+        self.folders = {}
+
+    def add(self, folder, raw, internal_date):
+        messages = self.folders.setdefault(folder, [])
+        messages.append(StoredMessage(len(messages) + 1, raw, internal_date))
+
+class Stats:
+    """
+    What the server did, across all connections.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.wire_bytes_sent = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            "connections": self.connections,
+            "commands": self.commands,
+            "messages_sent": self.messages_sent,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "wire_bytes_sent": self.wire_bytes_sent,
+        }
+
+class Connection:
+    """
+    Writes to and reads from a client's socket, compressing both ways once
+    COMPRESS DEFLATE is on, and waiting as long as sending the bytes would 
+    take at the server's bandwidth.
+    """
+
+    def __init__(self, server, rfile, wfile):
+        self.server = server
+        self.rfile = rfile
+        self.wfile = wfile
+        self.compressor = None
+        self.decompressor = None
+        self.buffer = b''
+
+    def start_compressing(self):
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self.decompressor = zlib.decompressobj(-15)
+
+    def write(self, data):
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self.put(data)
+
+    def flush(self):
+        if self.compressor:
+            self.put(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def put(self, data):
+        if not data:
+            return
+        self.wfile.write(data)
+        self.server.stats.add(wire_bytes_sent=len(data))
+        if self.server.bandwidth:
+            time.sleep(len(data) / self.server.bandwidth)
+
+    def readline(self):
+        if not self.decompressor:
+            return self.rfile.readline()
+
+        while b'\n' not in self.buffer:
+            data = self.rfile.read1(65536)
+            if not data:
+                break
+            self.buffer += self.decompressor.decompress(data)
+
+        line, end, self.buffer = self.buffer.partition(b'\n')
+
+        return line + end
+
+def tokenize(line):
+    """
+    Split a command line into nested lists of tokens, e.g.
+    b'FETCH 1:2 (UID RFC822)' -> ['FETCH', '1:2', ['UID', 'RFC822']]
+    """
+
+    stack = [[]]
+
+    for match in TOKEN_PATTERN.finditer(line):
+        token = match.group(0)
+        if token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) > 1:
+                group = stack.pop()
+                stack[-1].append(group)
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', token[1:-1]).decode())
+        else:
+            stack[-1].append(token.decode())
+
+    while len(stack) > 1:
+        group = stack.pop()
+        stack[-1].append(group)
+
+    return stack[0]
+
+def parse_date(text):
+    return datetime.strptime(text, "%d-%b-%Y").date()
+
+def parse_set(text, largest):
+    """
+    Parse a UID or sequence set like "1:5,7,9:*" into a predicate.
+    """
+
+    ranges = []
+
+    for part in text.split(','):
+        if ':' in part:
+            a, b = part.split(':')
+            a = largest if a == '*' else int(a)
+            b = largest if b == '*' else int(b)
+            ranges.append((min(a, b), max(a, b)))
+        else:
+            number = largest if part == '*' else int(part)
+            ranges.append((number, number))
+
+    return lambda number: any(a <= number <= b for a, b in ranges)
+
+def quote(value):
+    if value is None:
+        return 'NIL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def param_list(params):
+    if not params:
+        return 'NIL'
+    return '(' + ' '.join(f'{quote(key.upper())} {quote(value)}' for key, value in params) + ')'
+
+def part_body(part):
+    """
+    The body of a part as it is in the message, still encoded.
+    """
+
+    if part.get_content_type() == 'message/rfc822':
+        return part.get_payload(0).as_bytes()
+
+    return part.get_payload().encode('utf-8', 'surrogateescape')
+
+def body_structure(part):
+    """
+    Describe a message or part in the IMAP BODYSTRUCTURE format.
+    """
+
+    content_type = part.get_content_type()
+
+    if part.is_multipart() and content_type != 'message/rfc822':
+        children = ''.join(body_structure(child) for child in part.get_payload())
+        return f'({children} {quote(part.get_content_subtype().upper())})'
+
+    maintype, subtype = content_type.upper().split('/')
+    params = [(k, v) for k, v in (part.get_params() or [])[1:]]
+    encoding = part.get('Content-Transfer-Encoding', '7BIT').upper()
+    body = part_body(part)
+
+    fields = [quote(maintype), quote(subtype), param_list(params), 'NIL', 'NIL', quote(encoding), str(len(body))]
+
+    if maintype == 'TEXT':
+        fields.append(str(body.count(b'\n')))
+    elif content_type == 'message/rfc822':
+        fields += ['NIL', '("TEXT" "PLAIN" NIL NIL NIL "7BIT" 0 0)', str(body.count(b'\n'))]
+
+    disposition = part.get_content_disposition()
+    if disposition:
+        disposition_params = (part.get_params(header='content-disposition') or [])[1:]
+        fields += ['NIL', f'({quote(disposition.upper())} {param_list(disposition_params)})']
+
+    return '(' + ' '.join(fields) + ')'
+
+def section_body(message, section):
+    """
+    Get the body of a section e.g. "2.1", as BODY[2.1] would return it.
+    """
+
+    part = message
+    for number in section.split('.'):
+        if part.is_multipart() and part.get_content_type() != 'message/rfc822':
+            part = part.get_payload()[int(number) - 1]
+        elif number != '1':
+            raise ValueError(f"no section {section}")
+
+    return part_body(part)
+
+def header_fields(raw, names):
+    """
+    Get the raw lines of the named header fields, with continuations.
+    """
+
+    header = raw.split(b'\r\n\r\n', 1)[0]
+    wanted = {name.lower().encode() for name in names}
+    lines = []
+    keep = False
+
+    for line in header.split(b'\r\n'):
+        if line[:1] in (b' ', b'\t'):
+            if keep:
+                lines.append(line)
+            continue
+        keep = line.split(b':', 1)[0].strip().lower() in wanted
+        if keep:
+            lines.append(line)
+
+    return b'\r\n'.join(lines) + b'\r\n\r\n'
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    One client connection.
+    """
+
+    def setup(self):
+        super().setup()
+        self.folder = None
+        self.stream = Connection(self.server, self.rfile, self.wfile)
+        self.server.stats.add(connections=1)
+
+    def send(self, data):
+        self.stream.write(data)
+        self.server.stats.add(bytes_sent=len(data))
+
+    def handle(self):
+        self.send(b'* OK IMAP stand-in ready\r\n')
+        self.stream.flush()
+
+        while True:
+            line = self.stream.readline()
+            if not line:
+                break
+
+            self.server.stats.add(commands=1, bytes_received=len(line))
+
+            # act like a server that's far away
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            parts = line.rstrip(b'\r\n').split(b' ', 2)
+            tag = parts[0]
+            command = parts[1].upper().decode() if len(parts) > 1 else ''
+            args = tokenize(parts[2]) if len(parts) > 2 else []
+
+            try:
+                if not self.dispatch(tag, command, args):
+                    break
+            except Exception as e:
+                self.send(tag + b' BAD ' + str(e).encode() + b'\r\n')
+
+            self.stream.flush()
+
+    def dispatch(self, tag, command, args):
+        if command == 'CAPABILITY':
+            capabilities = CAPABILITIES
+            if self.server.compress and not self.stream.compressor:
+                capabilities += ' ' + COMPRESS_CAPABILITY
+            self.send(f'* CAPABILITY {capabilities}\r\n'.encode())
+        elif command == 'COMPRESS':
+            if not self.server.compress or self.stream.compressor or not args or str(args[0]).upper() != 'DEFLATE':
+                self.send(tag + b' NO compression not available\r\n')
+                return True
+            # the OK goes out as is, everything after it is compressed
+            self.send(tag + b' OK DEFLATE active\r\n')
+            self.stream.flush()
+            self.stream.start_compressing()
+            return True
+        elif command == 'LOGIN' or command == 'NOOP':
+            pass
+        elif command == 'LIST':
+            for name in self.server.mailbox.folders:
+                self.send(f'* LIST (\\HasNoChildren) "/" "{name}"\r\n'.encode())
+        elif command in ('SELECT', 'EXAMINE'):
+            return self.select(tag, args[0])
+        elif command == 'UID':
+            sub = args[0].upper()
+            if sub == 'SEARCH':
+                self.search(args[1:], True)
+            elif sub == 'FETCH':
+                self.fetch(args[1], args[2], True)
+            else:
+                self.send(tag + b' BAD unsupported\r\n')
+                return True
+        elif command == 'SEARCH':
+            self.search(args, False)
+        elif command == 'FETCH':
+            self.fetch(args[0], args[1], False)
+        elif command == 'CLOSE':
+            self.folder = None
+        elif command == 'LOGOUT':
+            self.send(b'* BYE logging out\r\n')
+            self.send(tag + b' OK LOGOUT completed\r\n')
+            return False
+        else:
+            self.send(tag + b' BAD unsupported\r\n')
+            return True
+
+        self.send(tag + b' OK ' + command.encode() + b' completed\r\n')
+
+        return True
+
+    def select(self, tag, name):
+        if name not in self.server.mailbox.folders:
+            self.send(tag + b' NO no such folder\r\n')
+            return True
+
+        self.folder = self.server.mailbox.folders[name]
+        uidnext = len(self.folder) + 1
+        self.send(f'* {len(self.folder)} EXISTS\r\n* 0 RECENT\r\n'.encode())
+        self.send(f'* OK [UIDVALIDITY {UIDVALIDITY}] UIDs valid\r\n'.encode())
+        self.send(f'* OK [UIDNEXT {uidnext}] next UID\r\n'.encode())
+        self.send(tag + b' OK [READ-WRITE] SELECT completed\r\n')
+
+        return True
+
+    def matcher(self, keys):
+        """
+        Build a predicate from a list of search keys, all must match.
+        """
+
+        tests = []
+
+        while keys:
+            tests.append(self.search_key(keys))
+
+        return lambda m: all(test(m) for test in tests)
+
+    def search_key(self, keys):
+        key = keys.pop(0)
+
+        if isinstance(key, list):
+            return self.matcher(list(key))
+
+        key = key.upper()
+
+        if key == 'ALL':
+            return lambda m: True
+        if key == 'SINCE':
+            day = parse_date(keys.pop(0))
+            return lambda m: m.internal_date.date() >= day
+        if key == 'BEFORE':
+            day = parse_date(keys.pop(0))
+            return lambda m: m.internal_date.date() < day
+        if key == 'UID':
+            uids = parse_set(keys.pop(0), self.folder[-1].uid if self.folder else 0)
+            return lambda m: uids(m.uid)
+        if key in ('FROM', 'TO', 'CC'):
+            text = keys.pop(0).lower()
+            return lambda m: text in str(m.headers.get(key, '')).lower()
+        if key == 'HEADER':
+            name, text = keys.pop(0), keys.pop(0).lower()
+            return lambda m: text in str(m.headers.get(name, '')).lower()
+        if key == 'OR':
+            a = self.search_key(keys)
+            b = self.search_key(keys)
+            return lambda m: a(m) or b(m)
+        if key == 'NOT':
+            a = self.search_key(keys)
+            return lambda m: not a(m)
+
+        raise ValueError(f"unsupported search key {key}")
+
+    def search(self, args, by_uid):
+        if args and str(args[0]).upper() == 'CHARSET':
+            args = args[2:]
+
+        test = self.matcher(list(args))
+        found = [str(m.uid if by_uid else i + 1) for i, m in enumerate(self.folder or []) if test(m)]
+
+        self.send(('* SEARCH ' + ' '.join(found)).rstrip().encode() + b'\r\n')
+
+    def fetch(self, message_set, items, by_uid):
+        if not isinstance(items, list):
+            items = [items]
+
+        items = [item.upper() if isinstance(item, str) else item for item in items]
+        if by_uid and 'UID' not in items:
+            items = ['UID'] + items
+
+        folder = self.folder or []
+        largest = (folder[-1].uid if by_uid else len(folder)) if folder else 0
+        wanted = parse_set(message_set, largest)
+
+        for i, m in enumerate(folder):
+            if not wanted(m.uid if by_uid else i + 1):
+                continue
+
+            response = f'* {i + 1} FETCH ('.encode()
+            parts = []
+
+            for item in items:
+                if not isinstance(item, list):
+                    parts.append(self.fetch_item(m, item))
+
+            response += b' '.join(parts) + b')\r\n'
+            self.send(response)
+
+    def fetch_item(self, m, item):
+        if item == 'UID':
+            return f'UID {m.uid}'.encode()
+        if item == 'RFC822.SIZE':
+            return f'RFC822.SIZE {len(m.raw)}'.encode()
+        if item in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+            name = 'RFC822' if item == 'RFC822' else 'BODY[]'
+            self.server.stats.add(messages_sent=1)
+            return f'{name} {{{len(m.raw)}}}\r\n'.encode() + m.raw
+        if item.startswith('BODY.PEEK[HEADER.FIELDS') or item.startswith('BODY[HEADER.FIELDS'):
+            names = re.findall(r'[\w-]+', item.split('(', 1)[1]) if '(' in item else []
+            data = header_fields(m.raw, names)
+            name = 'BODY[HEADER.FIELDS (' + ' '.join(names) + ')]'
+            return f'{name} {{{len(data)}}}\r\n'.encode() + data
+        if item in ('BODY.PEEK[HEADER]', 'BODY[HEADER]', 'RFC822.HEADER'):
+            data = m.raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+            return f'BODY[HEADER] {{{len(data)}}}\r\n'.encode() + data
+        if item == 'BODYSTRUCTURE':
+            return f'BODYSTRUCTURE {body_structure(m.message)}'.encode()
+
+        partial = re.match(r'BODY(?:\.PEEK)?\[\]<(\d+)\.(\d+)>$', item)
+        if partial:
+            start, count = int(partial.group(1)), int(partial.group(2))
+            data = m.raw[start:start + count]
+            if start + count >= len(m.raw):
+                self.server.stats.add(messages_sent=1)
+            return f'BODY[]<{start}> {{{len(data)}}}\r\n'.encode() + data
+
+        section = re.match(r'BODY(?:\.PEEK)?\[([\d.]+)\]$', item)
+        if section:
+            data = section_body(m.message, section.group(1))
+            return f'BODY[{section.group(1)}] {{{len(data)}}}\r\n'.encode() + data
+
+        raise ValueError(f"unsupported fetch item {item}")
+
+class Server(socketserver.ThreadingTCPServer):
+    """
+    The stand-in server, only ever listening on the loopback interface.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox, latency=0.0, port=0, bandwidth=0, compress=True):
+        """
+        Args:
+            mailbox: The Mailbox to serve
+            latency: Seconds to wait before answering each command
+            port: The port to listen on, 0 for any free one
+            bandwidth: Bytes per second sent to each client, 0 for no limit
+            compress: True to offer COMPRESS=DEFLATE
+        """
+
+        super().__init__(('127.0.0.1', port), Handler)
+        self.mailbox = mailbox
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.compress = compress
+        self.stats = Stats()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,311 @@
+import fnmatch
+import logging
+import re
+import uuid
+
+import imap_utils
+
+FETCH_STRUCTURE = '(BODYSTRUCTURE BODY.PEEK[HEADER])'
+
+TEXT_PLAIN = 'text/plain'
+TEXT_HTML = 'text/html'
+MESSAGE_RFC822 = 'message/rfc822'
+ATTACHMENT = 'attachment'
+BASE64 = 'base64'
+
+# marks a part that wasn't downloaded, its value is the size in bytes
+SKIPPED_HEADER = 'X-Email-Md-Skipped'
+
+# the header fields replaced by the ones for the rebuilt message
+MIME_HEADER_PATTERN = re.compile(rb'^(content-type|content-transfer-encoding|mime-version)\s*:', re.IGNORECASE)
+
+class Part:
+    """
+    One leaf of the MIME tree of a message, from its BODYSTRUCTURE.
+    """
+
+    def __init__(self, section, content_type, params, encoding, size,
+                 disposition="", disposition_params=None):
+        self.section = section
+        self.content_type = content_type
+        self.params = params
+        self.encoding = encoding
+        self.size = size
+        self.disposition = disposition
+        self.disposition_params = disposition_params or {}
+
+    @property
+    def filename(self):
+        return self.disposition_params.get('filename') or self.params.get('name') or ""
+
+    # The size once decoded, base64 takes 4 bytes for every 3
+    @property
+    def decoded_size(self):
+        if self.encoding == BASE64:
+            return self.size * 3 // 4
+        return self.size
+
+    def is_attachment(self):
+        return self.disposition == ATTACHMENT
+
+def to_dict(values):
+    """
+    Turn a BODYSTRUCTURE parameter list e.g. ["CHARSET", "utf-8"] into a
+    dict with lower case keys.
+    """
+
+    result = {}
+
+    if isinstance(values, list):
+        for i in range(0, len(values) - 1, 2):
+            value = values[i + 1]
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', 'replace')
+            result[str(values[i]).lower()] = value if value is not None else ""
+
+    return result
+
+def to_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return (value or "").lower()
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+# Find the leaf parts of a message from its BODYSTRUCTURE
+def parse(structure, section=""):
+    """
+    Walk a parsed BODYSTRUCTURE and list its leaf parts with the section
+    number to fetch each one with e.g. "1" or "2.1". A forwarded message
+    (message/rfc822) is a leaf, it's kept or skipped as a whole.
+
+    Args:
+        structure: The BODYSTRUCTURE as nested lists from imap_utils
+        section: The section of this part, "" for the whole message
+
+    Returns:
+        list: The Part objects
+    """
+
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    # a multipart has its parts first, then its subtype
+    if isinstance(structure[0], list):
+        parts = []
+        number = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            number += 1
+            parts += parse(child, f"{section}.{number}" if section else str(number))
+        return parts
+
+    content_type = f"{to_text(structure[0])}/{to_text(structure[1] if len(structure) > 1 else '')}"
+
+    # after the basic fields, text parts have a line count and forwarded
+    # messages have the envelope, structure and line count
+    if content_type.startswith('text/'):
+        extension = 8
+    elif content_type == MESSAGE_RFC822:
+        extension = 10
+    else:
+        extension = 7
+
+    disposition = ""
+    disposition_params = {}
+    if len(structure) > extension + 1 and isinstance(structure[extension + 1], list):
+        fields = structure[extension + 1]
+        disposition = to_text(fields[0]) if fields else ""
+        disposition_params = to_dict(fields[1]) if len(fields) > 1 else {}
+
+    return [Part(section or "1", content_type,
+        to_dict(structure[2]) if len(structure) > 2 else {},
+        to_text(structure[5]) if len(structure) > 5 else "",
+        to_int(structure[6]) if len(structure) > 6 else 0,
+        disposition, disposition_params)]
+
+# Check an attachment against the type and size filters
+def is_wanted(content_type, size, types, max_bytes):
+    """
+    Args:
+        content_type: The MIME type e.g. "image/png"
+        size: The size in bytes
+        types: MIME type patterns to keep e.g. ["image/*"], empty for all
+        max_bytes: The largest to keep, 0 for no limit
+
+    Returns:
+        bool: True if the attachment should be kept
+    """
+
+    if max_bytes and size > max_bytes:
+        return False
+
+    if types and not any(fnmatch.fnmatch(content_type, pattern) for pattern in types):
+        return False
+
+    return True
+
+# Decide which parts to download
+def choose(parts, types, max_bytes):
+    """
+    Pick the parts `parse_multi_part` would use: the first text/plain and
+    text/html bodies, and the attachments that pass the filters. Other
+    parts, e.g. inline images, aren't used so they're left out.
+
+    Args:
+        parts: From `parse`
+        types: MIME type patterns of attachments to keep, empty for all
+        max_bytes: The largest attachment to keep, 0 for no limit
+
+    Returns:
+        tuple: (the Parts to fetch, the attachment Parts to skip)
+    """
+
+    wanted = []
+    skipped = []
+    found = set()
+
+    for part in parts:
+        if part.is_attachment():
+            if is_wanted(part.content_type, part.decoded_size, types, max_bytes):
+                wanted.append(part)
+            else:
+                skipped.append(part)
+        elif part.content_type in (TEXT_PLAIN, TEXT_HTML) and part.content_type not in found:
+            found.add(part.content_type)
+            wanted.append(part)
+
+    return wanted, skipped
+
+def header_value(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def header_params(params):
+    # RFC 2231 values e.g. filename*=utf-8''... aren't quoted
+    return ''.join(f"; {key}={value if key.endswith('*') else header_value(value)}"
+                   for key, value in params.items())
+
+# The MIME header fields of a part, rebuilt from its BODYSTRUCTURE
+def part_header(part):
+    lines = [f"Content-Type: {part.content_type}{header_params(part.params)}"]
+
+    if part.encoding:
+        lines.append(f"Content-Transfer-Encoding: {part.encoding}")
+
+    if part.disposition:
+        lines.append(f"Content-Disposition: {part.disposition}{header_params(part.disposition_params)}")
+
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+# Put the downloaded parts back together into one message
+def assemble(header, fetched, skipped):
+    """
+    Build a multipart/mixed message from the header of the original and
+    the parts that were downloaded, so it can be parsed like any other.
+    Each skipped attachment is an empty part with `SKIPPED_HEADER` set to
+    its size.
+
+    Args:
+        header: The header of the original message, from BODY[HEADER]
+        fetched: List of (Part, body bytes)
+        skipped: The Parts not downloaded
+
+    Returns:
+        bytes: The message
+    """
+
+    boundary = f"email_md_{uuid.uuid4().hex}".encode()
+
+    kept = []
+    dropping = False
+
+    # drop the original MIME fields and their continuation lines
+    for line in header.rstrip(b'\r\n').split(b'\r\n'):
+        if line[:1] in (b' ', b'\t'):
+            if not dropping:
+                kept.append(line)
+            continue
+        dropping = bool(MIME_HEADER_PATTERN.match(line))
+        if not dropping:
+            kept.append(line)
+
+    kept.append(b'MIME-Version: 1.0')
+    kept.append(b'Content-Type: multipart/mixed; boundary="' + boundary + b'"')
+
+    result = [b'\r\n'.join(kept), b'\r\n\r\n']
+
+    for part, body in fetched:
+        result += [b'--', boundary, b'\r\n', part_header(part), b'\r\n', body, b'\r\n']
+
+    for part in skipped:
+        result += [b'--', boundary, b'\r\n', part_header(part),
+                   f"{SKIPPED_HEADER}: {part.decoded_size}\r\n\r\n".encode(), b'\r\n']
+
+    result += [b'--', boundary, b'--\r\n']
+
+    return b''.join(result)
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if value is None:
+        return b''
+    return str(value).encode('utf-8')
+
+# Download only the parts of the messages that are needed
+def fetch_messages(imap, uids, types, max_bytes):
+    """
+    Fetch a batch of messages part by part: first the BODYSTRUCTURE and
+    header of each, then only the text bodies and the attachments that
+    pass the filters. Messages that need the same sections are fetched
+    together, so a batch takes only a few round trips.
+
+    Args:
+        imap: The IMAP connection
+        uids: The UIDs in the batch
+        types: MIME type patterns of attachments to keep, empty for all
+        max_bytes: The largest attachment to keep, 0 for no limit
+
+    Returns:
+        tuple: (dict of (envelope, message bytes) keyed by UID like
+                `imap_utils.fetch_batch`, bytes of attachments not
+                downloaded)
+    """
+
+    responses = {}
+    avoided = 0
+    plans = {}
+
+    structures = imap_utils.fetch_items(imap, uids, FETCH_STRUCTURE)
+
+    # group the messages by the sections they need
+    for uid in uids:
+        items = structures.get(uid)
+        if not items:
+            continue
+
+        wanted, skipped = choose(parse(items.get('BODYSTRUCTURE')), types, max_bytes)
+        avoided += sum(part.size for part in skipped)
+        sections = tuple(part.section for part in wanted)
+        plans.setdefault(sections, []).append((uid, to_bytes(items.get('BODY[HEADER]')), wanted, skipped))
+
+    for sections, messages in plans.items():
+        bodies = {}
+        if sections:
+            request = '(' + ' '.join(f"BODY.PEEK[{section}]" for section in sections) + ')'
+            bodies = imap_utils.fetch_items(imap, [uid for uid, header, wanted, skipped in messages], request)
+
+        for uid, header, wanted, skipped in messages:
+            if sections and uid not in bodies:
+                logging.error(f"fetch_messages: no parts for UID {uid}")
+                continue
+
+            fetched = [(part, to_bytes(bodies[uid].get(f"BODY[{part.section}]"))) for part in wanted]
+            responses[uid] = (b'UID ' + uid, assemble(header, fetched, skipped))
+
+    return responses, avoided
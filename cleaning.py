@@ -0,0 +1,457 @@
+import logging
+import re
+import time
+
+class Rule:
+    """
+    One step in cleaning up the body of an email. Keeps track of how often
+    it changed something and how long it took so the rules that aren't
+    worth their cost can be found and turned off.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = True
+        self.calls = 0
+        self.hits = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    # Apply the rule, returning the new text and the number of changes
+    def run(self, text):
+        return text, 0
+
+    def apply(self, text):
+        """
+        Apply the rule to the text, recording the stats. Errors are counted
+        and the text is returned unchanged.
+
+        Args:
+            text: The text to clean
+
+        Returns:
+            tuple: (the cleaned text, True if there was no error)
+        """
+
+        ok = True
+        start = time.perf_counter()
+
+        try:
+            text, hits = self.run(text)
+            self.hits += hits
+        except Exception as e:
+            self.errors += 1
+            ok = False
+
+        self.calls += 1
+        self.seconds += time.perf_counter() - start
+
+        return text, ok
+
+    def reset(self):
+        self.calls = 0
+        self.hits = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+class Replace(Rule):
+    """
+    Replace literal strings, one pair after another.
+    """
+
+    def __init__(self, name, pairs):
+        super().__init__(name)
+        self.pairs = pairs
+
+    def run(self, text):
+        hits = 0
+
+        for old, new in self.pairs:
+            count = text.count(old)
+            if count:
+                hits += count
+                text = text.replace(old, new)
+
+        return text, hits
+
+class Sub(Rule):
+    """
+    Replace the matches of a regular expression, compiled once when the
+    rule is created.
+
+    `requires` are literal strings that every match contains, e.g. the
+    name of the provider in a block of boilerplate. When the text doesn't
+    contain all of them, the regular expression isn't run at all.
+    """
+
+    def __init__(self, name, pattern, replacement, flags=0, requires=()):
+        super().__init__(name)
+        self.replacement = replacement
+        self.requires = requires
+
+        # a pattern Python can't compile (e.g. a variable width look-behind)
+        # never changed anything, so keep it as a no-op
+        try:
+            self.pattern = re.compile(pattern, flags)
+        except re.error as e:
+            logging.debug(f"Sub: {name} can't be compiled, skipping it. Error {e}")
+            self.pattern = None
+            self.enabled = False
+
+    def run(self, text):
+        for literal in self.requires:
+            if literal not in text:
+                return text, 0
+
+        return self.pattern.subn(self.replacement, text)
+
+class Between(Rule):
+    """
+    Replace everything from `start` to the next `end`, like the regular
+    expression `start.*?end` with DOTALL, or `start.*?inside.*?end`.
+
+    Python's `re` tries a pattern like that at every `start` in the text
+    and looks for `end` all the way to the end of the text each time, so a
+    long body with many of them and no `end` takes time in proportion to
+    the square of its length. Here each one is only looked for once.
+    """
+
+    def __init__(self, name, start, end, replacement='', inside='', flags=0):
+        """
+        Args:
+            name: The rule name
+            start: Literal text where a match starts
+            end: Regular expression where it ends e.g. `\\*+` for a run of
+                 asterisks
+            replacement: Text to put in place of the match, or a function
+                         given the matched text that returns it
+            inside: Literal text that must come between `start` and `end`
+            flags: The flags for `end`
+        """
+
+        super().__init__(name)
+        self.start = start
+        self.end = re.compile(end, flags)
+        self.replacement = replacement
+        self.inside = inside
+
+    def run(self, text):
+        parts = []
+        position = 0
+        hits = 0
+
+        while True:
+            start = text.find(self.start, position)
+            if start < 0:
+                break
+
+            # if the first `start` has no `inside` or `end` after it, none do
+            after = start + len(self.start)
+            if self.inside:
+                after = text.find(self.inside, after)
+                if after < 0:
+                    break
+                after += len(self.inside)
+
+            end = self.end.search(text, after)
+            if not end:
+                break
+
+            found = text[start:end.end()]
+            parts.append(text[position:start])
+            parts.append(self.replacement(found) if callable(self.replacement) else self.replacement)
+            position = end.end()
+            hits += 1
+
+        if not hits:
+            return text, 0
+
+        parts.append(text[position:])
+
+        return ''.join(parts), hits
+
+class Anchored(Rule):
+    """
+    Replace a phrase along with the run of e.g. spaces and dashes around
+    it, like the regular expression `before + anchor + after`.
+
+    Python's `re` tries a pattern starting with something like `\\s*` at
+    every character of a long run of spaces and goes over the rest of the
+    run each time, and two of them in a row (`\\s*-{0,3}\\s*`) is far worse.
+    Here `anchor + after` is searched for and `before` is matched backwards
+    from it, so it takes time in proportion to the length of the text.
+    """
+
+    def __init__(self, name, anchor, replacement, before='', after='', flags=0):
+        """
+        Args:
+            name: The rule name
+            anchor: Regular expression for the phrase, `before` must not be
+                    able to match its first character
+            replacement: Text to put in place of the match
+            before: Regular expression for what comes before the anchor,
+                    written backwards e.g. `\\s*-*` for `-*\\s*`. It's
+                    matched as far back as it can go
+            after: Regular expression for what comes after the anchor
+            flags: The flags for all of the regular expressions
+        """
+
+        super().__init__(name)
+        self.pattern = re.compile(anchor + after, flags)
+        self.before = re.compile(before, flags)
+        self.replacement = replacement
+
+    def run(self, text):
+        parts = []
+        position = 0
+        hits = 0
+        backwards = None
+        length = len(text)
+
+        for match in self.pattern.finditer(text):
+            if backwards is None:
+                backwards = text[::-1]
+
+            # the end of the match in the reversed text is where it starts
+            start = length - self.before.match(backwards, length - match.start(), length - position).end()
+
+            parts.append(text[position:start])
+            parts.append(self.replacement)
+            position = match.end()
+            hits += 1
+
+        if not hits:
+            return text, 0
+
+        parts.append(text[position:])
+
+        return ''.join(parts), hits
+
+class Call(Rule):
+    """
+    Run a function on the text. Counts a hit whenever the text changed.
+    """
+
+    def __init__(self, name, function):
+        super().__init__(name)
+        self.function = function
+
+    def run(self, text):
+        result = self.function(text)
+        return result, int(result != text)
+
+class LineFilter:
+    """
+    Removes the lines matching any of a set of patterns, like the ads that
+    Yahoo! and other providers added to the bottom of emails.
+
+    Nearly all lines contain none of the words the patterns look for, so
+    each line is first checked with one combined search for the `keywords`
+    and only the lines with a keyword are checked against `patterns`. 
+    Every match of every pattern must contain at least one of the keywords.
+    The `always` patterns don't have a keyword and are checked on every 
+    line so they should be cheap e.g. anchored.
+    """
+
+    def __init__(self, keywords, patterns, always=(), flags=re.IGNORECASE):
+        """
+        Args:
+            keywords: Literal words, at least one is in every match
+            patterns: Each a regular expression or a tuple of them that must
+                      all be found in the line
+            always: Regular expressions checked on every line
+            flags: The flags for all of the regular expressions
+        """
+
+        self.prefilter = re.compile('|'.join(re.escape(keyword) for keyword in keywords), flags)
+        self.patterns = [self.compile(pattern, flags) for pattern in patterns]
+        self.always = [self.compile(pattern, flags) for pattern in always]
+
+    @staticmethod
+    def compile(pattern, flags):
+        if isinstance(pattern, str):
+            pattern = (pattern,)
+
+        return [re.compile(part, flags) for part in pattern]
+
+    @staticmethod
+    def matches(line, patterns):
+        for parts in patterns:
+            if all(part.search(line) for part in parts):
+                return True
+
+        return False
+
+    def filter(self, text):
+        """
+        Remove the matching lines.
+
+        Args:
+            text: The text to filter
+
+        Returns:
+            tuple: (the text without the matching lines, number removed)
+        """
+
+        lines = []
+        removed = 0
+        search = self.prefilter.search
+
+        for line in text.split('\n'):
+            if (self.always and self.matches(line, self.always)) or \
+               (search(line) and self.matches(line, self.patterns)):
+                removed += 1
+            else:
+                lines.append(line)
+
+        return '\n'.join(lines), removed
+
+class RuleSet:
+    """
+    An ordered table of rules applied one after the other.
+
+    The `fallback` rules are the least that has to be done to a body, e.g.
+    turning HTML into Markdown. When the rules take longer than the time
+    allowed for a body, only those are applied to the rest of it.
+
+    In a worker process, `start_forwarding` makes `take` hand back the stats
+    counted since it was last called so the parent process can `merge` them.
+    """
+
+    def __init__(self, rules, fallback=()):
+        self.rules = rules
+        self.by_name = {rule.name: rule for rule in rules}
+        self.fallback = set(fallback)
+        self.forwarding = False
+
+    def apply(self, text, budget=0):
+        """
+        Apply all of the enabled rules in order.
+
+        A rule can't be stopped part way through so the time is checked
+        between rules, once it's up the rest are skipped except for the
+        `fallback` ones.
+
+        Args:
+            text: The text to clean
+            budget: The most seconds to spend on it, 0 for no limit
+
+        Returns:
+            tuple: (the cleaned text, list of the names of rules that failed,
+                   list of the names of rules skipped for lack of time)
+        """
+
+        failed = []
+        skipped = []
+        deadline = time.perf_counter() + budget if budget else None
+
+        for rule in self.rules:
+            if not rule.enabled:
+                continue
+
+            if deadline and rule.name not in self.fallback and time.perf_counter() > deadline:
+                skipped.append(rule.name)
+                continue
+
+            text, ok = rule.apply(text)
+            if not ok:
+                failed.append(rule.name)
+
+        return text, failed, skipped
+
+    # Turn rules on or off by name
+    def set_enabled(self, names, enabled):
+        """
+        Turn rules on or off.
+
+        Args:
+            names: The rule names
+            enabled: True to turn them on, False to turn them off
+
+        Returns:
+            list: The names that don't match any rule
+        """
+
+        unknown = []
+
+        for name in names:
+            rule = self.by_name.get(name)
+            if rule:
+                rule.enabled = enabled
+            else:
+                unknown.append(name)
+
+        return unknown
+
+    def reset(self):
+        for rule in self.rules:
+            rule.reset()
+
+    def start_forwarding(self):
+        self.forwarding = True
+        self.reset()
+
+    # Get the stats waiting to go to the parent process
+    def take(self):
+        """
+        Returns:
+            dict: (calls, hits, errors, seconds) keyed by the name of each 
+                  rule run since the last time, empty if not forwarding
+        """
+
+        taken = {}
+
+        if not self.forwarding:
+            return taken
+
+        for rule in self.rules:
+            if rule.calls:
+                taken[rule.name] = (rule.calls, rule.hits, rule.errors, rule.seconds)
+                rule.reset()
+
+        return taken
+
+    # Add the stats from a worker process
+    def merge(self, taken):
+        for name, (calls, hits, errors, seconds) in taken.items():
+            rule = self.by_name.get(name)
+            if rule:
+                rule.calls += calls
+                rule.hits += hits
+                rule.errors += errors
+                rule.seconds += seconds
+
+    def stats(self):
+        """
+        Get the stats of each rule, in the order they're applied.
+
+        Returns:
+            list: A dict per rule with the name, enabled, calls, hits,
+                  errors and seconds
+        """
+
+        return [{
+            "name": rule.name,
+            "enabled": rule.enabled,
+            "calls": rule.calls,
+            "hits": rule.hits,
+            "errors": rule.errors,
+            "seconds": round(rule.seconds, 6),
+        } for rule in self.rules]
+
+    def report(self):
+        """
+        Describe the stats of each rule, slowest first.
+
+        Returns:
+            str: One line per rule
+        """
+
+        lines = []
+
+        for rule in sorted(self.stats(), key=lambda r: r["seconds"], reverse=True):
+            state = "" if rule["enabled"] else " (off)"
+            lines.append(f"{rule['name']}{state}: {rule['seconds']:.3f}s  "
+                         f"calls: {rule['calls']}  hits: {rule['hits']}  errors: {rule['errors']}")
+
+        return '\n'.join(lines)
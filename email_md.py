@@ -1,22 +1,36 @@
 ﻿import imaplib
 import email
-from email.header import decode_header
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
 import webbrowser
 import os
 import re
 from dateutil import parser
-from email.utils import getaddresses
+from email.utils import getaddresses, parsedate_to_datetime
 
 import markdownify
-from markdownify import markdownify as md
 
 import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import json
 import csv
 from datetime import datetime, timezone
 import tzlocal 
 
 import sys
+import collections
+import itertools
+import shutil
+import tempfile
+
+# not on Windows, only used to report memory in debug mode
+try:
+    import resource
+except ImportError:
+    resource = None
 sys.path.insert(1, '../../github/message_md/') 
 import message_md
 import config
@@ -25,11 +39,35 @@ import message
 import person
 import attachment
 
+import email_settings
+import imap_utils
+import sync_state
+import stream_writer
+import cleaning
+import sources
+import metrics
+import media_store
+import body_structure
+import people_index
+import message_ids
+import replies
+import journal
+import imap_compress
+import message_cache
+import large_message
+
 import logging
 
 import warnings
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning 
 
+# use the fastest parser that's installed
+try:
+    import lxml
+    BS4_PARSER = 'lxml'
+except ImportError:
+    BS4_PARSER = 'html.parser'
+
 INBOX = "INBOX"
 SENT = "SENT"
 
@@ -40,12 +78,66 @@ HEADER_MESSAGE_ID = 'Message-ID'
 HEADER_FROM = 'From'
 HEADER_REFERENCES = 'References'
 HEADER_IN_REPLY_TO = 'In-Reply-To'
+HEADER_SUBJECT = 'Subject'
+
+# the header ends at the first empty line
+HEADER_END_PATTERN = re.compile(rb'\r?\n\r?\n')
+HEADER_PARSER = BytesHeaderParser()
+
+# a line break followed by a space or tab continues the header field
+FOLDING_PATTERN = re.compile(r'\r?\n(?=[ \t])')
 
 ATTACHMENT = 'attachment'
 CONTENT_DISPOSITION = 'Content-Disposition'
 CONTENT_TYPE_TEXT_PLAIN = 'text/plain'
+CONTENT_TYPE_TEXT_HTML = 'text/html'
+
+# plain text parts shorter than this are checked for being a placeholder
+PLACEHOLDER_MAX_LENGTH = 300
+PLACEHOLDER_PATTERN = re.compile(r'html|(view|read|open) (it|this( email| message)?) (in|on|with) (a|your) (web )?browser', re.IGNORECASE)
+
+# tags that show a body still has HTML in it
+HTML_TAG_PATTERN = re.compile(r'</?(?:html|head|body|div|p|br|span|table|tbody|tr|td|th|a|b|i|u|em|strong|img|font|style|ul|ol|li|blockquote|hr|h[1-6])\b[^<>]*>', re.IGNORECASE)
+
+CLEAN_RULE_MARKDOWNIFY = 'markdownify'
+
+MB = 1024 * 1024
+
+email_not_found = collections.Counter()
+
+# guards the shared list of messages when fetching folders in parallel
+messages_lock = threading.Lock()
+
+# the processes parsing and cleaning the emails, if `workers` is set
+parse_pool = None
+
+# the number of messages kept so far, for `max_messages`
+messages_found = 0
+
+# the folders that weren't fetched in full because a fetch failed
+failed_folders = []
+
+# set once every folder was fetched without an error, so the journal isn't 
+# needed any more
+fetch_complete = False
+
+# writes the messages as they're parsed, if `stream` is set
+the_stream = None
+
+# how long each stage takes, for the `metrics-file`
+METRICS = metrics.Metrics()
 
-email_not_found = []
+# the emails already processed, to skip their copies in other folders
+MESSAGE_IDS = message_ids.MessageIds()
+
+# what's kept between runs, not connected until they're opened. `__main__`
+# puts them in the config folder
+the_sync_state = sync_state.SyncState("")
+the_cache = message_cache.MessageCache("", 0)
+the_journal = journal.Journal("", 0)
+
+# the sets of `OR FROM` search keys, if `search_senders` is set
+sender_search = []
 
 # attribution to https://thepythoncode.com/article/reading-emails-in-python
 
@@ -53,6 +145,9 @@ email_not_found = []
 # or check this page: https://www.systoolsgroup.com/imap/
 # use `i <imapServer>`
 
+# regular expression pattern for extracting email addresses
+EMAIL_ADDRESS_PATTERN = re.compile(r'[\w\.+-]+@[\w\.-]+')
+
 # Parse email addresses from text string, returning first found address in lowercase
 def get_email_address(text):
     """
@@ -68,11 +163,8 @@ def get_email_address(text):
     if not isinstance(text, str):
         return text
 
-    # regular expression pattern for extracting email addresses
-    email_pattern = r'[\w\.-]+@[\w\.-]+'
-
     # Use the findall method to extract email addresses from the text
-    email_addresses = re.findall(email_pattern, text)
+    email_addresses = EMAIL_ADDRESS_PATTERN.findall(text)
 
     if email_addresses: 
         result = email_addresses[0].lower()  # convert to lowercase
@@ -81,6 +173,16 @@ def get_email_address(text):
 
     return result
 
+REPLY_PATTERNS = [
+    re.compile(pattern_expression, re.MULTILINE | re.DOTALL | re.IGNORECASE)  # match across multiple lines, ignore case, and treat ^ and $ as the start/end of each line
+    for pattern_expression in [
+        r'\\_\\_\\_\\_' # matches \\_\\_\\_\\_
+    ]
+]
+
+# HTML comments, e.g. <!-- ... -->
+HTML_COMMENTS = cleaning.Between("html-comments", "<!--", re.escape("-->"))
+
 # Remove quoted replies and other unnecessary text from email body
 def remove_reply(text):
     """
@@ -98,27 +200,106 @@ def remove_reply(text):
         Cleaned text with quotes and unnecessary content removed
     """
 
-    result = text
+    # the replied-to part, starting at "On ... wrote:", the "From:" lines, etc.
+    result = replies.cut(text)
 
-    patterns = [
-        r'^On\s.*?wrote:.*$', # match "On <date/time> <person> wrote:"
-        r'Le mer\.|a écrit\s*:' # match "Le mer. <date/time> <person> écrit :"
-        r'(?:\*\*From:\*\*|From:).*',  # match "From:" line (with/out asterisks) and everything 
-        r'<!--.*?-->',  # matches <!-- ... -->
-        r'\\_\\_\\_\\_' # matches \\_\\_\\_\\_
-    ]
+    result = HTML_COMMENTS.run(result)[0]
 
-    for pattern_expression in patterns:
-        pattern = re.compile(pattern_expression, re.MULTILINE | re.DOTALL | re.IGNORECASE)  # match across multiple lines, ignore case, and treat ^ and $ as the start/end of each line
-        # search for the replied-to part, the "From:" line, or comments
+    for pattern in REPLY_PATTERNS:
         result = pattern.sub('', result)
 
-        return result.strip()
+    return result.strip()
 
-    return result
+# Parse just the header of a raw email
+def read_header(raw):
+    """
+    Parse only the header of an email, which is all that's needed to
+    decide if it's wanted, without going through the body and its parts.
+
+    Args:
+        raw: The email, or just its header, as bytes
+
+    Returns:
+        email.message.Message: The header fields, with no body
+    """
+
+    end = HEADER_END_PATTERN.search(raw)
+
+    return HEADER_PARSER.parsebytes(raw[:end.end()] if end else raw)
+
+# Decode all of the encoded-words in a header field
+def decode_header_value(value):
+    """
+    Decode a header field like a Subject or From with any number of 
+    encoded-words, e.g. "=?utf-8?q?Caf=C3=A9?= =?iso-8859-1?q?cr=E8me?=", 
+    possibly in different character sets and mixed with plain text. 
+    Folded lines are joined back together.
+
+    Args:
+        value: The header field as returned by the email package, or None
+
+    Returns:
+        str: The decoded text, "" if there is no such field
+    """
+
+    if value is None:
+        return ""
+
+    if isinstance(value, str):
+        value = FOLDING_PATTERN.sub('', value)
+
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception as e:
+        pass
+
+    # an unknown or wrong character set, keep what can be decoded
+    result = []
+
+    try:
+        for text, charset in decode_header(value):
+            if isinstance(text, bytes):
+                try:
+                    text = text.decode(charset or 'ascii', 'replace')
+                except LookupError:
+                    text = text.decode('utf-8', 'replace')
+            result.append(text)
+    except Exception as e:
+        return str(value)
+
+    return ''.join(result)
+
+# Parse the Date header field
+def parse_date(date_header):
+    """
+    Parse a Date header. Nearly all are in the RFC 5322 format which the
+    standard library parses quickly, dateutil is only used for the rest.
+
+    Args:
+        date_header: e.g. "Mon, 9 Oct 2023 13:06:00 -0400 (EDT)"
+
+    Returns:
+        datetime: The date and time in the time zone given in the header
+
+    Raises:
+        ValueError or OverflowError if it isn't a date
+    """
+
+    # remove extra info after tz offset
+    date_header = str(date_header).split(' (', 1)[0]
+
+    # without a time zone it's taken as local time, like dateutil does
+    try:
+        parsed_date = parsedate_to_datetime(date_header)
+        if parsed_date.tzinfo is not None:
+            return parsed_date
+    except (TypeError, ValueError, IndexError) as e:
+        pass
+
+    return parser.parse(date_header)
 
 # Parse email addresses from header and add them to Message object
-def parse_addresses(the_email, the_message, direction):
+def parse_addresses(the_email, the_message, direction, not_found=None):
     """
     Parse the email addresses from email into a Message object.
 
@@ -126,6 +307,7 @@ def parse_addresses(the_email, the_message, direction):
         the_email: The actual email
         the_message: Where the parsed email message goes
         direction: FROM, TO, or CC
+        not_found: Counter of the unknown addresses, `email_not_found` if None
 
     Returns:
         bool: True if person was found and email was added to them,
@@ -134,6 +316,9 @@ def parse_addresses(the_email, the_message, direction):
     
     result = False
 
+    if not_found is None:
+        not_found = email_not_found
+
     to_from_cc_header = the_email.get(direction)
 
     if to_from_cc_header:
@@ -148,49 +333,37 @@ def parse_addresses(the_email, the_message, direction):
 
         for email_address in the_message.to_emails:
             try: 
-                person = the_config.get_person_by_email(email_address.lower())
+                person = the_people.find(email_address)
                 # if we found someone and not ignoring them e.g. a mailing list
                 if person and not person.ignore:
                     if person.slug not in the_message.to_slugs and person.slug not in the_message.from_slug:
                         the_message.to_slugs.append(person.slug)
                         result = True
                 elif not person:
-                    email_not_found.append(email_address)
+                    not_found[the_people.normalize(email_address)] += 1
             except Exception as e:
                 logging.error(f"{the_config.get_str(the_config.STR_NO_PERSON_WITH_EMAIL)}: {email_address}. Error {e}")
 
     return result
 
 # Extract and parse email header fields into Message object
-def parse_header(the_email, the_message):
+def parse_header(the_email, the_message, not_found=None):
     """
     Parse the header of the email into a Message object.
 
     Args:
         the_email: The actual email
         the_message: Where the parsed email message goes
+        not_found: Counter of the unknown addresses, `email_not_found` if None
 
     Returns:
         bool: True if parsed successfully, False if ran into an issue
     """
 
     result = True   # assume success
-    subject = ""
 
     # decode the email subject
-    try:
-        subject, encoding = decode_header(the_email["Subject"])[0]
-    except Exception as e:
-        return False
-    
-    if encoding and isinstance(subject, bytes):
-        try:
-            # if it's a bytes, decode to str
-            subject = subject.decode(encoding)
-        except:
-            return False
-    
-    the_message.subject = subject
+    the_message.subject = decode_header_value(the_email.get(HEADER_SUBJECT))
 
     # get the funky IMAP id of the message
     the_message.id = the_email.get(HEADER_MESSAGE_ID)
@@ -198,11 +371,9 @@ def parse_header(the_email, the_message):
     # get the date from the header
     date_header = the_email.get(HEADER_DATE)
 
-    # remove extra info after tz offset
     if date_header:
         try:
-            date_header = date_header.split(' (', 1)[0]
-            parsed_date = parser.parse(date_header)
+            parsed_date = parse_date(date_header)
 
             # format the date and time
             date_str = parsed_date.strftime('%Y-%m-%d')
@@ -215,35 +386,90 @@ def parse_header(the_email, the_message):
             return False
     
     # get the to and cc email addresses
-    result = parse_addresses(the_email, the_message, HEADER_TO)
-    parse_addresses(the_email, the_message, HEADER_CC)
+    result = parse_addresses(the_email, the_message, HEADER_TO, not_found)
+    parse_addresses(the_email, the_message, HEADER_CC, not_found)
 
     # decode email sender
-    the_from, encoding = decode_header(the_email.get(HEADER_FROM))[0]
-    if encoding and isinstance(the_from, bytes):
-        try:
-            the_from = the_from.decode(encoding)
-        except:
-            pass
+    the_from = decode_header_value(the_email.get(HEADER_FROM))
 
+    email_addresses = None
     if the_from:
         email_addresses = get_email_address(the_from)
 
     # get the `slug` of the sender
-    person = the_config.get_person_by_email(email_addresses)
+    person = the_people.find(email_addresses) if email_addresses else None
     if person:
         the_message.from_slug = person.slug
-    else: 
-        pass
+    elif email_addresses:
+        not_found[the_people.normalize(email_addresses)] += 1
 
     return result
 
+# Describe a number of bytes e.g. "1.5 MB"
+def format_size(size):
+    if size >= MB:
+        return f"{size / MB:.1f} MB"
+    return f"{max(1, round(size / 1024))} KB"
+
+# Get the attachment filters from the settings
+def attachment_filters():
+    """
+    Returns:
+        tuple: (list of the MIME type patterns of the attachments to keep,
+                empty for all, the largest in bytes to keep, 0 for any)
+    """
+
+    types = [t.strip().lower() for t in the_settings.attachment_types.split(';') if t.strip()]
+
+    return types, int(the_settings.attachment_max_mb * MB)
+
+# Note an attachment that wasn't saved
+def skip_attachment(part, the_message, size):
+    """
+    Keep the name, type and size of an attachment that was left out by
+    the `attachment-types` or `attachment-max-mb` filters so the Markdown
+    can say it was there.
+
+    Args:
+        part: The part of the email that has the attachment
+        the_message: Where the details go, in `skipped_attachments`
+        size: The size of the attachment in bytes
+
+    Returns:
+        None
+    """
+
+    if not hasattr(the_message, "skipped_attachments"):
+        the_message.skipped_attachments = []
+
+    the_message.skipped_attachments.append({
+        "filename": part.get_filename() or "",
+        "type": part.get_content_type(),
+        "size": size,
+    })
+
+    METRICS.count("attachments_skipped")
+
+# Add a line to the body for each attachment that wasn't saved
+def note_skipped_attachments(the_message):
+    skipped = getattr(the_message, "skipped_attachments", [])
+
+    if skipped:
+        notes = [f"Attachment left out: {a['filename']} ({a['type']}, {format_size(a['size'])})" 
+                 for a in skipped]
+        the_message.body = (the_message.body or "").rstrip() + "\n\n" + "\n".join(notes)
+
 # Save email attachment to disk and add it to Message object
 def download_attachment(part, the_message):
     """
     Download the attachment from the multi-part email and add a corresponding
     Attachment object to the Message object.
 
+    The attachment is saved in the media folder under a name made from a 
+    hash of its contents so the same file sent in many emails is saved
+    once and files that happen to have the same name don't overwrite each
+    other. The Attachment points at the saved file.
+
     Args:
         part: The part of the email that has the attachment
         the_message: Where the Attachment is added
@@ -255,35 +481,147 @@ def download_attachment(part, the_message):
 
     # download the attachment
     if filename:
+        # with `fetch-parts` the attachments left out weren't downloaded
+        skipped_size = part.get(body_structure.SKIPPED_HEADER)
+        if skipped_size is not None:
+            skip_attachment(part, the_message, int(skipped_size or 0))
+            return
+
+        # the parts of a large email are decoded from their files
+        chunks = None
+        if isinstance(part, large_message.SpooledPart):
+            size = part.body_size
+            chunks = large_message.decoded_chunks(part)
+        else:
+            size = len(part.get_payload() or "")
+
+        # otherwise check the filters against the size, roughly, before 
+        # decoding it
+        if str(part.get('Content-Transfer-Encoding', '')).strip().lower() == body_structure.BASE64:
+            size = size * 3 // 4
+
+        types, max_bytes = attachment_filters()
+        if not body_structure.is_wanted(part.get_content_type(), size, types, max_bytes):
+            skip_attachment(part, the_message, size)
+            return
+
         # find the place to put it
         folder = os.path.join(the_config.output_folder, the_config.people_subfolder)
         folder = os.path.join(folder, the_config.media_subfolder)
-        file_path = os.path.join(folder, filename)
-        
-        # if the folder doesn't exist, create it
-        if not os.path.exists(folder):
-            # create the folder
-            os.makedirs(folder)
 
-        try:
-            # download attachment and save it
-            open(file_path, "wb").write(part.get_payload(decode=True))
+        # decode it straight to a file, or find the copy saved before
+        with METRICS.timer("download_attachment") as timer:
+            stored = media_store.save(folder, part, filename, chunks)
+            if stored:
+                timer.size = stored[1]
 
-            # create and fill the Attachment object
-            the_attachment = attachment.Attachment()
-            try:
-                the_attachment.id = filename
-                the_attachment.filename = filename
-                the_attachment.type = the_config.get_mime_type(filename)
-                the_attachment.custom_filename = filename
-                the_message.add_attachment(the_attachment)
-            except Exception as e:
-                logging.error("download_attachment: {e}")
-                pass
+        if not stored:
+            logging.error(f"{the_config.get_str(the_config.STR_COULD_NOT_CREATE_MEDIA_FOLDER)}: {folder}")
+            return
 
+        stored_filename, size, is_new = stored
+        METRICS.count("attachments_saved" if is_new else "attachments_deduplicated")
+
+        # create and fill the Attachment object
+        the_attachment = attachment.Attachment()
+        try:
+            the_attachment.id = filename
+            the_attachment.filename = stored_filename
+            the_attachment.type = the_config.get_mime_type(filename)
+            the_attachment.custom_filename = stored_filename
+            the_message.add_attachment(the_attachment)
         except Exception as e:
-            logging.error("{the_config.get_str(STR_COULD_NOT_CREATE_MEDIA_FOLDER)}: {file_path}") 
-            pass
+            logging.error(f"download_attachment: {e}")
+
+# Convert the body of an email to Markdown
+def to_markdown(text):
+    """
+    Convert an HTML or plain text body to Markdown, parsing it only once 
+    with the fastest BeautifulSoup parser available.
+
+    Args:
+        text: The body
+
+    Returns:
+        str: The body in Markdown
+    """
+
+    soup = BeautifulSoup(text, BS4_PARSER)
+
+    return markdownify.MarkdownConverter().convert_soup(soup)
+
+# Cut off the email being replied to before the body is converted and cleaned
+def cut_reply(text, html=False):
+    """
+    Remove the quoted email a reply ends with, it has a file of its own,
+    unless `cut_replies` is off. Done on the decoded body so the quoted
+    history isn't converted to Markdown and cleaned only to be removed.
+
+    Args:
+        text: The decoded body
+        html: True if it's HTML
+
+    Returns:
+        str: The body without the quoted email
+    """
+
+    if not the_settings.cut_replies:
+        return text
+
+    with METRICS.timer("cut_reply", len(text)):
+        result = replies.cut(text, html)
+
+    if len(result) < len(text):
+        METRICS.count("replies_cut")
+        METRICS.count("reply_chars_cut", len(text) - len(result))
+
+    return result
+
+# Decode the payload of one part of an email into a string
+def decode_part(part):
+    """
+    Decode the payload of a part using its charset, falling back to UTF-8
+    and replacing anything that can't be decoded.
+
+    Args:
+        part: The part of the email
+
+    Returns:
+        str: The decoded text, empty if there is none
+    """
+
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ""
+
+    try:
+        return payload.decode(part.get_content_charset() or 'utf-8')
+    except (LookupError, UnicodeDecodeError):
+        return payload.decode('utf-8', errors='replace')
+
+# Check if the plain text alternative is good enough to use
+def is_adequate_plain_text(text):
+    """
+    Most emails with an HTML part also have a plain text version of it. Use 
+    the plain text unless it's empty or a placeholder telling you to view
+    the HTML version, since converting HTML is the slowest step.
+
+    Args:
+        text: The plain text part
+
+    Returns:
+        bool: True if the plain text can be used instead of the HTML
+    """
+
+    text = text.strip()
+
+    if not text:
+        return False
+
+    if len(text) < PLACEHOLDER_MAX_LENGTH and PLACEHOLDER_PATTERN.search(text):
+        return False
+
+    return True
 
 # Process all parts of a multi-part email message 
 def parse_multi_part(the_email, the_message):
@@ -298,12 +636,31 @@ def parse_multi_part(the_email, the_message):
         None
     """
 
-    the_body = ""
+    parse_parts(the_email.walk(), the_message)
+
+# Save the attachments and get the body from the parts of an email
+def parse_parts(parts, the_message):
+    """
+    Attachments are saved and the body comes from the first text/plain 
+    part or, if that's not adequate, the first text/html part. Only the 
+    chosen part is decoded and converted to Markdown.
+
+    Args:
+        parts: The parts of the email, e.g. from `walk()`
+        the_message: Where the parsed email message goes
+
+    Returns:
+        The part the body came from or None
+    """
+
+    plain_part = None
+    html_part = None
+    plain_text = ""
     content_disposition = ""
     content_type = ""
     
     # iterate over email parts
-    for part in the_email.walk():
+    for part in parts:
 
         # extract content type of email
         try:
@@ -316,15 +673,31 @@ def parse_multi_part(the_email, the_message):
         except:
             pass
 
-        try:
-            the_body = part.get_payload(decode=True).decode()
-            if the_body and content_type == CONTENT_TYPE_TEXT_PLAIN and ATTACHMENT not in content_disposition:
-                the_message.body = md(the_body)
-        except:
-            pass
-
         if ATTACHMENT in content_disposition:
             download_attachment(part, the_message)
+        elif content_type == CONTENT_TYPE_TEXT_PLAIN and not plain_part:
+            try:
+                plain_text = decode_part(part)
+                if is_adequate_plain_text(plain_text):
+                    plain_part = part
+            except:
+                pass
+        elif content_type == CONTENT_TYPE_TEXT_HTML and not html_part:
+            html_part = part
+
+    try:
+        if plain_part:
+            the_message.body = to_markdown(cut_reply(plain_text))
+            return plain_part
+        elif html_part:
+            the_body = decode_part(html_part)
+            if the_body:
+                the_message.body = to_markdown(cut_reply(the_body, html=True))
+            return html_part
+    except:
+        pass
+
+    return None
 
 # Extract and process email body content
 def parse_body(the_email, the_message):
@@ -345,23 +718,40 @@ def parse_body(the_email, the_message):
     if the_email.is_multipart():
         parse_multi_part(the_email, the_message)
     else:
-        # extract the content type of the email
-        content_type = the_email.get_content_type()
-
         # get the email body
         try:
-            the_body = the_email.get_payload(decode=True).decode()
+            the_body = decode_part(the_email)
             if the_body:
-                the_message.body = md(the_body)
+                html = the_email.get_content_type() == CONTENT_TYPE_TEXT_HTML
+                the_message.body = to_markdown(cut_reply(the_body, html))
 
-        # sometimes got errors like this, so ignoring the email
-        # 'utf-8' codec can't decode byte 0x80 in position 8: invalid start byte
+        # sometimes got errors decoding, so ignoring the email
         except Exception as e:
             pass
 
+# Convert whatever HTML is left in the body after cleaning
+def markdownify_remaining_html(text):
+    """
+    The body was already converted to Markdown when it was parsed, so only 
+    convert it again if some HTML is left.
+
+    Args:
+        text: The body
+
+    Returns:
+        str: The body without HTML
+    """
+
+    if HTML_TAG_PATTERN.search(text):
+        return to_markdown(text.strip())
+
+    return text.strip()
+
+EMAIL_HEADER_PATTERN = re.compile(r'^\s*(From:|Sent:|To:|Cc:|Subject:)', re.IGNORECASE)
+
 def is_email_header(line):
     # check if the line resembles an email header
-    return re.match(r'^\s*(From:|Sent:|To:|Cc:|Subject:)', line, re.IGNORECASE) is not None
+    return EMAIL_HEADER_PATTERN.match(line) is not None
 
 # Join lines within paragraphs while preserving email headers
 def join_lines(body):
@@ -378,33 +768,110 @@ def join_lines(body):
     # reassemble lines, preserving paragraph breaks
     lines = body.splitlines()
     paragraphs = []
-    current_paragraph = ''
+    current_paragraph = []
 
     for line in lines:
         if is_email_header(line):
             # if the line resembles an email header, start a new paragraph
             if current_paragraph:
-                paragraphs.append(current_paragraph.strip())
-                current_paragraph = ''
-            paragraphs.append(current_paragraph.strip())
+                paragraphs.append('\n'.join(current_paragraph))
+                current_paragraph = []
+            paragraphs.append('')
         elif line.strip():  # if the line is not empty, add it to the current paragraph
-            current_paragraph += line.strip() + '\n'
-        elif line.strip():  # if the line is not empty
-            current_paragraph += line + ' '
+            current_paragraph.append(line.strip())
         else:  # if the line is empty, it indicates the end of the current paragraph
-            if current_paragraph and not current_paragraph.isspace():
-                paragraphs.append(current_paragraph.strip())
-            current_paragraph = ''
+            if current_paragraph:
+                paragraphs.append('\n'.join(current_paragraph))
+            current_paragraph = []
 
     # add the last paragraph if there's any
     if current_paragraph:
-        paragraphs.append(current_paragraph.strip())
+        paragraphs.append('\n'.join(current_paragraph))
 
     # join lines within each paragraph, excluding email headers
-    body = '\n\n'.join(para for para in paragraphs)
+    body = '\n\n'.join(paragraphs)
 
     return body
 
+# Lines of Yahoo! promotional content. All of them have one of the keywords
+YAHOO_LINES = cleaning.LineFilter(
+    keywords=['yahoo', 'job', 'resume', 'declare', 'register', 'post', 'place',
+              'make', 'on-the-go', 'check', 'fantasy', 'greetings'],
+    patterns=[
+        # lines with Yahoo promotional content
+        (r'yahoo\!?', r'yahoo\.com|platinum|mail\s*plus|sign\s*up|greetings|e-?cards|messages|photos|finance|personals|home\s*page|security|mobile|farechase|travel|autos|beta|discover|sports|small\s*business|spam|search|my\s*yahoo|resources|holiday|video|email|dsl|music'),
+        # "Do you Yahoo!?" lines
+        r'do\s*you\s*yahoo\!?\?',
+        # job and resume related lines
+        r'(find|post)\s*(a)?\s*(job|resume)',
+        # lines about accessing Yahoo services
+        r'(listen|access|check)\s*.*\s*(yahoo\!? (mail|messages))',
+        # lines about Yahoo service features
+        r'(new|more)\s*yahoo\!?\s*(photos|mail)\s*-\s*(easier|better|simpler)',
+        # lines about Yahoo services with specific actions
+        r'yahoo\!?\s*(finance|mail):\s*(get|file|check|track)',
+        # lines highlighting Yahoo service improvements
+        r'(new\s*and\s*improved|improved)\s*yahoo\!?\s*mail\s*-\s*.*\s*(messages|email)',
+        # registration or declaration lines
+        r'(declare\s*yourself|register)\s*.*\s*(online|today)',
+        # ad posting and personal ad lines
+        r'(post|place)\s*(your)?\s*(free)?\s*(ad|personal)',
+        # lines with Yahoo URLs for personals or ads
+        r'http://.*yahoo\.(com|ca)/*(personals|ads)',
+        # lines about setting Yahoo as home page
+        r'(start|begin)\s*your\s*day\s*with\s*yahoo\!?',
+        # lines encouraging making Yahoo home page
+        r'make\s*it\s*your\s*(default\s*)?home\s*page',
+        # lines about Yahoo Mail security
+        r'yahoo\!?\s*mail\s*-\s*(you)\s*care\s*about\s*(security)',
+        # lines about mobile Yahoo Mail
+        r'(take|get)\s*yahoo\!?\s*mail\s*.*\s*(mobile\s*phone|phone)',
+        # lines about Yahoo FareChase or travel services
+        r'yahoo\!?\s*farechase:\s*(search|find)\s*.*\s*(travel\s*sites|sites)',
+        # lines about Yahoo Autos
+        r'(find|search)\s*your\s*next\s*(car|vehicle)\s*at\s*yahoo\!?\s*canada?\s*autos',
+        # lines about Yahoo Mail beta
+        r'(everyone\s*is\s*raving|raving)\s*about\s*.*\s*yahoo\!?\s*mail\s*beta',
+        # "Discover Yahoo!" and similar promotional lines
+        r'(discover\s*yahoo\!?|get\s*on-the-go)\s*.*\s*(scores|quotes|news)',
+        # "Check it out!" type lines
+        r'check\s*it\s*out\!?',
+        # Yahoo Sports fantasy lines
+        r'(rekindle\s*the\s*rivalries|sign\s*up\s*for)\s*.*\s*(fantasy\s*football)',
+        # Yahoo Small Business promotional lines
+        r'have\s*a\s*(huge|big)\s*year\s*through\s*yahoo\!?\s*small\s*business',
+        # Yahoo Mail spam protection lines
+        r'(tired\s*of\s*spam|spam\s*protection)\s*.*\s*yahoo\!?\s*mail',
+        # Yahoo Search movie showtime lines
+        r'(find\s*a\s*flick|movie\s*showtime)\s*.*\s*yahoo\!?\s*search',
+        # My Yahoo promotional lines
+        r'(meet\s*the|try\s*it)\s*.*\s*my\s*yahoo\!?',
+        # Yahoo Small Business resources lines
+        r'yahoo\!?\s*small\s*business\s*-\s*(try|check\s*out)\s*.*\s*(resources?\s*site)',
+        # holiday greetings lines
+        r'send\s*your\s*.*\s*(free)\s*.*\s*(holiday\s*greetings|greetings)',
+        # Yahoo Mail video email lines
+        r'send\s*.*\s*(free)\s*.*\s*(video\s*emails?)\s*in\s*yahoo\!?\s*mail',
+        # Yahoo Mail promotional lines with "Try FREE"
+        r'(try\s*free)\s*yahoo\!?\s*mail\s*-\s*.*\s*(greatest\s*free\s*email)',
+        # Yahoo Greetings e-cards lines
+        r'yahoo\!?\s*greetings\s*-\s*send\s*.*\s*(free\s*e-?cards|e-?cards)',
+        # SBC Yahoo! DSL promotional lines
+        r'sbc\s*yahoo\!?\s*dsl\s*-\s*now\s*.*\s*\$\d+\.\d+\s*per\s*month',
+        # Yahoo Mail improved/new feature lines with message size
+        r'(new\s*and\s*improved)\s*yahoo\!?\s*mail\s*-\s*send\s*\d+\s*mb\s*messages',
+        # Yahoo Photos new feature lines
+        r'new\s*yahoo\!?\s*photos\s*-\s*.*\s*(easier|simpler)\s*(uploading|sharing)',
+        # Yahoo Music launch lines
+        r'(launch|start)\s*-\s*your\s*yahoo\!?\s*music\s*experience',
+        # Yahoo Shopping promotional lines
+        r'>\s*(>\s*)*\s*yahoo\!?[\s\w]*\s*shopping\s*[-:]\s*.*',
+    ],
+    always=[
+        # standalone angle brackets and empty lines
+        r'^>\s*$',
+    ])
+
 def clean_yahoo_text(text):
     """
     Remove lines containing Yahoo promotional content
@@ -415,339 +882,216 @@ def clean_yahoo_text(text):
     Returns:
         str: Cleaned text
     """
-    # Regex to remove lines
-    lines = [line for line in text.split('\n') 
-             if not (
-                 # Remove lines with Yahoo promotional content
-                 (re.search(r'yahoo\!?', line, re.IGNORECASE) and 
-                  (re.search(r'yahoo\.com', line, re.IGNORECASE) or 
-                   re.search(r'platinum|mail\s*plus|sign\s*up|greetings|e-?cards|messages|photos|finance|personals|home\s*page|security|mobile|farechase|travel|autos|beta|discover|sports|small\s*business|spam|search|my\s*yahoo|resources|holiday|video|email|dsl|music', line, re.IGNORECASE))) or
-                 # Remove "Do you Yahoo!?" lines
-                 re.search(r'do\s*you\s*yahoo\!?\?', line, re.IGNORECASE) or
-                 # Remove standalone angle brackets and empty lines
-                 re.match(r'^>\s*$', line) or
-                 # Remove job and resume related lines
-                 re.search(r'(find|post)\s*(a)?\s*(job|resume)', line, re.IGNORECASE) or
-                 # Remove lines about accessing Yahoo services
-                 re.search(r'(listen|access|check)\s*.*\s*(yahoo\!? (mail|messages))', line, re.IGNORECASE) or
-                 # Remove lines about Yahoo service features
-                 re.search(r'(new|more)\s*yahoo\!?\s*(photos|mail)\s*-\s*(easier|better|simpler)', line, re.IGNORECASE) or
-                 # Remove lines about Yahoo services with specific actions
-                 re.search(r'yahoo\!?\s*(finance|mail):\s*(get|file|check|track)', line, re.IGNORECASE) or
-                 # Remove lines highlighting Yahoo service improvements
-                 re.search(r'(new\s*and\s*improved|improved)\s*yahoo\!?\s*mail\s*-\s*.*\s*(messages|email)', line, re.IGNORECASE) or
-                 # Remove registration or declaration lines
-                 re.search(r'(declare\s*yourself|register)\s*.*\s*(online|today)', line, re.IGNORECASE) or
-                 # Remove ad posting and personal ad lines
-                 re.search(r'(post|place)\s*(your)?\s*(free)?\s*(ad|personal)', line, re.IGNORECASE) or
-                 # Remove lines with Yahoo URLs for personals or ads
-                 re.search(r'http://.*yahoo\.(com|ca)/*(personals|ads)', line, re.IGNORECASE) or
-                 # Remove lines about setting Yahoo as home page
-                 re.search(r'(start|begin)\s*your\s*day\s*with\s*yahoo\!?', line, re.IGNORECASE) or
-                 # Remove lines encouraging making Yahoo home page
-                 re.search(r'make\s*it\s*your\s*(default\s*)?home\s*page', line, re.IGNORECASE) or
-                 # Remove lines about Yahoo Mail security
-                 re.search(r'yahoo\!?\s*mail\s*-\s*(you)\s*care\s*about\s*(security)', line, re.IGNORECASE) or
-                 # Remove lines about mobile Yahoo Mail
-                 re.search(r'(take|get)\s*yahoo\!?\s*mail\s*.*\s*(mobile\s*phone|phone)', line, re.IGNORECASE) or
-                 # Remove lines about Yahoo FareChase or travel services
-                 re.search(r'yahoo\!?\s*farechase:\s*(search|find)\s*.*\s*(travel\s*sites|sites)', line, re.IGNORECASE) or
-                 # Remove lines about Yahoo Autos
-                 re.search(r'(find|search)\s*your\s*next\s*(car|vehicle)\s*at\s*yahoo\!?\s*canada?\s*autos', line, re.IGNORECASE) or
-                 # Remove lines about Yahoo Mail beta
-                 re.search(r'(everyone\s*is\s*raving|raving)\s*about\s*.*\s*yahoo\!?\s*mail\s*beta', line, re.IGNORECASE) or
-                 # Remove "Discover Yahoo!" and similar promotional lines
-                 re.search(r'(discover\s*yahoo\!?|get\s*on-the-go)\s*.*\s*(scores|quotes|news)', line, re.IGNORECASE) or
-                 # Remove "Check it out!" type lines
-                 re.search(r'check\s*it\s*out\!?', line, re.IGNORECASE) or
-                 # Remove Yahoo Sports fantasy lines
-                 re.search(r'(rekindle\s*the\s*rivalries|sign\s*up\s*for)\s*.*\s*(fantasy\s*football)', line, re.IGNORECASE) or
-                 # Remove Yahoo Small Business promotional lines
-                 re.search(r'have\s*a\s*(huge|big)\s*year\s*through\s*yahoo\!?\s*small\s*business', line, re.IGNORECASE) or
-                 # Remove Yahoo Mail spam protection lines
-                 re.search(r'(tired\s*of\s*spam|spam\s*protection)\s*.*\s*yahoo\!?\s*mail', line, re.IGNORECASE) or
-                 # Remove Yahoo Search movie showtime lines
-                 re.search(r'(find\s*a\s*flick|movie\s*showtime)\s*.*\s*yahoo\!?\s*search', line, re.IGNORECASE) or
-                 # Remove My Yahoo promotional lines
-                 re.search(r'(meet\s*the|try\s*it)\s*.*\s*my\s*yahoo\!?', line, re.IGNORECASE) or
-                 # Remove Yahoo Small Business resources lines
-                 re.search(r'yahoo\!?\s*small\s*business\s*-\s*(try|check\s*out)\s*.*\s*(resources?\s*site)', line, re.IGNORECASE) or
-                 # Remove holiday greetings lines
-                 re.search(r'send\s*your\s*.*\s*(free)\s*.*\s*(holiday\s*greetings|greetings)', line, re.IGNORECASE) or
-                 # Remove Yahoo Mail video email lines
-                 re.search(r'send\s*.*\s*(free)\s*.*\s*(video\s*emails?)\s*in\s*yahoo\!?\s*mail', line, re.IGNORECASE) or
-                 # Remove Yahoo Mail promotional lines with "Try FREE"
-                 re.search(r'(try\s*free)\s*yahoo\!?\s*mail\s*-\s*.*\s*(greatest\s*free\s*email)', line, re.IGNORECASE) or
-                 # Remove Yahoo Greetings e-cards lines
-                 re.search(r'yahoo\!?\s*greetings\s*-\s*send\s*.*\s*(free\s*e-?cards|e-?cards)', line, re.IGNORECASE) or
-                 # Remove SBC Yahoo! DSL promotional lines
-                 re.search(r'sbc\s*yahoo\!?\s*dsl\s*-\s*now\s*.*\s*\$\d+\.\d+\s*per\s*month', line, re.IGNORECASE) or
-                 # Remove Yahoo Mail improved/new feature lines with message size
-                 re.search(r'(new\s*and\s*improved)\s*yahoo\!?\s*mail\s*-\s*send\s*\d+\s*mb\s*messages', line, re.IGNORECASE) or
-                 # Remove Yahoo Photos new feature lines
-                 re.search(r'new\s*yahoo\!?\s*photos\s*-\s*.*\s*(easier|simpler)\s*(uploading|sharing)', line, re.IGNORECASE) or
-                 # Remove Yahoo Music launch lines
-                 re.search(r'(launch|start)\s*-\s*your\s*yahoo\!?\s*music\s*experience', line, re.IGNORECASE) or
-                 # Remove Yahoo Shopping promotional lines
-                 re.search(r'>\s*(>\s*)*\s*yahoo\!?[\s\w]*\s*shopping\s*[-:]\s*.*', line, re.IGNORECASE)
-             )]
-    
-    return '\n'.join(lines).strip()
 
-def clean_body(the_email, the_message):
+    text, removed = YAHOO_LINES.filter(text)
+
+    return text.strip()
+
+# the "dashes-wrote" rule was the pattern below, meant to split lines like 
+# "> --- Bob Smith wrote:". Its backslashes are doubled in a raw string so 
+# it only ever matched a literal "\" followed by "s"s, and the replacement
+# is the literal text "\1\n\2". `split_dashes_wrote` does exactly the same,
+# without the time in proportion to the square of the length of the body
+#
+#   re.sub(r"(.*?)(?:\\s*>*)\\s*-{2,}\\s*(.*?\\s*wrote:)", r"\\1\\n\\2", text,
+#          flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+DASHES_WROTE_REPLACEMENT = '\\1\\n\\2'
+WROTE_PATTERN = re.compile(r'\\s*wrote:', re.IGNORECASE)
+
+# Skip over a run of any of the characters
+def skip_run(text, position, chars):
+    while position < len(text) and text[position] in chars:
+        position += 1
+
+    return position
+
+# Do what the old "dashes-wrote" pattern did, in linear time
+def split_dashes_wrote(text):
     """
-    Remove extra stuff from the body of the email like "Sent from my iPhone" and 
-    any reply-to text from the email being replied to.
+    Replace everything up to and including each `\\s*wrote:` that comes after
+    a `\\s*>*\\s*--\\s*`, where `\\` is a backslash and `s*` a run of 
+    "s"s, with the literal text "\\1\\n\\2", the same as the old pattern.
 
-    Performs extensive text cleaning including:
-    - Removing HTML and styling artifacts
-    - Cleaning up quoted text
-    - Normalizing line breaks and spacing
-    - Removing common email client signatures
-    - Formatting headers and message boundaries
+    The regular expression tried every position of the text and, from each,
+    looked for "wrote:" to the end of it. Here each backslash is checked 
+    once and "wrote:" is only looked for again once it's been passed.
 
     Args:
-        the_email: The actual email
-        the_message: Where the parsed email message goes
+        text (str): Input text
 
     Returns:
-        bool: True if successful, False if ran into errors
+        str: The text with the matches replaced
     """
 
-    text = the_message.body
-    result = False
+    parts = []
+    position = 0
+    searched = len(text) + 1
+    wrote = None
+    backslash = text.find('\\')
+
+    while backslash >= 0:
+        # `\\s*>*\\s*-{2,}\\s*`, each run can only end one way
+        start = None
+        after = skip_run(text, skip_run(text, backslash + 1, 'sS'), '>')
+        if text.startswith('\\', after):
+            dashes = skip_run(text, after + 1, 'sS')
+            after = skip_run(text, dashes, '-')
+            if after - dashes >= 2 and text.startswith('\\', after):
+                start = skip_run(text, after + 1, 'sS')
+
+        if start is None:
+            backslash = text.find('\\', backslash + 1)
+            continue
+
+        # the first `\\s*wrote:` from `start`, unless the last one found is
+        if not (searched <= start and (wrote is None or start <= wrote.start())):
+            wrote = WROTE_PATTERN.search(text, start)
+            searched = start
+
+        if not wrote:
+            backslash = text.find('\\', backslash + 1)
+            continue
+
+        # the match starts wherever the last one ended
+        parts.append(DASHES_WROTE_REPLACEMENT)
+        position = wrote.end()
+        backslash = text.find('\\', position)
+
+    if not parts:
+        return text
+
+    parts.append(text[position:])
+
+    return ''.join(parts)
+
+# The steps to clean up the body of an email, applied in this order. Each 
+# one can be turned off with the `clean-rules-off` setting
+CLEAN_RULES = cleaning.RuleSet([
 
     # get rid of quotes, a bit drastic but they're annoying
-    text = text.replace('>>  >> ', ' ')
-    text = text.replace('>>> ', ' ')
-    text = text.replace('>> ', ' ')
-    text = text.replace('>>  ', ' ')
-    text = text.replace('  >  > ', ' ')
-    text = text.replace(' >  > ', ' ') 
-    text = text.replace(' > ', ' ') 
-    text = text.replace('>  > ', ' ') 
-    text = text.replace('> ', ' ') 
-    text = text.replace('> > >', ' ')
-
-    # get rid of "{margin:0;}"
-    text = text.replace("{margin:0;}", "")
-    text = text.replace("{margin: 0;}", "")
-
-    # get rid of this
-    text = text.replace("P {margin-top:0;margin-bottom:0;}", "")
+    cleaning.Replace("quotes", [('>>  >> ', ' '), ('>>> ', ' '), ('>> ', ' '), 
+        ('>>  ', ' '), ('  >  > ', ' '), (' >  > ', ' '), (' > ', ' '),
+        ('>  > ', ' '), ('> ', ' '), ('> > >', ' ')]),
 
-    try:
-        pattern1 = re.compile(re.escape("#") + '.*?' + re.escape("{margin:0;}"), re.DOTALL)
-        text = pattern1.sub('', text)
-    except:
-        pass
-    
-    try:
-        pattern2 = re.compile(re.escape("#") + '.*?' + re.escape("NoSpacing"), re.DOTALL)
-        text = pattern2.sub('', text)
-    except:
-        pass
+    # get rid of "{margin:0;}" and "P {margin-top:0;margin-bottom:0;}"
+    cleaning.Replace("margins", [("{margin:0;}", ""), ("{margin: 0;}", ""),
+        ("P {margin-top:0;margin-bottom:0;}", "")]),
 
-    try:
-        # get rid of [External]/[Externe]
-        pattern3 = re.compile(r'\[External\]/\[Externe\]', re.IGNORECASE)
-        text = pattern3.sub('', text)
-    except:
-        pass
-    
-    try:
-        # regular expression pattern to match variations of "Sent from my iPhone" etc.
-        pattern4 = re.compile(r'Sent from .*|Get (Outlook for iOS|.*? for Android)|Sent via .*', re.IGNORECASE)
-        text = pattern4.sub('', text)
-    except:
-        pass
-    
-    try:
-        text = remove_reply(text)
-    except:
-        pass
+    cleaning.Between("hash-margin", "#", re.escape("{margin:0;}")),
+    cleaning.Between("hash-no-spacing", "#", re.escape("NoSpacing")),
 
-    try:
-        # add backticks around text with "#" so they aren't seen as tags in Obsidian e.g. `#bob`
-        text = re.sub(r'#([^\s\)\]\.]+)', r'`#\1`', text)
-    except:
-        pass
+    # get rid of [External]/[Externe]
+    cleaning.Sub("external", r'\[External\]/\[Externe\]', '', re.IGNORECASE),
 
-    try:
-        # remove "\\_\\_\\_\\_\\_\\_\\_" of any length
-        pattern5 = re.compile(r'\\_+', re.MULTILINE)
-        text = pattern5.sub('', text)
-    except:
-        pass
+    # variations of "Sent from my iPhone" etc.
+    cleaning.Sub("sent-from", r'Sent from .*|Get (Outlook for iOS|.*? for Android)|Sent via .*', '', re.IGNORECASE),
 
-    try:
-        # remove "\\\\" of any length
-        pattern6 = re.compile(r'^\\\\$', re.MULTILINE)
-        text = pattern6.sub('', text)
-    except:
-        pass
-    
-    try:
-        # add a blank line before "On Feb 22, 2018, at 8:18 PM, Bob Smith wrote:"
-        text = re.sub(r'(On .*? wrote:)', r'\n\1\n', text, flags=re.DOTALL)
-    except:
-        pass
+    cleaning.Call("remove-reply", remove_reply),
 
-    try:
-        # remove backslash and asterisk around "From," "Sent," and "To"
-        text = re.sub(r'\*\*(From|Cc|Sent|To|Subject)\:\*\*', r'\n\1:', text, flags=re.IGNORECASE)
-    except:
-        pass
+    # add backticks around text with "#" so they aren't seen as tags in Obsidian e.g. `#bob`
+    cleaning.Sub("hashtags", r'#([^\s\)\]\.]+)', r'`#\1`'),
 
-    # remove any HTML
-    try:
-        text = md(text.strip())
-        result = True
-    except Exception as e:
-        pass
+    # remove "\\_\\_\\_\\_\\_\\_\\_" of any length
+    cleaning.Sub("escaped-underscores", r'\\_+', '', re.MULTILINE),
 
-    try:
-        # reassemble lines to avoid word splitting
-        text = join_lines(text)
-    except:
-        pass
+    # remove "\\\\" of any length
+    cleaning.Sub("backslashes", r'^\\\\$', '', re.MULTILINE),
 
-    try:
-        # get rid of "p.MsoNormal,p.MsoNoSpacing{margin:0}"
-        text = text.replace('p.MsoNormal,p.MsoNoSpacing{margin:0}', ' ') 
-        pattern7 = re.compile(re.escape("p.") + '(.*?)' + re.escape("{margin: ?0;}"), re.DOTALL)
-        text = pattern7.sub('', text)
-    except:
-        pass
+    # add a blank line before "On Feb 22, 2018, at 8:18 PM, Bob Smith wrote:"
+    cleaning.Between("on-wrote", "On ", re.escape(" wrote:"), lambda found: '\n' + found + '\n'),
 
-    try:
-        # remove leading spaces, likely vestiges from other substitutions above
-        text = re.sub(r'^\s*', '', text, flags=re.MULTILINE)
-    except:
-        pass
+    # remove backslash and asterisk around "From," "Sent," and "To"
+    cleaning.Sub("bold-headers", r'\*\*(From|Cc|Sent|To|Subject)\:\*\*', r'\n\1:', re.IGNORECASE),
 
-    try:
-        # get rid of extra newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
-    except:
-        pass    
-    
-    try:
-        text = text.replace('| | | --- | |', ' ') 
-        text = text.replace('| | --- | |', ' ') 
-    except:
-        pass
+    # remove any HTML
+    cleaning.Call(CLEAN_RULE_MARKDOWNIFY, markdownify_remaining_html),
 
-    try:
-        # add a blank line before lines starting with From:
-        text = re.sub(r'^(From:)', r'\n\1', text, flags=re.MULTILINE)
-    except:
-        pass
-    
-    try:
-        # add a blank line after lines starting with Subject:
-        text = re.sub(r'(Subject: .*)\n+', r'\1\n', text)
-    except:
-        pass
+    # reassemble lines to avoid word splitting
+    cleaning.Call("join-lines", join_lines),
 
-    try:
-        # add a line before "---------- Forwarded message ---------"
-        text = re.sub(r'\n?-*\s*-?Forwarded message?-*\s*-', '\n\n*- Forwarded message *-', text, flags=re.IGNORECASE)
-    except:
-        pass
+    # get rid of "p.MsoNormal,p.MsoNoSpacing{margin:0}"
+    cleaning.Replace("mso-normal", [('p.MsoNormal,p.MsoNoSpacing{margin:0}', ' ')]),
+    cleaning.Sub("p-margin", re.escape("p.") + '(.*?)' + re.escape("{margin: ?0;}"), '', re.DOTALL,
+        requires=("p.", "{margin: ?0;}")),
 
-    try:
-        # ensure exactly one blank line before and after "Original Message"
-        text = re.sub(r'\n*\s*-{0,3}\s*Original Message\s*-{0,3}\s*\n*', '\n\n-- Original Message --\n\n', text)
-    except:
-        pass
+    # remove leading spaces, likely vestiges from other substitutions above
+    cleaning.Sub("leading-spaces", r'^\s*', '', re.MULTILINE),
 
-    try:
-        # remove lines between and including "-=-=-=-=-=-=-=-=-=-=-=-"
-        text = re.sub(r'-=-=-=-=-=-=-=-=-=-=-=-.*?-=-=-=-=-=-=-=-=-=-=-=-\n?', '', text, flags=re.DOTALL)
-    except:
-        pass
+    # get rid of extra newlines
+    cleaning.Sub("extra-newlines", r'\n{3,}', '\n\n'),
 
-    try:
-        # remove everything after "Join Zoom Meeting"
-        text = re.sub(r'Join Zoom Meeting.*', 'Join Zoom Meeting', text, flags=re.DOTALL)
-    except:
-        pass
+    cleaning.Replace("table-rules", [('| | | --- | |', ' '), ('| | --- | |', ' ')]),
 
-    try:
-        # replace lines containing "======================================================================" with 9 fewer "="
-        text = re.sub(r'^(=+)$', lambda m: '=' * (len(m.group(1)) - 9), text, flags=re.MULTILINE)
-    except:
-        pass
+    # add a blank line before lines starting with From:
+    cleaning.Sub("from-line", r'^(From:)', r'\n\1', re.MULTILINE),
 
-    try:
-        # combine lines that don't start with "> " or a prompt and don't end with a period
-        text = re.sub(r'([^\.\!\?])\n(?!>|[a-zA-Z]+:\s)', r'\1 ', text)
-    except:
-        pass
+    # add a blank line after lines starting with Subject:
+    cleaning.Sub("subject-line", r'(Subject: .*)\n+', r'\1\n'),
 
-    try:
-        # add blank lines between paragraphs
-        text = re.sub(r'(\n)(?=\S)', r'\1\n', text)
-    except:
-        pass
+    # add a line before "---------- Forwarded message ---------"
+    cleaning.Anchored("forwarded", r'Forwarded message?', '\n\n*- Forwarded message *-',
+        before=r'-?\s*-*\n?', after=r'-*\s*-', flags=re.IGNORECASE),
 
-    try:
-        # ensure lines between quoted paragraphs also have a quote ">"
-        text = re.sub(r'(?<=^> .*)\n(?=> )', '>\n', text, flags=re.MULTILINE)
-    except:
-        pass
+    # ensure exactly one blank line before and after "Original Message"
+    cleaning.Anchored("original-message", r'Original Message', '\n\n-- Original Message --\n\n',
+        before=r'\s*-{0,3}\s*', after=r'\s*-{0,3}\s*'),
 
-    try:
-        # remove text that starts and ends with any quantity of asterisks and contains "This e-mail"
-        text = re.sub(r'\*+.*?This e-mail.*?\*+', '', text, flags=re.DOTALL)
-    except:
-        pass
+    # remove lines between and including "-=-=-=-=-=-=-=-=-=-=-=-"
+    cleaning.Sub("dash-equals", r'-=-=-=-=-=-=-=-=-=-=-=-.*?-=-=-=-=-=-=-=-=-=-=-=-\n?', '', re.DOTALL,
+        requires=("-=-=-=-=-=-=-=-=-=-=-=-",)),
 
-    try:
-        # remove "> > >", "> >", or "> " from the end of lines
-        text = re.sub(r'(> > >|> >|> )$', '', text, flags=re.MULTILINE)
-    except:
-        pass
+    # remove everything after "Join Zoom Meeting"
+    cleaning.Sub("zoom", r'Join Zoom Meeting.*', 'Join Zoom Meeting', re.DOTALL,
+        requires=("Join Zoom Meeting",)),
 
-    try:
-        # ensure lines with "--------------------------------" preceded and/or followed by a space or any number of dashes greater than 2 have a blank line before and after them
-        text = re.sub(r'\s*-{2,}\s*--------------------------------\s*-{2,}\s*', '\n\n--------------------------------\n\n', text)
-    except:
-        pass
+    # replace lines containing "======================================================================" with 9 fewer "="
+    cleaning.Sub("equals-line", r'^(=+)$', lambda m: '=' * (len(m.group(1)) - 9), re.MULTILINE),
 
-    try:
-        # remove "_____" (or more or fewer underscores)
-        text = re.sub(r'_+', '', text)
-    except:
-        pass
+    # combine lines that don't start with "> " or a prompt and don't end with a period
+    cleaning.Sub("combine-lines", r'([^\.\!\?])\n(?!>|[a-zA-Z]+:\s)', r'\1 '),
 
-    try:
-        # deal with "Date: Tuesday, December 17, 2024 10:20 AM Blah blah"
-        date_pattern = re.compile(r'(Date: [A-Za-z]+, [A-Za-z]+ \d{1,2}, \d{4} \d{1,2}:\d{2} [APM]{2})(?=\S)', re.IGNORECASE)
-        text = date_pattern.sub(r'\1\n', text)
-    except:
-        pass
+    # add blank lines between paragraphs
+    cleaning.Sub("paragraphs", r'(\n)(?=\S)', r'\1\n'),
+
+    # ensure lines between quoted paragraphs also have a quote ">"
+    # note: Python's `re` can't compile the variable width look-behind so 
+    # this one has never applied
+    cleaning.Sub("quoted-paragraphs", r'(?<=^> .*)\n(?=> )', '>\n', re.MULTILINE),
+
+    # remove text that starts and ends with any quantity of asterisks and contains "This e-mail"
+    cleaning.Between("this-email", "*", r'\*+', inside="This e-mail"),
+
+    # remove "> > >", "> >", or "> " from the end of lines
+    cleaning.Sub("trailing-quotes", r'(> > >|> >|> )$', '', re.MULTILINE),
+
+    # ensure lines with "--------------------------------" preceded and/or followed by a space or any number of dashes greater than 2 have a blank line before and after them
+    cleaning.Anchored("dash-line", r'-{2,}\s*--------------------------------\s*-{2,}', '\n\n--------------------------------\n\n',
+        before=r'\s*', after=r'\s*'),
+
+    # remove "_____" (or more or fewer underscores)
+    cleaning.Sub("underscores", r'_+', ''),
+
+    # deal with "Date: Tuesday, December 17, 2024 10:20 AM Blah blah"
+    cleaning.Sub("date-line", r'(Date: [A-Za-z]+, [A-Za-z]+ \d{1,2}, \d{4} \d{1,2}:\d{2} [APM]{2})(?=\S)', r'\1\n', re.IGNORECASE),
 
     # remove any extra blank lines that might be introduced
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    cleaning.Sub("blank-lines", r'\n{3,}', '\n\n'),
 
     # split "> --- Bob Smith wrote:"
-    text = re.sub(
-        r"(.*?)(?:\\s*>*)\\s*-{2,}\\s*(.*?\\s*wrote:)",
-        r"\\1\\n\\2",
-        text,
-        flags=re.IGNORECASE | re.MULTILINE | re.DOTALL
-    )
-
-    text = re.sub(r'>> Chat with friends online, try MSN Messenger: http://messenger\.msn\.com', '', text)
-    
+    cleaning.Call("dashes-wrote", split_dashes_wrote),
+
+    cleaning.Sub("msn-messenger", r'>> Chat with friends online, try MSN Messenger: http://messenger\.msn\.com', '',
+        requires=("MSN Messenger",)),
+
     # remove AVG text
-    text = re.sub(r'Checked by AVG.*?message\.', '', text)
-    text = re.sub(r'> >---\s*> >Incoming mail is certified Virus Free\..*?Release Date: \d{2}/\d{2}/\d{4}', '', text, flags=re.DOTALL)
+    cleaning.Sub("avg-checked", r'Checked by AVG.*?message\.', '',
+        requires=("Checked by AVG",)),
+    cleaning.Sub("avg-virus-free", r'> >---\s*> >Incoming mail is certified Virus Free\..*?Release Date: \d{2}/\d{2}/\d{4}', '', re.DOTALL,
+        requires=("Incoming mail is certified Virus Free", "Release Date: ")),
 
     # remove "> Off to school, going on a trip, or moving? Windows Live (MSN) Messenger..."
-    text = re.sub(r'Off to school.*?/[^/]+$', '', text)
+    cleaning.Sub("off-to-school", r'Off to school.*?/[^/]+$', '',
+        requires=("Off to school",)),
 
     # replace
     #   > -- Original Message -- 
@@ -756,23 +1100,53 @@ def clean_body(the_email, the_message):
     # 
     # with
     #   -- Original Message --
-    text = re.sub(r'-- Original Message --\s*> --\s*', '-- Original Message --', text)
+    cleaning.Sub("original-message-quote", r'-- Original Message --\s*> --\s*', '-- Original Message --'),
 
     # remove "-- " from "-- hi " in lines
-    text = re.sub(r">\s*-+\s*hi(?=\s|$)", "> hi", text)
+    cleaning.Sub("dash-hi", r">\s*-+\s*hi(?=\s|$)", "> hi"),
     
     # get rid of extra quoted lines with more flexibility
-    text = re.sub(r'\n\n+(?=>)', '\n', text)
+    cleaning.Sub("quoted-blank-lines", r'(?<!\n)\n\n+(?=>)', '\n'),
+
+    cleaning.Call("yahoo", clean_yahoo_text),
+], fallback=(CLEAN_RULE_MARKDOWNIFY, "extra-newlines"))
+
+def clean_body(the_email, the_message):
+    """
+    Remove extra stuff from the body of the email like "Sent from my iPhone" and 
+    any reply-to text from the email being replied to.
+
+    Performs extensive text cleaning including:
+    - Removing HTML and styling artifacts
+    - Cleaning up quoted text
+    - Normalizing line breaks and spacing
+    - Removing common email client signatures
+    - Formatting headers and message boundaries
+
+    The steps are the rules in `CLEAN_RULES`.
+
+    Args:
+        the_email: The actual email
+        the_message: Where the parsed email message goes
 
-    text = clean_yahoo_text(text)
+    Returns:
+        bool: True if successful, False if ran into errors
+    """
+
+    text, failed, skipped = CLEAN_RULES.apply(the_message.body, the_settings.clean_budget_ms / 1000)
+
+    if skipped:
+        METRICS.count("cleaning_cut_short")
+        logging.info(f"ID: {the_message.id}  Size: {format_size(len(the_message.body))}  "
+                     f"Cleaning ran out of time, skipped: {';'.join(skipped)}")
 
     # FINALLY, ready to put the new-and-improved body in the message 🤣
     the_message.body = text
 
-    return result
+    return CLEAN_RULE_MARKDOWNIFY not in failed
 
 # Parse single email and extract header/body into Message object
-def parse_email(this_email, the_message):
+def parse_email(this_email, the_message, not_found=None):
     """
     Parse a specific email and clean up its contents.
 
@@ -782,6 +1156,7 @@ def parse_email(this_email, the_message):
     Args:
         this_email: The email to be parsed
         the_message: Where the parsed email message goes
+        not_found: Counter of the unknown addresses, `email_not_found` if None
 
     Returns:
         bool: True if email was parsed successfully, 
@@ -793,35 +1168,381 @@ def parse_email(this_email, the_message):
     for response in this_email:
 
         if isinstance(response, tuple):    
-            try:
-                # parse a bytes email into a message object
-                this_email = email.message_from_bytes(response[1])
+            peak = peak_rss_mb()
 
-                if the_config.debug:
-                    logging.info(f"ID: {id}")
+            # a large email was downloaded to a file
+            if isinstance(response[1], str):
+                size = os.path.getsize(response[1]) if os.path.exists(response[1]) else 0
+                result = parse_spooled(response[1], the_message, not_found)
+                report_memory(the_message, size, peak)
+                continue
 
-                if parse_header(this_email, the_message):
+            try:
+                # the header is enough to know if the email is wanted
+                with METRICS.timer("parse_header"):
+                    known = parse_header(read_header(response[1]), the_message, not_found)
+
+                if known:
                     if (the_message.from_slug):
-                        parse_body(this_email, the_message)
+                        # parse a bytes email into a message object
+                        with METRICS.timer("message_from_bytes", len(response[1])):
+                            this_email = email.message_from_bytes(response[1])
+
+                        with METRICS.timer("parse_body"):
+                            parse_body(this_email, the_message)
                         result = True
-                        clean_body(this_email, the_message)
+                        with METRICS.timer("clean_body", len(the_message.body or "")):
+                            clean_body(this_email, the_message)
+                        note_skipped_attachments(the_message)
             except:
                 pass
+
+            report_memory(the_message, len(response[1]), peak)
         
     return result
 
+# Parse a large email from the file it was downloaded to
+def parse_spooled(file_path, the_message, not_found=None):
+    """
+    Parse an email too big to hold in memory, for `large_message_mb`. Each 
+    part is written to a file of its own, the attachments are saved from 
+    those files, and only up to `message_memory_mb` of the text parts is 
+    read back in. The files are deleted afterwards.
+
+    Args:
+        file_path: The email, from `large_message.fetch`
+        the_message: Where the parsed email message goes
+        not_found: Counter of the unknown addresses, `email_not_found` if None
+
+    Returns:
+        bool: True if parsed and from a known person, False otherwise
+    """
+
+    folder = None
+
+    try:
+        folder = tempfile.mkdtemp(prefix=large_message.TEMP_PREFIX)
+
+        # only the text is read back into memory, when it's needed
+        max_bytes = int(the_settings.message_memory_mb * MB)
+        with METRICS.timer("split_message", os.path.getsize(file_path)):
+            header, parts = large_message.split(file_path, folder, max_bytes)
+
+        with METRICS.timer("parse_header"):
+            known = parse_header(read_header(header), the_message, not_found)
+
+        if not (known and the_message.from_slug):
+            return False
+
+        with METRICS.timer("parse_body"):
+            body_part = parse_parts(parts, the_message)
+        with METRICS.timer("clean_body", len(the_message.body or "")):
+            clean_body(None, the_message)
+
+        if body_part is not None and body_part.cut:
+            the_message.body = (the_message.body or "").rstrip() + "\n\n" + \
+                f"The rest of this email was left out, it's over {format_size(max_bytes)}"
+        note_skipped_attachments(the_message)
+
+    except Exception as e:
+        logging.error(f"parse_spooled: {file_path}. Error {e}")
+        return False
+
+    finally:
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    return True
+
+# The most memory this process has used so far, in MB
+def peak_rss_mb():
+    if not resource:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports KB and macOS bytes
+    return peak / MB if sys.platform == 'darwin' else peak / 1024
+
+# In debug mode, log how much the peak memory grew parsing an email
+def report_memory(the_message, size, peak_before):
+    if the_config.debug:
+        peak = peak_rss_mb()
+        logging.info(f"ID: {the_message.id}  Size: {format_size(size)}  "
+                     f"Peak RSS: {peak:.1f} MB (+{peak - peak_before:.1f} MB)")
+
+# Parse one fetched email, in a worker process when there's a pool
+def parse_response(response):
+    """
+    Parse one `FETCH` response item into a new Message object. Everything 
+    it needs comes in and goes out by value so it can run in one of the
+    `parse_pool` worker processes.
+
+    Args:
+        response: The (envelope, raw RFC822 bytes) tuple from the server
+
+    Returns:
+        tuple: (True if parsed and from a known person, the Message, 
+                Counter of the unknown email addresses found, the stage 
+                timings and counts and the stats of the cleaning rules 
+                when in a worker process)
+    """
+
+    the_message = message.Message()
+    not_found = collections.Counter()
+
+    result = parse_email([response], the_message, not_found)
+
+    return result, the_message, not_found, METRICS.take(), CLEAN_RULES.take()
+
+# Hand a fetched email to the parse stage
+def submit_parse(response):
+    """
+    Queue a fetched email for parsing in the `parse_pool` worker processes
+    or, without a pool, parse it right away.
+
+    Args:
+        response: The (envelope, raw RFC822 bytes) tuple from the server
+
+    Returns:
+        Future: Its result is the tuple from `parse_response`
+    """
+
+    if parse_pool:
+        return parse_pool.submit(parse_response, response)
+
+    future = Future()
+    future.set_result(parse_response(response))
+
+    return future
+
+# Keep a parsed email if it's wanted
+def keep_parsed(future, messages, from_date=None, end_date=None):
+    """
+    Get the result of parsing an email and add it to the messages if it's
+    from a known person, was sent in the date range and, with 
+    `dedupe_messages`, no copy of it was already processed. Duplicates 
+    don't count towards `max_messages`.
+
+    Args:
+        future: From `submit_parse`
+        messages: Where the Message objects go
+        from_date: `datetime` of the earliest message to keep, or None
+        end_date: `datetime` to keep only messages sent before, or None
+
+    Returns:
+        tuple: (the Message or None if it couldn't be parsed, True if kept,
+                True if it was skipped as a duplicate)
+    """
+
+    try:
+        result, the_message, not_found, taken, rule_stats = future.result()
+    except Exception as e:
+        logging.error(f"keep_parsed: {e}")
+        return None, False, False
+
+    with messages_lock:
+        email_not_found.update(not_found)
+    METRICS.merge(taken)
+    CLEAN_RULES.merge(rule_stats)
+    METRICS.count("messages_parsed")
+
+    if result and the_message.timestamp:
+        if from_date and the_message.timestamp < from_date.timestamp():
+            result = False
+        if end_date and the_message.timestamp >= end_date.timestamp():
+            result = False
+
+    if result and the_message.from_slug:
+        if the_settings.dedupe_messages and not MESSAGE_IDS.add(the_message.id):
+            METRICS.count("duplicates_skipped")
+            return the_message, False, True
+        kept = add_message(messages, the_message)
+        if kept:
+            METRICS.count("messages_kept")
+        elif the_settings.dedupe_messages:
+            # left out for `max_messages` so a later run can still keep it
+            MESSAGE_IDS.discard(the_message.id)
+        return the_message, kept, False
+
+    return the_message, False, False
+
+# Parse a date setting like `from_date` into a datetime
+def parse_date_setting(date_str):
+    """
+    Parse a date from the settings e.g. "2024-01-01".
+
+    Args:
+        date_str: The date string
+
+    Returns:
+        datetime: The parsed date or None if empty or not a valid date
+    """
+
+    if not date_str:
+        return None
+
+    try:
+        return parser.parse(date_str)
+    except Exception as e:
+        logging.error(f"{the_config.get_str(the_config.STR_DATE_STRING_DOES_NOT_MATCH_FORMAT)}: {date_str}. Error {e}")
+
+    return None
+
+# Add a parsed message unless the run already has enough of them
+def add_message(messages, the_message):
+    """
+    Add a message to the shared list, or pass it on to the writer when 
+    streaming, respecting `max_messages` across all of the folders being 
+    fetched at the same time.
+
+    Args:
+        messages: Where the Message objects go
+        the_message: The parsed Message
+
+    Returns:
+        bool: True if it was added, False if the limit was already reached
+    """
+
+    global messages_found
+
+    with messages_lock:
+        if messages_found >= the_config.max_messages:
+            return False
+        messages_found += 1
+        if not the_stream:
+            messages.append(the_message)
+
+    # outside of the lock as it waits when the writer is behind
+    if the_stream:
+        the_stream.put(the_message)
+
+    return True
+
+# Check if the run has all the messages it needs
+def limit_reached():
+    with messages_lock:
+        return messages_found >= the_config.max_messages
+
+# Write a group of messages to Markdown files while streaming
+def write_messages(messages):
+    """
+    Create the Markdown files for some of the messages, called by the 
+    `StreamWriter` as messages are parsed.
+
+    Args:
+        messages: The Message objects to write
+
+    Returns:
+        None
+    """
+
+    with METRICS.timer("write_markdown"):
+        message_md.get_markdown(the_config, loaded_messages, messages, [])
+
+# Stand in for `load_messages` when the messages are already loaded
+def loaded_messages(dest_file, messages, reactions, the_config):
+    return len(messages)
+
+# Use only the headers to find the messages from known people
+def select_known_senders(imap, folder, uids, from_date):
+    """
+    Phase one of fetching: get just the main header fields of each message
+    and run them through `parse_header` and the person lookup. Only the 
+    messages that would be kept need their bodies downloaded, so not the
+    copies of emails already processed from another folder.
+
+    Args:
+        imap: The IMAP connection
+        folder: The folder name, for logging
+        uids: The UIDs of the candidate messages
+        from_date: `datetime` of the earliest message to keep, or None
+
+    Returns:
+        tuple: (UIDs of the wanted messages in the original order, 
+                dict of their sizes keyed by UID, number of duplicates,
+                UIDs of the messages whose headers show they aren't wanted,
+                bytes of the unwanted messages not downloaded)
+
+    Raises:
+        imap_utils.FetchError: If the headers couldn't be fetched
+    """
+
+    selected = []
+    sizes = {}
+    avoided = 0
+    duplicates = 0
+    unwanted = []
+
+    with METRICS.timer("fetch_headers") as timer:
+        headers = imap_utils.fetch_headers(imap, uids)
+        timer.size = sum(len(header) for size, header in headers.values())
+
+    for uid in uids:
+        if uid not in headers:
+            continue
+
+        size, header = headers[uid]
+        the_message = message.Message()
+        not_found = collections.Counter()
+
+        try:
+            wanted = parse_header(read_header(header), the_message, not_found)
+        except Exception as e:
+            wanted = False
+
+        wanted = wanted and the_message.from_slug
+
+        if wanted and from_date and the_message.timestamp:
+            wanted = the_message.timestamp >= from_date.timestamp()
+
+        # a copy was processed from another folder
+        if wanted and the_settings.dedupe_messages and the_message.id in MESSAGE_IDS:
+            wanted = False
+            duplicates += 1
+            METRICS.count("duplicates_skipped")
+
+        # the full message gets parsed again so don't count these twice
+        if wanted:
+            selected.append(uid)
+            sizes[uid] = size
+        else:
+            with messages_lock:
+                email_not_found.update(not_found)
+            avoided += size
+            unwanted.append(uid)
+
+    METRICS.count("bytes_avoided", avoided)
+    logging.debug(f"Folder: {folder}  Headers: {len(headers)}  Wanted: {len(selected)}  Bytes avoided: {avoided}")
+
+    return selected, sizes, duplicates, unwanted, avoided
+
 # Retrieve and parse all emails from specified IMAP folder
 def fetch_emails(imap, folder, messages):
     """
     Load the emails from a specific IMAP server folder.
 
-    Retrieves emails one by one from the specified folder, parses them,
-    and appends successfully parsed messages to the messages list.
-    Stops when either all emails are processed, max_messages is reached,
-    or a message predating from_date is encountered.
-
-    Note: Originally considered filtering by specific email addresses
-    (e.g. 'HEADER FROM "spongebob@gmail.com"') but decided against it.
+    Asks the server for the UIDs of the messages in the date range using
+    `UID SEARCH SINCE <from_date> BEFORE <end_date>` so only those messages
+    are downloaded. With `incremental` on, only the messages with a UID 
+    higher than the last one processed on a previous run are searched, 
+    unless the folder's UIDVALIDITY changed. Unless `header_first` is off, 
+    the headers of each batch are checked just before it's fetched so only
+    the ones from known people have their bodies downloaded. The messages 
+    are retrieved in batches of `fetch_batch_size` (capped at 
+    `fetch_batch_mb` in total), parsed, and the ones successfully parsed 
+    are appended to the messages list. Stops when either all matching 
+    emails are processed or max_messages is reached. If a search or fetch 
+    fails, the rest of the folder is left for the next run and the folder 
+    is added to `failed_folders`.
+
+    With `search_senders`, the search also has the server match only the
+    emails from the people in `people.json` e.g. 
+    'OR FROM "spongebob@gmail.com" FROM "patrick@gmail.com"'.
 
     Args:
         imap: The IMAP connection
@@ -833,15 +1554,14 @@ def fetch_emails(imap, folder, messages):
     """
 
     count = 0
+    fetched = 0
+    duplicates = 0
 
-    # for some reason, some folders have a space but no quotes around them 
-    # and others do have quotes. So, if the folder contains a space and 
-    # doesn't have double quotes, add them
-    if ' ' in folder and not (folder.startswith('"') and folder.endswith('"')):
-        folder = '"' + folder + '"'
+    folder = imap_utils.quote_folder(folder)
 
     try:
-        status, emails = imap.select(folder)
+        with METRICS.timer("select"):
+            status, emails = imap.select(folder)
     except Exception as e:
         logging.error(e)
         return count
@@ -850,55 +1570,613 @@ def fetch_emails(imap, folder, messages):
         logging.error(status)
         return count
 
-    # get the total number of emails in the folder
-    emails = int(emails[0])
+    folder = imap_utils.unquote_folder(folder)
 
-    for i in range(emails, 0, -1):
-        # fetch the email message by ID
-        response, this_email = imap.fetch(str(i), "(RFC822)")
+    # on incremental runs only look at the messages since the last run
+    uidvalidity = imap_utils.get_uidvalidity(imap)
+    last_uid = 0
+    if the_settings.incremental:
+        last_uid = the_sync_state.get_last_uid(the_config.email_account, folder, uidvalidity)
 
-         # create a holder for the parsed email
-        the_message = message.Message()
+    # let the server skip everything outside of the date range
+    from_date = parse_date_setting(the_config.from_date)
+    end_date = parse_date_setting(the_settings.end_date)
+    criteria = imap_utils.search_criteria(from_date, end_date, last_uid)
+    try:
+        with METRICS.timer("search"):
+            if sender_search:
+                uids = imap_utils.search_senders(imap, criteria, sender_search)
+            else:
+                uids = imap_utils.search_uids(imap, criteria)
+    except imap_utils.FetchError:
+        fetch_failed(folder)
+        return count
+
+    # `n:*` always includes the highest UID even if it's lower than n
+    uids = [uid for uid in uids if int(uid) > last_uid]
+    searched = uids
+
+    # the UIDs (int) fetched and parsed, or skipped after their headers
+    done = set()
+
+    # on a resumed run, skip the emails the interrupted one got through
+    if the_settings.resume:
+        resumed = the_journal.get_uids(the_config.email_account, folder, uidvalidity)
+        if resumed:
+            uids = [uid for uid in uids if int(uid) not in resumed]
+            done.update(int(uid) for uid in searched if int(uid) in resumed)
+            logging.info(f"Folder: {folder}  Resumed: {len(resumed)} emails already done")
+
+    # newest first
+    uids.reverse()
+
+    # group the messages so each batch is fetched in one round trip. With
+    # `header_first`, the headers of a batch are checked just before its 
+    # bodies are fetched and the sizes come with the headers
+    sizes = {}
+    failed = False
+    if the_settings.header_first:
+        batches = list(imap_utils.chunks(uids, max(1, the_settings.fetch_batch_size)))
+    else:
+        if the_settings.fetch_batch_size > 1 or the_settings.large_message_mb:
+            try:
+                with METRICS.timer("fetch_sizes"):
+                    sizes = imap_utils.fetch_sizes(imap, uids)
+            except imap_utils.FetchError:
+                failed = True
+        batches = imap_utils.plan_batches(uids, sizes, 
+            the_settings.fetch_batch_size, the_settings.fetch_batch_mb * MB)
+
+    # the batch being parsed while the next one is fetched
+    pending = []
+    pending_uids = []
+    skipped = 0
+    headers_avoided = 0
+
+    for batch in batches + [[]]:
+        parsing = []
+        parsing_uids = []
+
+        # only download the bodies of messages to or from known people
+        if batch and not failed and not limit_reached() and the_settings.header_first:
+            try:
+                wanted, batch_sizes, batch_duplicates, unwanted, avoided = select_known_senders(imap, folder, batch, from_date)
+            except imap_utils.FetchError:
+                wanted, batch_sizes, batch_duplicates, unwanted, avoided = [], {}, 0, [], 0
+                failed = True
+            headers_avoided += avoided
+            sizes.update(batch_sizes)
+            duplicates += batch_duplicates
+            skipped += len(unwanted)
+            done.update(int(uid) for uid in unwanted)
+            save_journal(folder, uidvalidity, unwanted, [])
+            batch = wanted
+
+        # once a fetch fails, the connection is likely gone so the folder
+        # is left for the next run
+        if batch and not failed and not limit_reached():
+            # the emails downloaded on an earlier run don't need fetching
+            cached = the_cache.get(the_config.email_account, folder, uidvalidity, batch)
+            missing = [uid for uid in batch if uid not in cached]
+            METRICS.count("cache_hits", len(cached))
+
+            # large emails are downloaded to files, a piece at a time
+            large = []
+            if the_settings.large_message_mb:
+                large = [uid for uid in missing if sizes.get(uid, 0) > the_settings.large_message_mb * MB]
+                missing = [uid for uid in missing if uid not in large]
+
+            # the bodies wanted from a batch of headers can still be more 
+            # than `fetch_batch_mb`
+            responses = {}
+            for part in imap_utils.plan_batches(missing, sizes, 
+                    the_settings.fetch_batch_size, the_settings.fetch_batch_mb * MB):
+                try:
+                    with METRICS.timer("fetch") as timer:
+                        if the_settings.fetch_parts:
+                            fetched_parts, avoided = body_structure.fetch_messages(imap, part, *attachment_filters())
+                            METRICS.count("bytes_avoided", avoided)
+                        else:
+                            fetched_parts = imap_utils.fetch_batch(imap, part)
+                        timer.size = sum(len(response[1]) for response in fetched_parts.values())
+                except imap_utils.FetchError:
+                    failed = True
+                    break
+                responses.update(fetched_parts)
+                METRICS.count("messages_fetched", len(fetched_parts))
+
+            # only whole emails are cached, not the parts from `fetch_parts`
+            if not the_settings.fetch_parts:
+                the_cache.put(the_config.email_account, folder, uidvalidity,
+                    {uid: response[1] for uid, response in responses.items()})
+
+            for uid in large:
+                if failed:
+                    break
+                with METRICS.timer("fetch_large", sizes[uid]):
+                    file_path = large_message.fetch(imap, uid)
+                if file_path:
+                    responses[uid] = (b'UID ' + uid, file_path)
+                    METRICS.count("messages_fetched")
+                    METRICS.count("messages_spooled")
+                else:
+                    failed = True
+
+            responses.update((uid, (b'UID ' + uid, raw)) for uid, raw in cached.items())
+            del cached
+            parsing_uids = [uid for uid in batch if uid in responses]
+            parsing = [submit_parse(responses.pop(uid)) for uid in parsing_uids]
+            del responses
+
+        kept_messages = []
+        done_uids = []
+
+        for uid, future in zip(pending_uids, pending):
+            fetched += 1
+
+            # the server searches on the received date, so double check the 
+            # date the message was sent
+            the_message, kept, duplicate = keep_parsed(future, messages, from_date)
+            if not the_message:
+                continue
+
+            done.add(int(uid))
+
+            if kept:
+                count += 1
+                kept_messages.append((uid, the_message))
+            elif duplicate:
+                duplicates += 1
+
+            # one left out for `max_messages` isn't done if the run is resumed
+            if kept or not limit_reached():
+                done_uids.append(uid)
+
+            # let the user know where processing is at
+            status = f"Folder: {folder}  " + f"Countdown: {len(uids) - fetched - skipped}  "
+            status += f"Found: {count}  Date: {the_message.date_str} "
+            status += ' ' * (120 - len(status))
+            print(status, end="\r")
+
+        # the whole batch is done, so it can be journaled, but not the 
+        # emails that didn't come or couldn't be parsed
+        save_journal(folder, uidvalidity, done_uids, kept_messages)
+
+        pending = parsing
+        pending_uids = parsing_uids
+
+    if failed:
+        fetch_failed(folder)
+
+    # how much checking the headers first saved
+    if the_settings.header_first:
+        logging.info(f"Folder: {folder}  Not wanted: {skipped}  Bytes avoided: {headers_avoided}")
+
+    # remember where this run got to, unless it stopped at `max_messages` 
+    # or skipped the newer messages. The emails are done newest first, so 
+    # after a failed fetch it's only as far as every older one was done
+    if not limit_reached() and not end_date:
+        the_sync_state.set_last_uid(the_config.email_account, folder, uidvalidity,
+                                    highest_done(searched, done, last_uid))
+
+    if the_settings.remember_messages:
+        the_sync_state.add_message_ids(the_config.email_account, MESSAGE_IDS.take_new())
+
+    METRICS.count("folders")
+    logging.info(f"Folder: {folder}  Searched: {len(searched)}  Fetched: {fetched}  Skipped: {len(searched) - fetched}  Found: {count}  Duplicates: {duplicates}")
+
+    return count
+
+# Remember that a folder wasn't fetched in full
+def fetch_failed(folder):
+    logging.warning(f"Folder: {folder}  Not finished as a fetch failed, the rest is left for the next run")
+
+    with messages_lock:
+        failed_folders.append(folder)
+
+# Find how far through a folder every email is done
+def highest_done(uids, done, last_uid):
+    """
+    Find the highest UID that every searched UID up to is done, so the next
+    incremental run starts from the first one that isn't.
+
+    Args:
+        uids: The UIDs (bytes) searched for
+        done: The UIDs (int) done
+        last_uid: The last UID done on the previous run
+
+    Returns:
+        int: The highest UID with all of the ones before it done
+    """
+
+    highest = last_uid
+
+    for uid in sorted(int(uid) for uid in uids):
+        if uid not in done:
+            break
+        highest = uid
+
+    return highest
+
+# Record a batch of emails in the journal
+def save_journal(folder, uidvalidity, uids, kept):
+    """
+    Save the UIDs done and the messages kept so an interrupted run can be
+    resumed. When streaming, the messages are saved too as some can still
+    be waiting to be written, and they're written again on `resume`.
+
+    Args:
+        folder: The folder name
+        uidvalidity: The UIDVALIDITY of the folder
+        uids: The UIDs (bytes) done
+        kept: (UID, Message) of the messages kept
+
+    Returns:
+        None
+    """
+
+    if not the_journal.connection or not uids:
+        return
 
-        result = parse_email(this_email, the_message)
+    with METRICS.timer("journal"):
+        size = the_journal.save(the_config.email_account, folder, uidvalidity, uids, kept)
 
-        if result and the_message.from_slug:
+    METRICS.count("journal_bytes", max(0, size))
+
+# Add the messages an interrupted run had kept
+def resume_messages(messages):
+    """
+    Put the messages from the journal back in the list, as if they were
+    just parsed, for `resume`.
+
+    Args:
+        messages: Where the Message objects go
+
+    Returns:
+        int: The number of messages added
+    """
+
+    count = 0
+
+    for the_message in the_journal.get_messages(the_config.email_account):
+        # they could have been saved with `remember_messages`, so don't skip them
+        MESSAGE_IDS.add(the_message.id)
+        if add_message(messages, the_message):
             count += 1
-            messages.append(the_message)
+        else:
+            MESSAGE_IDS.discard(the_message.id)
 
-        # remove the double quotes around the folder name
-        if folder.startswith('"') and folder.endswith('"'):
-            folder = folder[1:-1]
+    logging.info(f"Resumed: {count} messages from the journal")
 
-        # let the user know where processing is at
-        status = f"Folder: {folder}  " + f"Countdown: {i-1}  "
-        status += f"Found: {count}  Date: {the_message.date_str} "
-        status += ' ' * (120 - len(status))
-        print(status, end="\r")
+    return count
 
-        # stop if this message was sent before the start date
-        try:
-            if the_message.date_str:
-                message_date = parser.parse(the_message.date_str)
-                from_date = parser.parse(the_config.from_date)
-                if message_date < from_date:
-                    continue
-        except Exception as e:
-            logging.error(f"{the_config.get_str(the_config.STR_DATE_STRING_DOES_NOT_MATCH_FORMAT)}: {the_message.date_str}. Error {e}")
+# Empty the journal once the run is complete
+def finish_journal():
+    if not the_settings.journal_seconds or the_settings.rerender or \
+       the_settings.input_format != sources.INPUT_IMAP:
+        return
+
+    # keep it for `resume` if the run couldn't connect or a folder failed
+    if not fetch_complete:
+        logging.warning("The run isn't complete, continue it with --resume")
+        return
+
+    if the_journal.open():
+        the_journal.clear(the_config.email_account)
+        the_journal.close()
+
+# Connect and log in to the IMAP server
+def connect(the_config):
+    """
+    Open an authenticated connection to the IMAP server.
+
+    Args:
+        the_config: Specific settings
+
+    Returns:
+        The IMAP connection or None if it couldn't connect or log in
+    """
+
+    # create an IMAP4 class with SSL unless told otherwise
+    port = the_settings.imap_port or (imaplib.IMAP4_SSL_PORT if the_settings.imap_ssl else imaplib.IMAP4_PORT)
+
+    try:
+        if the_settings.imap_ssl:
+            imap = imaplib.IMAP4_SSL(the_config.imap_server, port)
+        else:
+            imap = imaplib.IMAP4(the_config.imap_server, port)
+    except Exception as e:
+        logging.error(f"connect: {e}")
+        return None
+
+    try:
+        imap.login(the_config.email_account, the_config.password)
+    except Exception as e:
+        logging.error(f"connect: {e}")
+        disconnect(imap)
+        return None
+
+    # compress everything after logging in, if the server can
+    imap.compression = imap_compress.start(imap) if the_settings.imap_compress else None
+
+    return imap
+
+# Close the folder and log out from the IMAP server
+def disconnect(imap):
+    compression = getattr(imap, "compression", None)
+    if compression:
+        METRICS.count("compressed_bytes_received", compression.wire_received)
+        METRICS.count("uncompressed_bytes_received", compression.received)
+        METRICS.count("compressed_bytes_sent", compression.wire_sent)
+        METRICS.count("uncompressed_bytes_sent", compression.sent)
+
+    try:
+        imap.close()
+    except:
+        pass
+
+    try:
+        imap.logout()
+    except:
+        pass
+
+# Get the folders to fetch the emails from
+def get_folders(imap, the_config):
+    """
+    Get the folders from the `email-folders` setting or, if empty, all of
+    the folders on the server, minus the ones in `not-email-folders`.
+
+    Args:
+        imap: The IMAP connection
+        the_config: Specific settings
+
+    Returns:
+        list: The folder names
+    """
 
-        if count >= the_config.max_messages:
+    folders = []
+
+    if len(the_config.email_folders) > 0:
+        folders = list(the_config.email_folders)
+    else:
+        # log the list of folders
+        logging.info(imap.list()[1])
+
+        for i in imap.list()[1]:
+            l = i.decode().split(' "/" ')
+            folders.append(l[1])
+
+    # remove any folders specified in `not-email-folders` 
+    # setting and any of it's subfolders
+    for x_folder in the_config.not_email_folders:
+        folders = [y_folder for y_folder in folders if y_folder.split('/')[0] != x_folder]
+
+    return folders
+
+# Fetch the emails from folders in the queue until it is empty
+def fetch_folders(imap, folders, messages):
+    """
+    Work through the shared queue of folders on one IMAP connection. Several
+    of these run at the same time, one per connection in the pool.
+
+    Args:
+        imap: The IMAP connection or None to open a new one
+        folders: `queue.Queue` of the folder names
+        messages: Where the Message objects will go
+
+    Returns:
+        int: The number of messages loaded
+    """
+
+    count = 0
+
+    if not imap:
+        imap = connect(the_config)
+        if not imap:
             return count
 
+    try:
+        while not limit_reached():
+            try:
+                folder = folders.get_nowait()
+            except queue.Empty:
+                break
+
+            count += fetch_emails(imap, folder, messages)
+
+    except Exception as e:
+        logging.error(e)
+        fetch_failed(folder)
+
+    # close the connection and logout
+    disconnect(imap)
+
     return count
 
+# Load the emails from mbox, Maildir or .eml files
+def load_files(path, messages):
+    """
+    Load the emails from local files instead of the IMAP server.
+
+    Args:
+        path: The mbox file, Maildir or folder of .eml files
+        messages: Where the Message objects will go
+
+    Returns:
+        int: The number of messages loaded
+    """
+
+    emails = sources.read_messages(the_settings.input_format, path)
+
+    return parse_all(emails, f"File: {os.path.basename(path)}", messages)
+
+# Rebuild the messages from the emails in the cache
+def load_cache(messages):
+    """
+    Load the emails from the `message-cache.db` instead of the IMAP server,
+    for `rerender`, a folder at a time and newest first.
+
+    Args:
+        messages: Where the Message objects will go
+
+    Returns:
+        int: The number of messages loaded
+    """
+
+    count = 0
+    keys = the_cache.keys(the_config.email_account)
+
+    for (folder, uidvalidity), group in itertools.groupby(keys, key=lambda key: key[:2]):
+        uids = [str(uid).encode() for folder, uidvalidity, uid in group]
+        count += parse_all(cached_emails(folder, uidvalidity, uids), f"Folder: {folder}", messages)
+
+    return count
+
+# Read the emails of a folder from the cache, a batch at a time
+def cached_emails(folder, uidvalidity, uids):
+    for batch in imap_utils.chunks(uids, max(1, the_settings.fetch_batch_size)):
+        cached = the_cache.get(the_config.email_account, folder, uidvalidity, batch)
+        for uid in batch:
+            if uid in cached:
+                yield f"{folder} {uid.decode()}", cached.pop(uid)
+
+# Parse a series of emails that are already downloaded
+def parse_all(emails, label, messages):
+    """
+    Parse emails read from files or the cache, using the same parsing as 
+    when fetching and, with `workers`, the same worker processes. Only the 
+    last `fetch_batch_size` emails read are held in memory at once.
+
+    Args:
+        emails: Iterable of (name, raw RFC822 bytes)
+        label: Where they're from, for the status e.g. "File: mail.mbox"
+        messages: Where the Message objects will go
+
+    Returns:
+        int: The number of messages loaded
+    """
+
+    count = 0
+    read = 0
+    duplicates = 0
+    pending = collections.deque()
+    window = max(1, the_settings.fetch_batch_size)
+
+    from_date = parse_date_setting(the_config.from_date)
+    end_date = parse_date_setting(the_settings.end_date)
+
+    for name, raw in emails:
+        if limit_reached():
+            break
+
+        pending.append(submit_parse((name.encode(), raw)))
+        read += 1
+        METRICS.count("messages_read")
+        METRICS.count("bytes_read", len(raw))
+
+        while len(pending) >= window or (pending and not parse_pool):
+            the_message, kept, duplicate = keep_parsed(pending.popleft(), messages, from_date, end_date)
+            if kept:
+                count += 1
+            elif duplicate:
+                duplicates += 1
+
+            # let the user know where processing is at
+            if the_message:
+                status = f"{label}  Read: {read}  "
+                status += f"Found: {count}  Date: {the_message.date_str} "
+                status += ' ' * (120 - len(status))
+                print(status, end="\r")
+
+    while pending:
+        the_message, kept, duplicate = keep_parsed(pending.popleft(), messages, from_date, end_date)
+        if kept:
+            count += 1
+        elif duplicate:
+            duplicates += 1
+
+    logging.info(f"{label}  Read: {read}  Found: {count}  Duplicates: {duplicates}")
+
+    return count
+
+# Start the worker processes to parse the emails
+def start_parse_pool():
+    """
+    Start the `workers` processes, unless they're already running. This 
+    needs to happen before any threads are started as forking once they're
+    running isn't safe, so `__main__` starts them before the metrics and 
+    stream threads.
+
+    Returns:
+        None
+    """
+
+    global parse_pool
+
+    if the_settings.workers > 0 and not parse_pool:
+        parse_pool = ProcessPoolExecutor(max_workers=the_settings.workers,
+            mp_context=multiprocessing.get_context("fork"), initializer=start_worker)
+        parse_pool.submit(int).result()
+
+# Set up a worker process, its timings, counts and cleaning stats go back 
+# to this process
+def start_worker():
+    METRICS.start_forwarding()
+    CLEAN_RULES.start_forwarding()
+
+def stop_parse_pool():
+    global parse_pool
+
+    if parse_pool:
+        parse_pool.shutdown()
+        parse_pool = None
+
+# List the unknown email addresses, most frequent first
+def report_not_found(csv_path=""):
+    """
+    Print each email address that isn't in `people.json` with the number of
+    times it was seen, most frequent first, and optionally save them in a
+    CSV file to help fill in `people.json`.
+
+    Args:
+        csv_path: The CSV file to write, "" for none
+
+    Returns:
+        None
+    """
+
+    if not email_not_found:
+        return
+
+    ranked = sorted(email_not_found.items(), key=lambda item: (-item[1], item[0]))
+
+    print(the_config.get_str(the_config.STR_THESE_EMAIL_ADDRESSES_NOT_FOUND))
+
+    for email_address, count in ranked:
+        print(f"{count:>7}  {email_address}")
+
+    if csv_path:
+        try:
+            with open(csv_path, "w", newline="", encoding="utf-8") as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(["email", "count", "domain"])
+                for email_address, count in ranked:
+                    writer.writerow([email_address, count, email_address.rpartition('@')[2]])
+        except Exception as e:
+            logging.error(f"report_not_found: {csv_path}. Error {e}")
+
 # Connect to IMAP server and load emails from all accessible folders
 def load_messages(dest_file, messages, reactions, the_config):
     """
-    Load the emails from the IMAP server.
+    Load the emails from the IMAP server or, if `input_format` is mbox, 
+    maildir or eml, from the files in the source folder.
 
     Connects to the IMAP server, authenticates, and retrieves emails from all
-    accessible folders (except those in not-email-folders). Some parameters
-    are unused but required by the interface.
+    accessible folders (except those in not-email-folders). With more than
+    one of `imap_connections`, that many connections each work on a 
+    different folder at the same time. With `workers`, the emails are 
+    parsed and cleaned in that many processes. Some parameters are unused
+    but required by the interface.
 
     Args:
         dest_file: Not used but needed for the interface
@@ -910,61 +2188,109 @@ def load_messages(dest_file, messages, reactions, the_config):
         int: The number of messages loaded
     """
 
+    global sender_search, fetch_complete
+
     count = 0
-    folders = []
+
+    # rebuild the Markdown from the cache, without the IMAP server
+    if the_settings.rerender:
+        the_cache.open()
+        start_parse_pool()
+        count = load_cache(messages)
+        stop_parse_pool()
+        the_cache.close()
+        return count
+
+    # read local files instead
+    if the_settings.input_format != sources.INPUT_IMAP:
+        start_parse_pool()
+        count = load_files(the_config.source_folder, messages)
+        stop_parse_pool()
+        return count
 
     if not (the_config.imap_server and the_config.email_account and the_config.password):
         return 0
 
-    # create an IMAP4 class with SSL 
+    imap = connect(the_config)
+    if not imap:
+        return 0
+
+    # get the list of folders, the connections take them from the queue 
+    # one at a time
     try:
-        imap = imaplib.IMAP4_SSL(the_config.imap_server)
+        folders = queue.Queue()
+        for folder in get_folders(imap, the_config):
+            folders.put(folder)
     except Exception as e:
-        logging.error("load_messages: {e}")
+        logging.error(e)
+        disconnect(imap)
         return 0
-    
-    # authenticate, get the list of folders, fetch the emails
-    try:
-        imap.login(the_config.email_account, the_config.password)
 
-        if len(the_config.email_folders) > 0:
-            folders = the_config.email_folders
+    # let the server leave out the emails from unknown senders, unless some
+    # of them can't be searched for
+    if the_settings.search_senders:
+        addresses = the_people.addresses()
+        unsearchable = [address for address in addresses if not imap_utils.can_search(address)]
+        if unsearchable:
+            names = sorted({getattr(the_people.find(address), "slug", address) for address in unsearchable})
+            logging.warning(f"search-senders: can't search the server for {', '.join(names)}, "
+                            f"searching for every email instead")
         else:
-            # log the list of folders
-            logging.info(imap.list()[1])
-
-            for i in imap.list()[1]:
-                l = i.decode().split(' "/" ')
-                folders.append(l[1])
-
-        # remove any folders specified in `not-email-folders` 
-        # setting and any of it's subfolders
-        for x_folder in the_config.not_email_folders:
-            for y_folder in folders:
-                parts = y_folder.split('/')
-                if parts[0] == x_folder:
-                    folders.remove(y_folder)
-
-        for folder in folders:
-            # only fetch emails from folders not in the exclude list
-            count += fetch_emails(imap, folder, messages)
-            if count >= the_config.max_messages:
-                imap.close()
-                imap.logout()
-                return count
+            sender_search = imap_utils.sender_criteria(addresses)
 
-    except Exception as e:
-        logging.error(e)
+    # remember how far each folder got between runs
+    the_sync_state.open()
 
-    # close the connection and logout
-    try:
-        imap.close()
-        imap.logout()
-    except:
-        pass
+    # keep the emails downloaded so they're not downloaded again
+    if the_settings.cache_mb:
+        the_cache.open()
+
+    # skip the emails processed on earlier runs
+    if the_settings.remember_messages:
+        MESSAGE_IDS.load(the_sync_state.get_message_ids(the_config.email_account))
+
+    # journal the run so it can be resumed if it's interrupted
+    if the_settings.journal_seconds and the_journal.open():
+        if the_settings.resume:
+            count += resume_messages(messages)
+        else:
+            the_journal.clear(the_config.email_account)
+
+    # start the parse workers before the fetching threads
+    start_parse_pool()
+
+    connections = max(1, min(the_settings.imap_connections, folders.qsize()))
+
+    # the first connection is already open, the others open their own
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = [executor.submit(fetch_folders, imap if i == 0 else None, folders, messages)
+                   for i in range(connections)]
+        for future in futures:
+            count += future.result()
+
+    # a folder is left in the queue if none of the connections could open
+    fetch_complete = not failed_folders and (folders.empty() or limit_reached())
+
+    stop_parse_pool()
+
+    the_sync_state.close()
+    the_cache.close()
+    the_journal.close()
+
+    report_compression()
 
     return count
 
+# Log how much COMPRESS DEFLATE saved
+def report_compression():
+    counters = METRICS.snapshot()["counters"]
+    compressed = counters.get("compressed_bytes_received", 0)
+    uncompressed = counters.get("uncompressed_bytes_received", 0)
+
+    if compressed:
+        logging.info(f"Compression: received {format_size(compressed)} for {format_size(uncompressed)}  "
+                     f"Ratio: {uncompressed / compressed:.1f}  Saved: {format_size(max(0, uncompressed - compressed))}")
+
 # main
 
 # Was getting the warning below and found no easy way to supress it so using: 
@@ -982,15 +2308,58 @@ the_messages = []
 the_reactions = [] 
 
 the_config = config.Config()
+the_settings = email_settings.Settings()
+the_people = people_index.PeopleIndex(the_config)
+
+if __name__ == "__main__":
+
+    # take out the email specific options so message_md doesn't trip on them
+    sys.argv[1:] = the_settings.parse_arguments(sys.argv[1:])
+
+    if message_md.setup(the_config, markdown.YAML_SERVICE_EMAIL):
+
+        the_settings.load(the_config.config_folder)
+        the_sync_state = sync_state.SyncState(the_config.config_folder)
+        the_cache = message_cache.MessageCache(the_config.config_folder, the_settings.cache_mb * MB)
+        the_journal = journal.Journal(the_config.config_folder, the_settings.journal_seconds)
+
+        for rule in the_people.add_domain_rules(the_settings.domain_rules):
+            logging.error(f"domain-rules: no person for {rule}")
+
+        # turn off the cleaning rules that aren't wanted
+        rules_off = [name.strip() for name in the_settings.clean_rules_off.split(';') if name.strip()]
+        for name in CLEAN_RULES.set_enabled(rules_off, False):
+            logging.error(f"clean-rules-off: no rule named {name}")
+
+        # fork the workers while this is the only thread, and after the 
+        # settings they copy
+        start_parse_pool()
+
+        if the_settings.metrics_file:
+            METRICS.start_writing(the_settings.metrics_file, 
+                the_settings.metrics_format, the_settings.metrics_interval)
+
+        # needs to be after setup so the command line parameters override the
+        # values defined in the settings file
+        if the_settings.stream:
+            # write the Markdown files as the messages come in
+            the_stream = stream_writer.StreamWriter(write_messages, the_settings.stream_queue_size)
+            the_stream.start()
+            load_messages(None, the_messages, the_reactions, the_config)
+            the_stream.close()
+        else:
+            message_md.get_markdown(the_config, load_messages, the_messages, the_reactions)
+
+        # in case loading stopped before it got to the workers
+        stop_parse_pool()
 
-if message_md.setup(the_config, markdown.YAML_SERVICE_EMAIL):
+        # everything is written so the run won't need resuming
+        finish_journal()
 
-    # needs to be after setup so the command line parameters override the
-    # values defined in the settings file
-    message_md.get_markdown(the_config, load_messages, the_messages, the_reactions)
+        if the_settings.clean_stats:
+            logging.info("Cleaning rules, slowest first:\n" + CLEAN_RULES.report())
 
-    if len(email_not_found):
-        print(the_config.get_str(the_config.STR_THESE_EMAIL_ADDRESSES_NOT_FOUND))
+        if the_settings.metrics_file:
+            METRICS.stop_writing()
 
-        for email_address in email_not_found:
-            print(email_address)
\ No newline at end of file
+        report_not_found(the_settings.not_found_csv)
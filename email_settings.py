@@ -0,0 +1,165 @@
+import argparse
+import json
+import logging
+import os
+
+CONFIG_FILE = "config.json"
+
+# Settings specific to email_md that are not part of the generic message_md
+# `Config` class. Each one can be set in the `config.json` file and
+# overridden on the command line.
+#
+# (attribute, config.json key, command line flag, type, default, help)
+OPTIONS = [
+    ("input_format", "input-format", "--input-format", str, "imap",
+        "where to read the emails from: imap, mbox, maildir or eml"),
+    ("imap_port", "imap-port", "--imap-port", int, 0,
+        "port of the IMAP server, 0 for the standard one"),
+    ("imap_ssl", "imap-ssl", "--no-imap-ssl", bool, True,
+        "connect to the IMAP server without SSL e.g. a local test server"),
+    ("imap_compress", "imap-compress", "--no-imap-compress", bool, True,
+        "don't compress the IMAP connection even if the server supports it"),
+    ("end_date", "end-date", "--end-date", str, "",
+        "only fetch emails received before this date e.g. 2024-12-31"),
+    ("fetch_batch_size", "fetch-batch-size", "--fetch-batch-size", int, 200,
+        "number of emails to fetch per IMAP command, 1 fetches one by one"),
+    ("fetch_batch_mb", "fetch-batch-mb", "--fetch-batch-mb", int, 25,
+        "maximum total size in MB of the emails fetched per IMAP command"),
+    ("header_first", "header-first", "--no-header-first", bool, True,
+        "download the whole email without checking the headers first"),
+    ("fetch_parts", "fetch-parts", "--fetch-parts", bool, False,
+        "download only the text and the attachments that pass the filters"),
+    ("large_message_mb", "large-message-mb", "--large-message-mb", float, 0,
+        "download emails bigger than this many MB to a file and parse them a part at a time"),
+    ("message_memory_mb", "message-memory-mb", "--message-memory-mb", float, 16,
+        "with large-message-mb, the most MB of an email's text to hold in memory"),
+    ("attachment_types", "attachment-types", "--attachment-types", str, "",
+        "MIME types of the attachments to save separated by ';' e.g. image/*"),
+    ("attachment_max_mb", "attachment-max-mb", "--attachment-max-mb", float, 0,
+        "largest attachment to save in MB, 0 for no limit"),
+    ("incremental", "incremental", "--incremental", bool, False,
+        "only fetch the emails that arrived since the last run"),
+    ("search_senders", "search-senders", "--search-senders", bool, False,
+        "ask the server for only the emails from the people in people.json"),
+    ("cache_mb", "cache-mb", "--cache-mb", int, 0,
+        "keep up to this many MB of downloaded emails so they're not downloaded again"),
+    ("journal_seconds", "journal-seconds", "--journal-seconds", float, 5,
+        "seconds between saves of the journal an interrupted run can be resumed from, 0 for none"),
+    ("resume", "resume", "--resume", bool, False,
+        "continue an interrupted run from its journal instead of starting over"),
+    ("rerender", "rerender", "--rerender", bool, False,
+        "rebuild the Markdown from the cached emails without the IMAP server"),
+    ("dedupe_messages", "dedupe-messages", "--no-dedupe-messages", bool, True,
+        "process every copy of an email found in more than one folder"),
+    ("remember_messages", "remember-messages", "--remember-messages", bool, False,
+        "remember the Message-IDs processed so later runs skip them too"),
+    ("imap_connections", "imap-connections", "--imap-connections", int, 1,
+        "number of IMAP connections fetching different folders at once"),
+    ("workers", "workers", "--workers", int, 0,
+        "number of processes parsing and cleaning the emails, 0 for none"),
+    ("stream", "stream", "--stream", bool, False,
+        "write the Markdown files as the emails are processed"),
+    ("stream_queue_size", "stream-queue-size", "--stream-queue-size", int, 100,
+        "maximum number of processed emails waiting to be written"),
+    ("cut_replies", "cut-replies", "--no-cut-replies", bool, True,
+        "cut off the quoted email at the end of a reply before cleaning the body"),
+    ("clean_rules_off", "clean-rules-off", "--clean-rules-off", str, "",
+        "names of the body cleaning rules to skip, separated by ';'"),
+    ("clean_stats", "clean-stats", "--clean-stats", bool, False,
+        "log the time taken and changes made by each body cleaning rule"),
+    ("clean_budget_ms", "clean-budget-ms", "--clean-budget-ms", int, 5000,
+        "most milliseconds to spend cleaning one body before only the basic rules run, 0 for no limit"),
+    ("domain_rules", "domain-rules", "--domain-rules", str, "",
+        "domain=slug pairs separated by ';' so anyone at the domain is that person"),
+    ("not_found_csv", "not-found-csv", "--not-found-csv", str, "",
+        "also write the unknown email addresses and their counts to this CSV file"),
+    ("metrics_file", "metrics-file", "--metrics-file", str, "",
+        "write the time taken by each stage and counters to this file"),
+    ("metrics_format", "metrics-format", "--metrics-format", str, "json",
+        "format of the metrics file: json or prometheus"),
+    ("metrics_interval", "metrics-interval", "--metrics-interval", int, 0,
+        "seconds between writes of the metrics file, 0 for only at the end"),
+]
+
+class Settings:
+    """
+    The email specific settings, see `OPTIONS` for the list.
+    """
+
+    def __init__(self):
+        self.overrides = {}
+
+        for name, key, flag, kind, default, help in OPTIONS:
+            setattr(self, name, default)
+
+    # Pull the email specific options out of the command line arguments
+    def parse_arguments(self, argv):
+        """
+        Parse the email specific command line options, remembering them so
+        they override the values in `config.json`.
+
+        The generic message_md options are left alone so they can be parsed
+        by `message_md.setup` afterwards.
+
+        Args:
+            argv: The command line arguments, without the program name
+
+        Returns:
+            list: The arguments that were not email specific
+        """
+
+        parser = argparse.ArgumentParser(add_help=False)
+
+        for name, key, flag, kind, default, help in OPTIONS:
+            if kind is bool:
+                action = "store_false" if default else "store_true"
+                parser.add_argument(flag, dest=name, action=action,
+                    default=argparse.SUPPRESS, help=help)
+            else:
+                parser.add_argument(flag, dest=name, type=kind,
+                    default=argparse.SUPPRESS, help=help)
+
+        args, remaining = parser.parse_known_args(argv)
+
+        self.overrides = vars(args)
+        self.apply(self.overrides)
+
+        return remaining
+
+    # Load the email specific settings from the `config.json` file
+    def load(self, folder):
+        """
+        Load the settings from `config.json` in the config folder. Values
+        given on the command line win over the ones in the file.
+
+        Args:
+            folder: The folder with the `config.json` file
+
+        Returns:
+            bool: True if the file was read, False otherwise
+        """
+
+        values = {}
+        file_path = os.path.join(folder, CONFIG_FILE)
+
+        try:
+            with open(file_path, "r", encoding="utf-8") as settings_file:
+                settings = json.load(settings_file)
+        except Exception as e:
+            logging.error(f"Settings.load: {file_path}. Error {e}")
+            return False
+
+        for name, key, flag, kind, default, help in OPTIONS:
+            if key in settings and name not in self.overrides:
+                try:
+                    values[name] = kind(settings[key])
+                except (TypeError, ValueError) as e:
+                    logging.error(f"Settings.load: {key}. Error {e}")
+
+        self.apply(values)
+
+        return True
+
+    def apply(self, values):
+        for name, value in values.items():
+            setattr(self, name, value)
@@ -0,0 +1,125 @@
+import logging
+import zlib
+
+CAPABILITY = 'COMPRESS=DEFLATE'
+
+# how much to read from the socket at a time
+BLOCK_SIZE = 65536
+
+# imaplib's limit on the length of a line
+MAX_LINE = 1000000
+
+# the bytes already read are dropped from the buffer once there are at least
+# this many and they're at least half of it
+COMPACT_SIZE = 1024 * 1024
+
+class DeflateStream:
+    """
+    Compresses what imaplib sends and decompresses what it reads once the
+    server has agreed to COMPRESS DEFLATE (RFC 4978), by taking over the
+    `read`, `readline` and `send` of the connection. Works the same for
+    `IMAP4` and `IMAP4_SSL`.
+
+    Counts the bytes on the wire and the bytes they stand for, both ways,
+    so the savings can be reported.
+
+    What's decompressed goes on the end of one buffer and is read from an
+    offset into it, so a literal of many MB isn't copied again for every
+    block that arrives or every piece imaplib reads.
+    """
+
+    def __init__(self, imap):
+        self.imap = imap
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self.decompressor = zlib.decompressobj(-15)
+        self.buffer = bytearray()
+        self.position = 0
+        self.wire_received = 0
+        self.received = 0
+        self.wire_sent = 0
+        self.sent = 0
+
+        imap.read = self.read
+        imap.readline = self.readline
+        imap.send = self.send
+
+    # Read and decompress the next block from the server
+    def fill(self):
+        data = self.imap.file.read1(BLOCK_SIZE)
+        if not data:
+            raise self.imap.abort("socket error: EOF")
+
+        self.wire_received += len(data)
+        data = self.decompressor.decompress(data)
+        self.received += len(data)
+        self.buffer += data
+
+    # Take the next bytes from the buffer, dropping the ones read now and then
+    def take(self, size):
+        end = self.position + size
+        data = bytes(self.buffer[self.position:end])
+        self.position = end
+
+        if self.position >= COMPACT_SIZE and self.position * 2 >= len(self.buffer):
+            del self.buffer[:self.position]
+            self.position = 0
+
+        return data
+
+    def read(self, size):
+        while len(self.buffer) - self.position < size:
+            self.fill()
+
+        return self.take(size)
+
+    def readline(self):
+        # only look for the newline in what's new since the last look
+        start = self.position
+
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end >= 0:
+                break
+            if len(self.buffer) - self.position > MAX_LINE:
+                raise self.imap.error(f"got more than {MAX_LINE} bytes")
+            start = len(self.buffer)
+            self.fill()
+
+        return self.take(end + 1 - self.position)
+
+    # Compress a command and send it straight away
+    def send(self, data):
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.imap.sock.sendall(compressed)
+        self.sent += len(data)
+        self.wire_sent += len(compressed)
+
+# Turn on compression if the server supports it
+def start(imap):
+    """
+    Ask the server for its capabilities, as they can change after logging
+    in, and turn on COMPRESS DEFLATE if it's one of them.
+
+    Args:
+        imap: The IMAP connection, logged in
+
+    Returns:
+        DeflateStream: Or None if the server doesn't support it
+    """
+
+    try:
+        status, data = imap.capability()
+        capabilities = data[0].decode().upper().split() if status == 'OK' and data and data[0] else []
+        if CAPABILITY not in capabilities:
+            return None
+
+        status, data = imap.xatom('COMPRESS', 'DEFLATE')
+    except Exception as e:
+        logging.error(f"start: {e}")
+        return None
+
+    if status != 'OK':
+        logging.error(f"start: {status} {data}")
+        return None
+
+    return DeflateStream(imap)
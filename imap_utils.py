@@ -0,0 +1,573 @@
+import logging
+import re
+
+# IMAP dates are always in English regardless of the locale e.g. 01-Jan-2024
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+SEARCH_ALL = 'ALL'
+SEARCH_SINCE = 'SINCE'
+SEARCH_BEFORE = 'BEFORE'
+SEARCH_UID = 'UID'
+SEARCH_FROM = 'FROM'
+SEARCH_OR = 'OR'
+
+# RFC 7162 asks clients to keep command lines under 8192 bytes, this leaves
+# room for the rest of the command e.g. the date range
+SEARCH_LENGTH = 7000
+
+FETCH_SIZE = '(RFC822.SIZE)'
+FETCH_RFC822 = '(RFC822)'
+FETCH_HEADERS = '(RFC822.SIZE BODY.PEEK[HEADER.FIELDS (FROM TO CC DATE SUBJECT MESSAGE-ID)])'
+
+# how many UIDs to ask for the size or headers of in one command
+SIZE_CHUNK = 500
+
+UID_PATTERN = re.compile(rb'UID (\d+)')
+SIZE_PATTERN = re.compile(rb'RFC822\.SIZE (\d+)')
+
+# the pieces of a FETCH response: parentheses, quoted strings, the {n} 
+# before a literal, and atoms like BODY[HEADER.FIELDS (FROM TO)]
+TOKEN_PATTERN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}$|[^\s()"\[]+(?:\[[^\]]*\](?:<\d+>)?)?')
+ESCAPE_PATTERN = re.compile(rb'\\(.)')
+LITERAL = object()
+
+class FetchError(Exception):
+    """
+    A `UID SEARCH` or `UID FETCH` failed, e.g. the connection dropped or the
+    server answered NO, so the messages asked for may not all be there.
+    """
+
+# Put double quotes around a folder name that has a space in it
+def quote_folder(folder):
+    """
+    For some reason, some folders have a space but no quotes around them and
+    others do have quotes. So, if the folder contains a space and doesn't
+    have double quotes, add them.
+
+    Args:
+        folder: The folder name e.g. "Sent Items"
+
+    Returns:
+        str: The folder name, quoted if needed
+    """
+
+    if ' ' in folder and not (folder.startswith('"') and folder.endswith('"')):
+        folder = '"' + folder + '"'
+
+    return folder
+
+# Remove the double quotes around a folder name
+def unquote_folder(folder):
+    if folder.startswith('"') and folder.endswith('"'):
+        folder = folder[1:-1]
+
+    return folder
+
+# Convert a date to the format used in IMAP SEARCH e.g. 01-Jan-2024
+def imap_date(the_date):
+    """
+    Format a date for use in an IMAP SEARCH command.
+
+    Args:
+        the_date: A `datetime` or `date`
+
+    Returns:
+        str: The date in IMAP format e.g. "01-Jan-2024"
+    """
+
+    return f"{the_date.day:02d}-{MONTHS[the_date.month - 1]}-{the_date.year}"
+
+# Build the IMAP SEARCH criteria for a date range and newer UIDs
+def search_criteria(from_date=None, to_date=None, after_uid=0):
+    """
+    Build the IMAP SEARCH criteria so the server only returns the messages
+    in the date range and, for incremental runs, newer than the last UID
+    processed.
+
+    Args:
+        from_date: `datetime` of the first day to include, or None
+        to_date: `datetime` of the day to stop before, or None
+        after_uid: Only include UIDs after this one, 0 for all
+
+    Returns:
+        list: The search keys e.g. ['SINCE', '01-Jan-2024']
+    """
+
+    criteria = []
+
+    if from_date:
+        criteria += [SEARCH_SINCE, imap_date(from_date)]
+
+    if to_date:
+        criteria += [SEARCH_BEFORE, imap_date(to_date)]
+
+    if after_uid:
+        criteria += [SEARCH_UID, f"{after_uid + 1}:*"]
+
+    if not criteria:
+        criteria = [SEARCH_ALL]
+
+    return criteria
+
+# Put a value in double quotes for a SEARCH command
+def quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+# Check if an address can go in a quoted string in a SEARCH command
+def can_search(address):
+    return address.isascii() and '\r' not in address and '\n' not in address
+
+# Build the SEARCH key for one sender
+def sender_key(address):
+    """
+    Build a `FROM` key for an address that also matches its plus addresses 
+    e.g. "bob+lists@x.com" for "bob@x.com", as they're the same person: 
+    `OR FROM "bob@x.com" (FROM "bob+" FROM "@x.com")`. A domain or an 
+    address with a tag gets a plain `FROM` key.
+
+    Args:
+        address: The email address or domain
+
+    Returns:
+        list: The search key, in pieces
+    """
+
+    local, at, domain = address.rpartition('@')
+
+    if not at or not local or '+' in local:
+        return [SEARCH_FROM, quote(address)]
+
+    return [SEARCH_OR, SEARCH_FROM, quote(address), 
+            f"({SEARCH_FROM}", quote(local + '+'), SEARCH_FROM, quote(at + domain) + ")"]
+
+# Build SEARCH criteria matching any of the senders
+def sender_criteria(addresses, max_length=SEARCH_LENGTH):
+    """
+    Chain the `sender_key` of each address with `OR` e.g. 
+    `OR FROM "a@x.com" FROM "b@y.com"`, split into as many sets of criteria
+    as needed to keep each one under `max_length` characters. The server 
+    matches a `FROM` key anywhere in the header so a domain e.g. "acme.com"
+    works too.
+
+    Addresses that aren't plain ASCII can't go in a quoted string so
+    they're left out and logged, check them with `can_search` first.
+
+    Args:
+        addresses: The email addresses or domains
+        max_length: The most characters in each set of criteria
+
+    Returns:
+        list: The sets of criteria, each a list of search keys
+    """
+
+    groups = []
+    keys = []
+    length = 0
+
+    for address in sorted(set(addresses)):
+        if not can_search(address):
+            logging.warning(f"sender_criteria: can't search for {address}")
+            continue
+
+        key = sender_key(address)
+        size = len(SEARCH_OR) + sum(len(piece) + 1 for piece in key) + 1
+
+        if keys and length + size > max_length:
+            groups.append(keys)
+            keys = []
+            length = 0
+
+        keys.append(key)
+        length += size
+
+    if keys:
+        groups.append(keys)
+
+    criteria = []
+
+    for keys in groups:
+        chain = []
+        for key in keys[:-1]:
+            chain += [SEARCH_OR] + key
+        criteria.append(chain + keys[-1])
+
+    return criteria
+
+# Search the selected folder once per set of sender criteria
+def search_senders(imap, criteria, senders):
+    """
+    Run `UID SEARCH` with the date range and each set of sender criteria 
+    from `sender_criteria` and combine the results.
+
+    Args:
+        imap: The IMAP connection
+        criteria: The search keys from `search_criteria`
+        senders: The sets of criteria from `sender_criteria`
+
+    Returns:
+        list: The UIDs (bytes) that matched any of them, in ascending order
+
+    Raises:
+        FetchError: If any of the searches failed
+    """
+
+    found = set()
+
+    for keys in senders:
+        found.update(search_uids(imap, criteria + keys))
+
+    return sorted(found, key=int)
+
+# Get the UIDVALIDITY of the selected folder
+def get_uidvalidity(imap):
+    """
+    Get the UIDVALIDITY the server sent when the folder was selected. If it
+    changes, the UIDs in the folder have been renumbered.
+
+    Args:
+        imap: The IMAP connection, after `select`
+
+    Returns:
+        int: The UIDVALIDITY or 0 if the server didn't send one
+    """
+
+    try:
+        status, data = imap.response('UIDVALIDITY')
+        return int(data[-1])
+    except Exception as e:
+        return 0
+
+# Search the selected folder and return the matching UIDs
+def search_uids(imap, criteria):
+    """
+    Run `UID SEARCH` on the currently selected folder.
+
+    Args:
+        imap: The IMAP connection
+        criteria: The search keys from `search_criteria`
+
+    Returns:
+        list: The UIDs (bytes) in ascending order, empty if none
+
+    Raises:
+        FetchError: If the search failed
+    """
+
+    try:
+        status, data = imap.uid('SEARCH', None, *criteria)
+    except Exception as e:
+        logging.error(f"search_uids: {criteria}. Error {e}")
+        raise FetchError(f"search_uids: {e}") from e
+
+    if status != 'OK':
+        logging.error(f"search_uids: {criteria}. Error {status}")
+        raise FetchError(f"search_uids: {status}")
+
+    if not data or not data[0]:
+        return []
+
+    return data[0].split()
+
+# Convert a list of UIDs into an IMAP UID set e.g. "1:5,7,9:10"
+def uid_set(uids):
+    """
+    Build a compact IMAP UID set from a list of UIDs, collapsing runs of
+    consecutive UIDs into ranges.
+
+    Args:
+        uids: The UIDs (bytes, str or int) in any order
+
+    Returns:
+        str: The UID set e.g. "1:5,7,9:10"
+    """
+
+    numbers = sorted(int(uid) for uid in uids)
+    ranges = []
+
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+
+    return ','.join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+# Split a list into chunks of at most `size` items
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# Get the size of each message
+def fetch_sizes(imap, uids):
+    """
+    Ask the server for the `RFC822.SIZE` of each message so the batches can
+    be sized without downloading anything.
+
+    Args:
+        imap: The IMAP connection
+        uids: The UIDs of the messages
+
+    Returns:
+        dict: The size in bytes keyed by UID (bytes), missing if unknown
+
+    Raises:
+        FetchError: If any of the fetches failed
+    """
+
+    sizes = {}
+
+    for chunk in chunks(uids, SIZE_CHUNK):
+        try:
+            status, data = imap.uid('FETCH', uid_set(chunk), FETCH_SIZE)
+        except Exception as e:
+            logging.error(f"fetch_sizes: {e}")
+            raise FetchError(f"fetch_sizes: {e}") from e
+
+        if status != 'OK':
+            logging.error(f"fetch_sizes: {status}")
+            raise FetchError(f"fetch_sizes: {status}")
+
+        for line in data:
+            if isinstance(line, tuple):
+                line = line[0]
+            if not isinstance(line, bytes):
+                continue
+            uid = UID_PATTERN.search(line)
+            size = SIZE_PATTERN.search(line)
+            if uid and size:
+                sizes[uid.group(1)] = int(size.group(1))
+
+    return sizes
+
+# Group the UIDs into batches limited by count and total size
+def plan_batches(uids, sizes, batch_size, batch_bytes):
+    """
+    Split the UIDs into batches to fetch in one command each. A batch is 
+    closed when it has `batch_size` messages or adding the next message
+    would take it over `batch_bytes`, so a run of huge messages doesn't 
+    blow up memory. A message bigger than `batch_bytes` gets a batch of
+    its own.
+
+    Args:
+        uids: The UIDs in the order they should be processed
+        sizes: The message sizes from `fetch_sizes`
+        batch_size: The maximum number of messages per batch
+        batch_bytes: The maximum total size of a batch
+
+    Returns:
+        list: The batches, each a list of UIDs
+    """
+
+    batches = []
+    batch = []
+    total = 0
+    batch_size = max(1, batch_size)
+
+    for uid in uids:
+        size = sizes.get(uid, 0)
+
+        if batch and (len(batch) >= batch_size or total + size > batch_bytes):
+            batches.append(batch)
+            batch = []
+            total = 0
+
+        batch.append(uid)
+        total += size
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+# Fetch a batch of messages with one command
+def fetch_batch(imap, uids, parts=FETCH_RFC822):
+    """
+    Fetch a batch of messages with a single `UID FETCH` so there's one round
+    trip per batch rather than per message.
+
+    Args:
+        imap: The IMAP connection
+        uids: The UIDs in the batch
+        parts: The message data items to fetch
+
+    Returns:
+        dict: The response tuple for each message keyed by UID (bytes), in 
+              the same form as a single `imap.fetch` response item
+
+    Raises:
+        FetchError: If the fetch failed
+    """
+
+    responses = {}
+
+    try:
+        status, data = imap.uid('FETCH', uid_set(uids), parts)
+    except Exception as e:
+        logging.error(f"fetch_batch: {e}")
+        raise FetchError(f"fetch_batch: {e}") from e
+
+    if status != 'OK':
+        logging.error(f"fetch_batch: {status}")
+        raise FetchError(f"fetch_batch: {status}")
+
+    for i, item in enumerate(data):
+        if isinstance(item, tuple):
+            uid = UID_PATTERN.search(item[0])
+
+            # some servers put the UID after the message e.g. b' UID 5)'
+            if not uid and i + 1 < len(data) and isinstance(data[i + 1], bytes):
+                uid = UID_PATTERN.search(data[i + 1])
+
+            if uid:
+                responses[uid.group(1)] = item
+
+    return responses
+
+# Get the size and the main header fields of each message
+def fetch_headers(imap, uids):
+    """
+    Fetch just the header fields needed to decide if a message is wanted, 
+    along with its size, without marking it as read.
+
+    Args:
+        imap: The IMAP connection
+        uids: The UIDs of the messages
+
+    Returns:
+        dict: (size, header bytes) keyed by UID (bytes)
+
+    Raises:
+        FetchError: If any of the fetches failed
+    """
+
+    headers = {}
+
+    for chunk in chunks(uids, SIZE_CHUNK):
+        for uid, item in fetch_batch(imap, chunk, FETCH_HEADERS).items():
+            size = SIZE_PATTERN.search(item[0])
+            headers[uid] = (int(size.group(1)) if size else 0, item[1])
+
+    return headers
+
+# Split the pieces of a FETCH response into tokens
+def tokenize(data):
+    """
+    Turn what imaplib returns for a FETCH into one list of tokens. The 
+    literals imaplib split out, e.g. the message itself, are put back 
+    where their `{n}` was.
+
+    Args:
+        data: The list of bytes and (bytes, literal) tuples from imaplib
+
+    Returns:
+        list: Tokens, `(LITERAL, bytes)` for the literals
+    """
+
+    tokens = []
+
+    for item in data:
+        if isinstance(item, tuple):
+            line, literal = item[0], item[1]
+        else:
+            line, literal = item, None
+
+        if not isinstance(line, bytes):
+            continue
+
+        for match in TOKEN_PATTERN.finditer(line):
+            token = match.group(0)
+            if not token.startswith(b'{'):
+                tokens.append(token)
+
+        if literal is not None:
+            tokens.append((LITERAL, literal))
+
+    return tokens
+
+# Turn the tokens into nested lists
+def parse_tokens(tokens):
+    """
+    Build nested lists from the tokens: atoms become `str`, `NIL` becomes 
+    None, quoted strings become `str` without the quotes, and literals 
+    stay `bytes`.
+
+    Args:
+        tokens: From `tokenize`
+
+    Returns:
+        list: The values, a list for each pair of parentheses
+    """
+
+    stack = [[]]
+
+    for token in tokens:
+        if isinstance(token, tuple):
+            stack[-1].append(token[1])
+        elif token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) > 1:
+                group = stack.pop()
+                stack[-1].append(group)
+        elif token.startswith(b'"'):
+            stack[-1].append(ESCAPE_PATTERN.sub(rb'\1', token[1:-1]).decode('utf-8', 'replace'))
+        elif token.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token.decode('utf-8', 'replace'))
+
+    while len(stack) > 1:
+        group = stack.pop()
+        stack[-1].append(group)
+
+    return stack[0]
+
+# Fetch some data items of each message and parse the responses
+def fetch_items(imap, uids, parts):
+    """
+    Fetch data items for a batch of messages with one `UID FETCH` and parse
+    the responses, e.g. `BODYSTRUCTURE` into nested lists.
+
+    Args:
+        imap: The IMAP connection
+        uids: The UIDs in the batch
+        parts: The message data items e.g. "(BODYSTRUCTURE BODY.PEEK[1])"
+
+    Returns:
+        dict: For each UID (bytes), a dict of the values keyed by the 
+              upper case item name e.g. "BODY[1]"
+
+    Raises:
+        FetchError: If the fetch failed
+    """
+
+    results = {}
+
+    try:
+        status, data = imap.uid('FETCH', uid_set(uids), parts)
+    except Exception as e:
+        logging.error(f"fetch_items: {e}")
+        raise FetchError(f"fetch_items: {e}") from e
+
+    if status != 'OK':
+        logging.error(f"fetch_items: {status}")
+        raise FetchError(f"fetch_items: {status}")
+
+    values = parse_tokens(tokenize(data))
+
+    # each message is a sequence number followed by its list of items
+    for items in values:
+        if not isinstance(items, list):
+            continue
+
+        found = {}
+        for i in range(0, len(items) - 1, 2):
+            if isinstance(items[i], str):
+                found[items[i].upper()] = items[i + 1]
+
+        uid = found.get('UID')
+        if uid:
+            results[str(uid).encode()] = found
+
+    return results
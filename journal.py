@@ -0,0 +1,193 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILE = "journal.db"
+
+CREATE_UIDS_TABLE = """
+    CREATE TABLE IF NOT EXISTS done_uids (
+        account TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        uidvalidity INTEGER NOT NULL,
+        uid INTEGER NOT NULL,
+        PRIMARY KEY (account, folder, uidvalidity, uid)
+    )
+"""
+
+CREATE_MESSAGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS messages (
+        account TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        uid INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )
+"""
+
+class Journal:
+    """
+    Write-ahead journal of a run so it can be resumed if it's interrupted,
+    e.g. the connection drops or the process is killed, instead of losing
+    everything that's only in memory until the Markdown is written.
+
+    For each batch of emails fetched, the UIDs done and the messages kept
+    are saved together, so the journal never says an email is done without
+    its message. They're committed at most every `interval` seconds to keep
+    the cost down, so up to that much of the work can be lost. Once the
+    Markdown is written, the run is complete and the journal is emptied.
+
+    It's a SQLite database next to the config files and can be shared by
+    the threads fetching different folders.
+    """
+
+    def __init__(self, folder, interval):
+        self.file_path = os.path.join(folder, JOURNAL_FILE)
+        self.interval = interval
+        self.connection = None
+        self.lock = threading.Lock()
+        self.committed = 0
+
+    def open(self):
+        """
+        Open the database, creating it if needed.
+
+        Returns:
+            bool: True if it was opened, False otherwise
+        """
+
+        try:
+            self.connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self.connection.execute(CREATE_UIDS_TABLE)
+            self.connection.execute(CREATE_MESSAGES_TABLE)
+            self.connection.commit()
+        except Exception as e:
+            logging.error(f"Journal.open: {self.file_path}. Error {e}")
+            self.connection = None
+            return False
+
+        self.committed = time.monotonic()
+
+        return True
+
+    def close(self):
+        if self.connection:
+            try:
+                with self.lock:
+                    self.connection.commit()
+            except Exception as e:
+                logging.error(f"Journal.close: {self.file_path}. Error {e}")
+            self.connection.close()
+            self.connection = None
+
+    # Record a batch of emails as done, along with the messages kept
+    def save(self, account, folder, uidvalidity, uids, messages):
+        """
+        Add the UIDs and messages to the journal, committing them if it's
+        been `interval` seconds since the last time.
+
+        Args:
+            account: The email account
+            folder: The folder name
+            uidvalidity: The UIDVALIDITY of the folder
+            uids: The UIDs (bytes) done, kept or not
+            messages: (UID, Message) of the ones kept
+
+        Returns:
+            int: The number of bytes of messages saved, -1 on error
+        """
+
+        if not self.connection:
+            return 0
+
+        rows = [(account, folder, int(uid), pickle.dumps(the_message, pickle.HIGHEST_PROTOCOL))
+                for uid, the_message in messages]
+
+        try:
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO done_uids VALUES (?, ?, ?, ?)",
+                    [(account, folder, uidvalidity, int(uid)) for uid in uids])
+                self.connection.executemany("INSERT INTO messages VALUES (?, ?, ?, ?)", rows)
+                if time.monotonic() - self.committed >= self.interval:
+                    self.connection.commit()
+                    self.committed = time.monotonic()
+        except Exception as e:
+            logging.error(f"Journal.save: {folder}. Error {e}")
+            return -1
+
+        return sum(len(row[3]) for row in rows)
+
+    # Get the UIDs of a folder done before the run was interrupted
+    def get_uids(self, account, folder, uidvalidity):
+        """
+        Returns:
+            set: The UIDs (int) done, empty if none or the folder's
+                 UIDVALIDITY changed
+        """
+
+        if not self.connection:
+            return set()
+
+        try:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT uid FROM done_uids WHERE account = ? AND folder = ? AND uidvalidity = ?",
+                    (account, folder, uidvalidity)).fetchall()
+        except Exception as e:
+            logging.error(f"Journal.get_uids: {folder}. Error {e}")
+            return set()
+
+        return {row[0] for row in rows}
+
+    # Get the messages kept before the run was interrupted
+    def get_messages(self, account):
+        """
+        Returns:
+            list: The Message objects, in the order they were kept
+        """
+
+        messages = []
+
+        if not self.connection:
+            return messages
+
+        try:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT folder, uid, data FROM messages WHERE account = ? ORDER BY rowid",
+                    (account,)).fetchall()
+        except Exception as e:
+            logging.error(f"Journal.get_messages: {account}. Error {e}")
+            return messages
+
+        for folder, uid, data in rows:
+            try:
+                messages.append(pickle.loads(data))
+            except Exception as e:
+                logging.error(f"Journal.get_messages: {folder} UID {uid}. Error {e}")
+
+        return messages
+
+    # Forget the journal of an account, e.g. once its run is complete
+    def clear(self, account):
+        """
+        Returns:
+            bool: True if cleared, False otherwise
+        """
+
+        if not self.connection:
+            return False
+
+        try:
+            with self.lock:
+                self.connection.execute("DELETE FROM done_uids WHERE account = ?", (account,))
+                self.connection.execute("DELETE FROM messages WHERE account = ?", (account,))
+                self.connection.commit()
+                self.committed = time.monotonic()
+        except Exception as e:
+            logging.error(f"Journal.clear: {account}. Error {e}")
+            return False
+
+        return True
@@ -0,0 +1,300 @@
+import binascii
+import email.message
+import logging
+import os
+import re
+import tempfile
+from email.parser import BytesHeaderParser
+
+import imap_utils
+
+# bytes of an email downloaded per FETCH
+FETCH_CHUNK = 4 * 1024 * 1024
+
+# bytes of a part decoded at a time
+DECODE_CHUNK = 1024 * 1024
+
+# longer lines are read a piece at a time
+MAX_LINE = 64 * 1024
+
+TEMP_PREFIX = "email_md_"
+
+BASE64 = "base64"
+QUOTED_PRINTABLE = "quoted-printable"
+NOT_BASE64_PATTERN = re.compile(rb'[^A-Za-z0-9+/=]')
+
+class SpooledPart(email.message.Message):
+    """
+    A part of a large email, with just its header in memory. Its body,
+    still encoded, is in the file at `body_path` and is only read in, up
+    to `max_bytes`, when the payload is asked for.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.body_path = None
+        self.body_size = 0
+        self.max_bytes = 0
+        self.loaded = False
+        self.cut = False
+
+    def get_payload(self, i=None, decode=False):
+        if self.body_path and not self.loaded:
+            self.cut = self.load(self.max_bytes)
+        return super().get_payload(i, decode)
+
+    @property
+    def encoding(self):
+        return str(self.get('Content-Transfer-Encoding', '')).strip().lower()
+
+    # Put the start of the body in the payload, e.g. for the text parts
+    def load(self, max_bytes):
+        """
+        Read the body into the payload so the part can be decoded like any
+        other, up to about `max_bytes` once decoded.
+
+        Args:
+            max_bytes: The most to read, 0 for all of it
+
+        Returns:
+            bool: True if the body was cut short
+        """
+
+        limit = self.body_size
+        if max_bytes:
+            # base64 takes 4 bytes for every 3
+            limit = min(limit, max_bytes * 4 // 3 if self.encoding == BASE64 else max_bytes)
+
+        with open(self.body_path, 'rb') as body_file:
+            data = body_file.read(limit)
+        self.loaded = True
+
+        # the email package expects the payload of a parsed email as text
+        self.set_payload(data.decode('ascii', 'surrogateescape'))
+
+        return limit < self.body_size
+
+# Decode the body of a spooled part a piece at a time
+def decoded_chunks(part):
+    """
+    Decode the body of a part straight from its file, like
+    `media_store.decoded_chunks` does for a part in memory.
+
+    Args:
+        part: A SpooledPart
+
+    Returns:
+        Iterator of bytes
+    """
+
+    encoding = part.encoding
+    rest = b''
+
+    with open(part.body_path, 'rb') as body_file:
+        while True:
+            data = body_file.read(DECODE_CHUNK)
+            if not data:
+                break
+            data = rest + data
+
+            if encoding == BASE64:
+                # only whole groups of 4 characters can be decoded
+                data = NOT_BASE64_PATTERN.sub(b'', data)
+                cut = len(data) - len(data) % 4
+            elif encoding == QUOTED_PRINTABLE:
+                # a soft line break joins a line to the next one
+                cut = data.rfind(b'\n') + 1
+            else:
+                cut = len(data)
+
+            data, rest = data[:cut], data[cut:]
+            yield decode(data, encoding)
+
+    # be forgiving about missing padding, like the email package is
+    if encoding == BASE64:
+        rest = rest.rstrip(b'=')
+        if len(rest) % 4 > 1:
+            yield decode(rest + b'=' * (-len(rest) % 4), encoding)
+    elif rest:
+        yield decode(rest, encoding)
+
+def decode(data, encoding):
+    try:
+        if encoding == BASE64:
+            return binascii.a2b_base64(data)
+        if encoding == QUOTED_PRINTABLE:
+            return binascii.a2b_qp(data)
+    except binascii.Error as e:
+        logging.error(f"large_message.decode: {e}")
+        return b''
+
+    return data
+
+def is_boundary(line, boundaries):
+    """
+    Check if a line is the delimiter of one of the boundaries.
+
+    Returns:
+        tuple: (the boundary, True if it's the closing one) or None
+    """
+
+    if not line.startswith(b'--'):
+        return None
+
+    line = line.rstrip()
+    for boundary in reversed(boundaries):
+        if line == b'--' + boundary:
+            return boundary, False
+        if line == b'--' + boundary + b'--':
+            return boundary, True
+
+    return None
+
+def read_header(source):
+    lines = []
+
+    for line in source:
+        lines.append(line)
+        if not line.strip():
+            break
+
+    return b''.join(lines)
+
+class Splitter:
+    """
+    Reads a large email from a file one line at a time and writes the body
+    of each leaf part to a file of its own, so no part is ever completely
+    in memory. A forwarded email (message/rfc822) is a leaf.
+    """
+
+    def __init__(self, source, folder, max_bytes=0):
+        self.source = iter(lambda: source.readline(MAX_LINE), b'')
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.parser = BytesHeaderParser(_class=SpooledPart)
+        self.parts = []
+
+    def parse_header(self):
+        return self.parser.parsebytes(read_header(self.source))
+
+    # Read the body of a part, returns the boundary line that ended it
+    def read_part(self, part, boundaries):
+        boundary = part.get_boundary() if part.get_content_maintype() == 'multipart' else None
+
+        if not boundary:
+            return self.spool(part, boundaries)
+
+        boundary = boundary.encode('ascii', 'replace')
+        inner = boundaries + [boundary]
+
+        # skip the preamble
+        line = self.skip(inner)
+
+        while line:
+            found = is_boundary(line, inner)
+            if not found or found[0] != boundary:
+                # a parent's boundary, the part wasn't closed
+                return line
+            if found[1]:
+                # the epilogue
+                return self.skip(boundaries)
+            line = self.read_part(self.parse_header(), inner)
+
+        return line
+
+    def skip(self, boundaries):
+        for line in self.source:
+            if is_boundary(line, boundaries):
+                return line
+        return b''
+
+    # Write the body of a leaf part to a file
+    def spool(self, part, boundaries):
+        handle, part.body_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.folder)
+        part.max_bytes = self.max_bytes
+        self.parts.append(part)
+
+        ending = b''
+        found = b''
+
+        with os.fdopen(handle, 'wb') as body_file:
+            for line in self.source:
+                if boundaries and is_boundary(line, boundaries):
+                    found = line
+                    break
+
+                # the line break before a boundary belongs to the boundary
+                body_file.write(ending)
+                part.body_size += len(ending)
+                text = line.rstrip(b'\r\n')
+                ending = line[len(text):]
+                body_file.write(text)
+                part.body_size += len(text)
+
+            if not found:
+                body_file.write(ending)
+                part.body_size += len(ending)
+
+        return found
+
+# Split a large email into its parts
+def split(file_path, folder, max_bytes=0):
+    """
+    Read an email from a file and spool the body of each part to a file in
+    `folder`.
+
+    Args:
+        file_path: The email
+        folder: Where the bodies go
+        max_bytes: The most of a part to read back into memory, 0 for all
+
+    Returns:
+        tuple: (the raw header bytes, list of the leaf SpooledParts)
+    """
+
+    with open(file_path, 'rb') as source:
+        splitter = Splitter(source, folder, max_bytes)
+        header = read_header(splitter.source)
+        splitter.read_part(splitter.parser.parsebytes(header), [])
+
+    return header, splitter.parts
+
+# Download an email to a file a piece at a time
+def fetch(imap, uid, folder=None):
+    """
+    Download an email with partial FETCHes of `FETCH_CHUNK` bytes so it's
+    never in memory all at once.
+
+    Args:
+        imap: The IMAP connection
+        uid: The UID (bytes)
+        folder: Where to put the file, None for the temporary folder
+
+    Returns:
+        str: The path of the file or None if it couldn't be downloaded
+    """
+
+    handle, file_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".eml", dir=folder)
+    offset = 0
+
+    try:
+        with os.fdopen(handle, 'wb') as email_file:
+            while True:
+                item = f"BODY[]<{offset}>"
+                items = imap_utils.fetch_items(imap, [uid], f"(BODY.PEEK[]<{offset}.{FETCH_CHUNK}>)")
+                data = items.get(uid, {}).get(item)
+                if data is None:
+                    raise ValueError(f"no {item}")
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+
+                email_file.write(data)
+                offset += len(data)
+                if len(data) < FETCH_CHUNK:
+                    break
+    except Exception as e:
+        logging.error(f"large_message.fetch: UID {uid}. Error {e}")
+        os.remove(file_path)
+        return None
+
+    return file_path
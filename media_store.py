@@ -0,0 +1,131 @@
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+# characters of base64 encoded text decoded at a time
+CHUNK_SIZE = 1024 * 1024
+
+# length of the hash in the stored file names, 96 bits is plenty to
+# never have two different attachments with the same name
+HASH_LENGTH = 24
+
+TEMP_PREFIX = ".tmp-"
+
+BASE64 = "base64"
+NOT_BASE64_PATTERN = re.compile(r'[^A-Za-z0-9+/=]')
+SAFE_EXTENSION_PATTERN = re.compile(r'^\.[A-Za-z0-9]{1,10}$')
+
+# Decode the payload of an attachment a piece at a time
+def decoded_chunks(part):
+    """
+    Decode the payload of a part without making a second copy of all of it
+    in memory. base64, used for nearly all attachments, is decoded a chunk
+    at a time, anything else is decoded in one go.
+
+    Args:
+        part: The part of the email with the attachment
+
+    Returns:
+        Iterator of bytes
+    """
+
+    encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+    payload = part.get_payload()
+
+    if encoding != BASE64 or not isinstance(payload, str):
+        yield part.get_payload(decode=True) or b''
+        return
+
+    rest = ''
+
+    for start in range(0, len(payload), CHUNK_SIZE):
+        data = rest + NOT_BASE64_PATTERN.sub('', payload[start:start + CHUNK_SIZE])
+
+        # only whole groups of 4 characters can be decoded
+        cut = len(data) - len(data) % 4
+        yield binascii.a2b_base64(data[:cut])
+        rest = data[cut:]
+
+    # be forgiving about missing padding, like the email package is
+    rest = rest.rstrip('=')
+    if len(rest) % 4 > 1:
+        yield binascii.a2b_base64(rest + '=' * (-len(rest) % 4))
+
+# Name the stored file after its contents
+def stored_name(digest, filename):
+    """
+    Get the name of the stored file, the hash of the contents plus the
+    extension of the original file so it still opens with the right app.
+
+    Args:
+        digest: The hex SHA-256 of the contents
+        filename: The original name of the attachment
+
+    Returns:
+        str: The name e.g. "3f5a0c9e1b2d4a6f8e7c1d2b.pdf"
+    """
+
+    extension = os.path.splitext(filename)[1].lower()
+    if not SAFE_EXTENSION_PATTERN.match(extension):
+        extension = ""
+
+    return digest[:HASH_LENGTH] + extension
+
+# Save an attachment once no matter how many emails it's in
+def save(folder, part, filename, chunks=None):
+    """
+    Save an attachment in the media folder under a name based on its
+    contents. The payload is decoded straight to a temporary file while
+    it's hashed and then renamed in one step, so a file in the folder is
+    always complete. When the same contents were saved before, the new
+    copy is thrown away.
+
+    Args:
+        folder: The media folder, created if needed
+        part: The part of the email with the attachment
+        filename: The original name of the attachment
+        chunks: The decoded contents a piece at a time, if not from the
+                payload of `part`
+
+    Returns:
+        tuple: (the stored file name, its size, True if it's a new file) or
+               None if it couldn't be saved
+    """
+
+    try:
+        os.makedirs(folder, exist_ok=True)
+    except OSError as e:
+        logging.error(f"media_store.save: {folder}. Error {e}")
+        return None
+
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = None
+
+    try:
+        handle, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=folder)
+        with os.fdopen(handle, "wb") as temp_file:
+            for chunk in chunks if chunks is not None else decoded_chunks(part):
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+
+        name = stored_name(digest.hexdigest(), filename)
+        file_path = os.path.join(folder, name)
+
+        if os.path.exists(file_path):
+            os.remove(temp_path)
+            return name, size, False
+
+        os.replace(temp_path, file_path)
+
+    except Exception as e:
+        logging.error(f"media_store.save: {filename}. Error {e}")
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    return name, size, True
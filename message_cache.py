@@ -0,0 +1,200 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+MESSAGE_CACHE_FILE = "message-cache.db"
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS messages (
+        account TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        uidvalidity INTEGER NOT NULL,
+        uid INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        used REAL NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (account, folder, uidvalidity, uid)
+    )
+"""
+
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS messages_used ON messages (used)"
+
+# how many of the least recently used messages to drop at a time
+EVICT_CHUNK = 100
+
+# how many UIDs to look up at a time, SQLite limits the ? in a query
+GET_CHUNK = 500
+
+class MessageCache:
+    """
+    Keeps the raw emails downloaded from the IMAP server, compressed, so
+    the next run doesn't need to download them again and the Markdown can
+    be rebuilt from them alone with `rerender`.
+
+    The emails are keyed by account, folder, UIDVALIDITY and UID. When the
+    cache is bigger than its limit, the least recently used emails are
+    dropped. It's a SQLite database next to the config files and can be
+    shared by the threads fetching different folders.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.file_path = os.path.join(folder, MESSAGE_CACHE_FILE)
+        self.max_bytes = max_bytes
+        self.connection = None
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def open(self):
+        """
+        Open the database, creating it if needed.
+
+        Returns:
+            bool: True if it was opened, False otherwise
+        """
+
+        try:
+            self.connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self.connection.execute(CREATE_TABLE)
+            self.connection.execute(CREATE_INDEX)
+            self.connection.commit()
+            self.total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        except Exception as e:
+            logging.error(f"MessageCache.open: {self.file_path}. Error {e}")
+            self.connection = None
+            return False
+
+        return True
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    # Get the cached emails in a folder
+    def get(self, account, folder, uidvalidity, uids):
+        """
+        Get the emails that are in the cache and mark them as just used.
+
+        Args:
+            account: The email account
+            folder: The folder name
+            uidvalidity: The UIDVALIDITY of the folder
+            uids: The UIDs (bytes) wanted
+
+        Returns:
+            dict: The raw RFC822 bytes keyed by UID (bytes), only for the
+                  emails found
+        """
+
+        found = {}
+        rows = []
+
+        if not self.connection or not uids:
+            return found
+
+        try:
+            with self.lock:
+                for i in range(0, len(uids), GET_CHUNK):
+                    chunk = [int(uid) for uid in uids[i:i + GET_CHUNK]]
+                    marks = ','.join('?' * len(chunk))
+                    rows += self.connection.execute(
+                        f"SELECT uid, data FROM messages WHERE account = ? AND folder = ? AND uidvalidity = ? AND uid IN ({marks})",
+                        [account, folder, uidvalidity] + chunk).fetchall()
+                if rows:
+                    self.connection.executemany(
+                        "UPDATE messages SET used = ? WHERE account = ? AND folder = ? AND uidvalidity = ? AND uid = ?",
+                        [(time.time(), account, folder, uidvalidity, uid) for uid, data in rows])
+                    self.connection.commit()
+        except Exception as e:
+            logging.error(f"MessageCache.get: {folder}. Error {e}")
+            return found
+
+        for uid, data in rows:
+            try:
+                found[str(uid).encode()] = zlib.decompress(data)
+            except Exception as e:
+                logging.error(f"MessageCache.get: {folder} UID {uid}. Error {e}")
+
+        return found
+
+    # Add downloaded emails to the cache
+    def put(self, account, folder, uidvalidity, messages):
+        """
+        Compress and save emails, then drop the least recently used ones
+        if the cache is over its limit. Does nothing without a limit.
+
+        Args:
+            account: The email account
+            folder: The folder name
+            uidvalidity: The UIDVALIDITY of the folder
+            messages: The raw RFC822 bytes keyed by UID
+
+        Returns:
+            bool: True if saved, False otherwise
+        """
+
+        if not self.connection or not self.max_bytes or not messages:
+            return False
+
+        now = time.time()
+        rows = []
+        for uid, raw in messages.items():
+            data = zlib.compress(raw)
+            rows.append((account, folder, uidvalidity, int(uid), len(data), now, data))
+
+        try:
+            with self.lock:
+                for row in rows:
+                    old = self.connection.execute(
+                        "SELECT size FROM messages WHERE account = ? AND folder = ? AND uidvalidity = ? AND uid = ?",
+                        row[:4]).fetchone()
+                    self.connection.execute("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+                    self.total += row[4] - (old[0] if old else 0)
+                self.evict()
+                self.connection.commit()
+        except Exception as e:
+            logging.error(f"MessageCache.put: {folder}. Error {e}")
+            return False
+
+        return True
+
+    # Drop the least recently used emails until the cache fits, with the lock held
+    def evict(self):
+        while self.total > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT rowid, size FROM messages ORDER BY used LIMIT ?", (EVICT_CHUNK,)).fetchall()
+            if not rows:
+                self.total = 0
+                break
+
+            dropped = 0
+            for rowid, size in rows:
+                if self.total - dropped <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM messages WHERE rowid = ?", (rowid,))
+                dropped += size
+
+            self.total -= dropped
+
+    # List the cached emails of an account
+    def keys(self, account):
+        """
+        Returns:
+            list: (folder, UIDVALIDITY, UID) of each email in the cache, by
+                  folder and newest first
+        """
+
+        if not self.connection:
+            return []
+
+        try:
+            with self.lock:
+                return self.connection.execute(
+                    "SELECT folder, uidvalidity, uid FROM messages WHERE account = ? ORDER BY folder, uidvalidity, uid DESC",
+                    (account,)).fetchall()
+        except Exception as e:
+            logging.error(f"MessageCache.keys: {account}. Error {e}")
+            return []
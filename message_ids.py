@@ -0,0 +1,73 @@
+import threading
+
+class MessageIds:
+    """
+    The Message-IDs of the emails already processed, so the other copies of
+    an email, e.g. in Gmail's INBOX, `[Gmail]/All Mail` and each label
+    folder, are skipped. Shared by the threads fetching different folders.
+
+    The IDs added since the last `take_new` can be saved so later runs
+    skip them too.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.new = []
+
+    # Take off the angle brackets and spaces around a Message-ID
+    @staticmethod
+    def normalize(message_id):
+        return str(message_id or "").strip().strip('<>').strip()
+
+    # Add the IDs processed on earlier runs
+    def load(self, message_ids):
+        with self.lock:
+            self.seen.update(message_ids)
+
+    def __contains__(self, message_id):
+        key = self.normalize(message_id)
+
+        with self.lock:
+            return bool(key) and key in self.seen
+
+    def add(self, message_id):
+        """
+        Remember that an email was processed.
+
+        Args:
+            message_id: The Message-ID header of the email
+
+        Returns:
+            bool: False if a copy was already processed, True otherwise,
+                  including when the email has no Message-ID
+        """
+
+        key = self.normalize(message_id)
+        if not key:
+            return True
+
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+            self.new.append(key)
+
+        return True
+
+    # Forget an email added but then not kept, e.g. for `max_messages`
+    def discard(self, message_id):
+        key = self.normalize(message_id)
+
+        with self.lock:
+            if key in self.seen:
+                self.seen.discard(key)
+                if key in self.new:
+                    self.new.remove(key)
+
+    # Get the IDs added since the last time, to save them
+    def take_new(self):
+        with self.lock:
+            new, self.new = self.new, []
+
+        return new
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+FORMAT_JSON = "json"
+FORMAT_PROMETHEUS = "prometheus"
+
+# prefix of the Prometheus metric names
+PROMETHEUS_PREFIX = "email_md"
+
+# the latencies kept per stage to work out the percentiles, after this many
+# a random sample of them is kept
+MAX_SAMPLES = 10000
+
+PERCENTILES = [("p50", 0.5), ("p95", 0.95)]
+
+class Stage:
+    """
+    The totals and a sample of the latencies for one stage of processing
+    e.g. fetching or cleaning.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.max = 0.0
+        self.samples = []
+        self.random = random.Random(0)
+
+    def add(self, seconds, size=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.bytes += size
+        self.max = max(self.max, seconds)
+
+        # keep a fair sample of the latencies without growing forever
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            i = self.random.randrange(self.calls)
+            if i < MAX_SAMPLES:
+                self.samples[i] = seconds
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def as_dict(self):
+        result = {
+            "calls": self.calls,
+            "seconds": round(self.seconds, 6),
+            "bytes": self.bytes,
+        }
+
+        for label, fraction in PERCENTILES:
+            result[label] = round(self.percentile(fraction), 6)
+        result["max"] = round(self.max, 6)
+
+        return result
+
+class Timer:
+    """
+    Times a `with` block and records it as one call of a stage. The number
+    of bytes handled can be set on the timer inside the block.
+    """
+
+    def __init__(self, metrics, name, size=0):
+        self.metrics = metrics
+        self.name = name
+        self.size = size
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.size)
+        return False
+
+class Metrics:
+    """
+    Timings of each stage of a run and counters, shared by the threads.
+
+    In a worker process, `start_forwarding` makes the timings and counts 
+    pile up until `take` hands them back so the parent process can `merge`
+    them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        self.forwarding = False
+        self.forward = []
+        self.forward_counts = {}
+        self.writer = None
+        self.write_args = None
+        self.stop_event = threading.Event()
+
+    def timer(self, name, size=0):
+        return Timer(self, name, size)
+
+    def record(self, name, seconds, size=0):
+        with self.lock:
+            if self.forwarding:
+                self.forward.append((name, seconds, size))
+                return
+
+            stage = self.stages.get(name)
+            if not stage:
+                stage = self.stages[name] = Stage(name)
+            stage.add(seconds, size)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            counters = self.forward_counts if self.forwarding else self.counters
+            counters[name] = counters.get(name, 0) + amount
+
+    def start_forwarding(self):
+        with self.lock:
+            self.forwarding = True
+            self.forward = []
+            self.forward_counts = {}
+
+    # Get the timings and counts waiting to go to the parent process
+    def take(self):
+        with self.lock:
+            records, self.forward = self.forward, []
+            counts, self.forward_counts = self.forward_counts, {}
+
+        return records, counts
+
+    # Add the timings and counts from a worker process
+    def merge(self, taken):
+        records, counts = taken
+
+        for name, seconds, size in records:
+            self.record(name, seconds, size)
+
+        for name, amount in counts.items():
+            self.count(name, amount)
+
+    def snapshot(self):
+        """
+        Get everything recorded so far.
+
+        Returns:
+            dict: The start time, the seconds since, the counters and, for
+                  each stage, the calls, seconds, bytes, p50, p95 and max
+        """
+
+        with self.lock:
+            return {
+                "started": int(self.started),
+                "elapsed": round(time.time() - self.started, 3),
+                "counters": dict(self.counters),
+                "stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_prometheus(self):
+        """
+        Describe the metrics in the Prometheus text format e.g. for the
+        node_exporter textfile collector.
+
+        Returns:
+            str: The metrics, one per line
+        """
+
+        snapshot = self.snapshot()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# TYPE {prefix}_run_started_seconds gauge",
+            f"{prefix}_run_started_seconds {snapshot['started']}",
+            f"# TYPE {prefix}_run_elapsed_seconds gauge",
+            f"{prefix}_run_elapsed_seconds {snapshot['elapsed']}",
+        ]
+
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        stages = sorted(snapshot["stages"].items())
+
+        lines.append(f"# TYPE {prefix}_stage_seconds summary")
+        for name, stage in stages:
+            for label, fraction in PERCENTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{fraction}"}} {stage[label]}')
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="1"}} {stage["max"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["calls"]}')
+
+        lines.append(f"# TYPE {prefix}_stage_bytes_total counter")
+        for name, stage in stages:
+            lines.append(f'{prefix}_stage_bytes_total{{stage="{name}"}} {stage["bytes"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    # Save the metrics, replacing the file in one step
+    def write(self, file_path, format=FORMAT_JSON):
+        """
+        Write the metrics to a file. It's written to a temporary file first
+        so whatever reads it never sees a partial file.
+
+        Args:
+            file_path: Where to write them
+            format: FORMAT_JSON or FORMAT_PROMETHEUS
+
+        Returns:
+            bool: True if written, False otherwise
+        """
+
+        text = self.to_prometheus() if format == FORMAT_PROMETHEUS else self.to_json()
+        temp_path = file_path + ".tmp"
+
+        try:
+            with open(temp_path, "w") as metrics_file:
+                metrics_file.write(text)
+            os.replace(temp_path, file_path)
+        except Exception as e:
+            logging.error(f"Metrics.write: {file_path}. Error {e}")
+            return False
+
+        return True
+
+    # Write the metrics every so often until `stop_writing`
+    def start_writing(self, file_path, format=FORMAT_JSON, interval=0):
+        """
+        Write the metrics to a file now and then and at the end.
+
+        Args:
+            file_path: Where to write them
+            format: FORMAT_JSON or FORMAT_PROMETHEUS
+            interval: Seconds between writes, 0 to only write at the end
+        """
+
+        self.write_args = (file_path, format)
+
+        if interval > 0:
+            def run():
+                while not self.stop_event.wait(interval):
+                    self.write(file_path, format)
+
+            self.writer = threading.Thread(target=run, daemon=True)
+            self.writer.start()
+
+    def stop_writing(self):
+        self.stop_event.set()
+
+        if self.writer:
+            self.writer.join()
+            self.writer = None
+
+        if self.write_args:
+            self.write(*self.write_args)
@@ -0,0 +1,115 @@
+import logging
+
+class PeopleIndex:
+    """
+    Finds the person for an email address, remembering every answer so each
+    distinct address is only looked up in the people from `people.json`
+    once per run however many emails it's in.
+
+    Addresses are compared in lower case. When there's no exact match, a
+    plus address e.g. "bob+lists@acme.com" is tried without the tag, then
+    the domain rules e.g. "acme.com=bob" send any address at the domain, or
+    its subdomains, to a person.
+    """
+
+    def __init__(self, the_config):
+        self.config = the_config
+        self.cache = {}
+        self.domains = {}
+
+    # Lower case the address and take off any angle brackets
+    @staticmethod
+    def normalize(address):
+        return (address or "").strip().strip('<>').strip().lower()
+
+    # Add domain rules like "acme.com=bob;example.org=alice"
+    def add_domain_rules(self, rules):
+        """
+        Map every address at a domain to a person.
+
+        Args:
+            rules: "domain=slug" pairs separated by ';'
+
+        Returns:
+            list: The rules whose slug isn't a known person
+        """
+
+        unknown = []
+        people = {person.slug: person for person in getattr(self.config, "people", [])}
+
+        for rule in rules.split(';'):
+            if '=' not in rule:
+                continue
+            domain, slug = [part.strip() for part in rule.split('=', 1)]
+            person = people.get(slug)
+            if person:
+                self.domains[domain.lower().lstrip('@')] = person
+            else:
+                unknown.append(rule.strip())
+
+        # the answers may have changed
+        self.cache = {}
+
+        return unknown
+
+    # Every email address of the people and the domains in the rules
+    def addresses(self):
+        """
+        Returns:
+            set: The addresses in lower case, for searching on the server
+        """
+
+        found = set(self.domains)
+
+        for person in getattr(self.config, "people", []):
+            emails = getattr(person, "emails", None) or getattr(person, "email", None) or []
+            if isinstance(emails, str):
+                emails = emails.split(';')
+            found.update(self.normalize(address) for address in emails if address and address.strip())
+
+        return found
+
+    def lookup(self, address):
+        try:
+            return self.config.get_person_by_email(address)
+        except Exception as e:
+            logging.error(f"PeopleIndex.lookup: {address}. Error {e}")
+            return None
+
+    def find_by_domain(self, domain):
+        while domain:
+            person = self.domains.get(domain)
+            if person:
+                return person
+            domain = domain.partition('.')[2]
+
+        return None
+
+    def find(self, address):
+        """
+        Find the person with an email address.
+
+        Args:
+            address: The email address e.g. "Bob+news@Acme.com"
+
+        Returns:
+            The Person or None if there's no one with that address
+        """
+
+        key = self.normalize(address)
+
+        if key in self.cache:
+            return self.cache[key]
+
+        person = self.lookup(key)
+        local, at, domain = key.rpartition('@')
+
+        if not person and at and '+' in local:
+            person = self.lookup(local.split('+', 1)[0] + at + domain)
+
+        if not person and at and self.domains:
+            person = self.find_by_domain(domain)
+
+        self.cache[key] = person
+
+        return person
@@ -0,0 +1,132 @@
+import re
+
+# the first line of the email being replied to, in a plain text or Markdown body
+TEXT_BOUNDARIES = [
+    # Gmail, Apple Mail, Thunderbird: "On Mon, Oct 9, 2023 at 1:06 PM Bob Smith <bob@smith.com> wrote:",
+    # sometimes wrapped over two lines
+    r'^[ \t]*On\s(?:[^\n]|\n(?![ \t]*\n)){0,400}?\swrote\s?:',
+    # in French: "Le lun. 9 oct. 2023 à 13:06, Bob Smith <bob@smith.com> a écrit :"
+    r'^[ \t]*Le\s(?:[^\n]|\n(?![ \t]*\n)){0,400}?\sa écrit\s?:',
+    # Outlook: a "From:" line followed by a "Sent:" or "Date:" line, bold once it's Markdown
+    r'^[ \t]*(?:\*\*)?(?:From|De)\s?:(?:\*\*)?[^\n]{0,400}\n[ \t]*(?:\*\*)?(?:Sent|Date|Envoyé)\s?:',
+    # "-----Original Message-----" and "----- Message d'origine -----"
+    r'^[ \t]*-{2,}\s*(?i:Original Message|Message d\'origine)\s*-{2,}',
+]
+
+# where the email being replied to starts in an HTML body
+HTML_BOUNDARIES = [
+    # Gmail
+    r'<div[^>]{0,200}\bclass="?gmail_quote',
+    # Apple Mail, Thunderbird
+    r'<blockquote[^>]{0,200}\btype="?cite',
+    # Outlook
+    r'<div[^>]{0,200}\bid="?(?:divRplyFwdMsg|appendonsend)',
+    # Yahoo!
+    r'<div[^>]{0,200}\bclass="?yahoo_quoted',
+    # Outlook desktop, a bold "From:" followed by a "Sent:"
+    r'<b>(?:<span[^>]{0,200}>)?(?:From|De)\s?:(?:</span>)?</b>[^<]{0,400}(?:<[^>]{0,200}>[^<]{0,400}){0,10}?(?:Sent|Date|Envoyé)\s?:',
+    r'-{2,}\s*(?:Original Message|Message d\'origine)\s*-{2,}',
+]
+
+TEXT_BOUNDARY_PATTERN = re.compile('|'.join(f'(?:{pattern})' for pattern in TEXT_BOUNDARIES), re.MULTILINE)
+HTML_BOUNDARY_PATTERN = re.compile('|'.join(f'(?:{pattern})' for pattern in HTML_BOUNDARIES), re.IGNORECASE)
+
+# a forwarded email is the content, not a reply, even if it looks like one
+FORWARDED_PATTERN = re.compile(r'forwarded message|message transféré', re.IGNORECASE)
+
+# how far around a boundary to look for "Forwarded message"
+FORWARDED_BEFORE = 200
+FORWARDED_AFTER = 500
+
+# Find where the quoted lines at the end of a body start
+def quoted_tail(text):
+    """
+    Find the lines at the end of the body that all start with ">", with
+    any blank lines between them, i.e. the replied-to email quoted in full.
+
+    Args:
+        text: The body
+
+    Returns:
+        int: Where the first of those lines starts, -1 if the body doesn't
+             end with a quote
+    """
+
+    start = -1
+    offset = len(text)
+
+    for line in reversed(text.split('\n')):
+        offset -= len(line)
+        stripped = line.strip()
+        if stripped.startswith('>'):
+            start = offset
+        elif stripped:
+            break
+        offset -= 1
+
+    return start
+
+def is_forwarded(text, position):
+    window = text[max(0, position - FORWARDED_BEFORE):position + FORWARDED_AFTER]
+
+    return FORWARDED_PATTERN.search(window) is not None
+
+# Find where the email being replied to starts
+def find_boundary(text, html=False):
+    """
+    Find the first marker the common email clients put before the email
+    being replied to, e.g. "On ... wrote:" or an Outlook "From:" and "Sent:"
+    block, or the quoted lines it ends with.
+
+    A marker with nothing but blank lines before it isn't the boundary,
+    e.g. when the replied-to email is quoted first and answered after, and
+    neither is one near "Forwarded message".
+
+    Args:
+        text: The body
+        html: True if the body is HTML
+
+    Returns:
+        int: Where the replied-to email starts, -1 if there isn't one
+    """
+
+    pattern = HTML_BOUNDARY_PATTERN if html else TEXT_BOUNDARY_PATTERN
+    boundary = -1
+
+    for match in pattern.finditer(text):
+        if not is_forwarded(text, match.start()):
+            boundary = match.start()
+            break
+
+    if not html:
+        start = quoted_tail(text)
+        if start >= 0 and (boundary < 0 or start < boundary):
+            boundary = start
+
+    if boundary <= 0 or not text[:boundary].strip():
+        return -1
+
+    # for HTML, only the text counts
+    if html and not re.sub(r'<[^>]*>|&nbsp;', '', text[:boundary]).strip():
+        return -1
+
+    return boundary
+
+# Remove the email being replied to from the end of a body
+def cut(text, html=False):
+    """
+    Cut the body where the email being replied to starts, since it has its
+    own file, so there's less to convert and clean.
+
+    Args:
+        text: The body
+        html: True if the body is HTML
+
+    Returns:
+        str: The body up to the replied-to email, all of it if there isn't
+             one
+    """
+
+    boundary = find_boundary(text, html)
+
+    return text if boundary < 0 else text[:boundary]
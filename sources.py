@@ -0,0 +1,155 @@
+import logging
+import mmap
+import os
+import re
+
+# where the emails are read from
+INPUT_IMAP = "imap"
+INPUT_MBOX = "mbox"
+INPUT_MAILDIR = "maildir"
+INPUT_EML = "eml"
+
+MBOX_SEPARATOR = b'From '
+
+# "From " at the start of a line in a message is written as ">From "
+MBOX_ESCAPED_FROM = re.compile(rb'^>(>*From )', re.MULTILINE)
+MAILDIR_FOLDERS = ['cur', 'new']
+EML_EXTENSION = '.eml'
+
+# Find the mbox files in a folder, or the file itself
+def mbox_files(path):
+    """
+    Get the mbox files to read. Thunderbird keeps one file per folder, with
+    no extension, next to `.msf` index files, so any file that starts with
+    an mbox "From " line counts.
+
+    Args:
+        path: An mbox file or a folder with them
+
+    Returns:
+        list: The paths of the mbox files
+    """
+
+    if os.path.isfile(path):
+        return [path]
+
+    files = []
+
+    for folder, subfolders, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            file_path = os.path.join(folder, filename)
+            try:
+                with open(file_path, 'rb') as mbox_file:
+                    if mbox_file.read(len(MBOX_SEPARATOR)) == MBOX_SEPARATOR:
+                        files.append(file_path)
+            except OSError as e:
+                logging.error(f"mbox_files: {file_path}. Error {e}")
+
+    return files
+
+# Split an mbox file into messages without reading it all into memory
+def mbox_messages(file_path):
+    """
+    Read the messages from an mbox file. The file is memory-mapped and
+    split on the "From " lines so multi-GB files (e.g. from Google Takeout)
+    are never loaded into RAM; only one message at a time is copied out.
+
+    Args:
+        file_path: The mbox file
+
+    Returns:
+        Iterator of (name, raw RFC822 bytes) where the name is the file and
+        the position of the message in it
+    """
+
+    with open(file_path, 'rb') as mbox_file:
+        if os.fstat(mbox_file.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(mbox_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            if mm[:len(MBOX_SEPARATOR)] != MBOX_SEPARATOR:
+                start = mm.find(b'\n' + MBOX_SEPARATOR) + 1
+                if start == 0:
+                    return
+
+            while start < len(mm):
+                end = mm.find(b'\n' + MBOX_SEPARATOR, start)
+                end = len(mm) if end < 0 else end + 1
+
+                # skip the "From sender date" line, it isn't a header
+                body_start = mm.find(b'\n', start, end) + 1
+                if body_start > 0:
+                    raw = mm[body_start:end]
+                    if b'>From ' in raw:
+                        raw = MBOX_ESCAPED_FROM.sub(rb'\1', raw)
+                    yield f"{file_path}:{start}", raw
+
+                start = end
+
+# Read the messages from a Maildir
+def maildir_messages(path):
+    """
+    Read the messages from a Maildir, including Maildir++ subfolders. Each
+    message is a file in a `cur` or `new` folder.
+
+    Args:
+        path: The Maildir folder
+
+    Returns:
+        Iterator of (file path, raw RFC822 bytes)
+    """
+
+    for folder, subfolders, filenames in os.walk(path):
+        subfolders.sort()
+        if os.path.basename(folder) in MAILDIR_FOLDERS:
+            for filename in sorted(filenames):
+                yield from read_file(os.path.join(folder, filename))
+
+# Read the messages from a folder of .eml files
+def eml_messages(path):
+    """
+    Read the `.eml` files in a folder and its subfolders.
+
+    Args:
+        path: The folder
+
+    Returns:
+        Iterator of (file path, raw RFC822 bytes)
+    """
+
+    for folder, subfolders, filenames in os.walk(path):
+        subfolders.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(EML_EXTENSION):
+                yield from read_file(os.path.join(folder, filename))
+
+def read_file(file_path):
+    try:
+        with open(file_path, 'rb') as message_file:
+            yield file_path, message_file.read()
+    except OSError as e:
+        logging.error(f"read_file: {file_path}. Error {e}")
+
+# Read the messages from local files
+def read_messages(input_format, path):
+    """
+    Read the raw messages from local files instead of an IMAP server.
+
+    Args:
+        input_format: One of INPUT_MBOX, INPUT_MAILDIR, or INPUT_EML
+        path: The file or folder to read
+
+    Returns:
+        Iterator of (name, raw RFC822 bytes)
+    """
+
+    if input_format == INPUT_MBOX:
+        for file_path in mbox_files(path):
+            yield from mbox_messages(file_path)
+    elif input_format == INPUT_MAILDIR:
+        yield from maildir_messages(path)
+    elif input_format == INPUT_EML:
+        yield from eml_messages(path)
+    else:
+        logging.error(f"read_messages: unknown input format {input_format}")
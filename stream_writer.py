@@ -0,0 +1,81 @@
+import logging
+import queue
+import threading
+import time
+
+# write what's collected at least this often
+FLUSH_COUNT = 20
+FLUSH_SECONDS = 5
+
+# tells the writer thread there's nothing more coming
+END = object()
+
+class StreamWriter:
+    """
+    Writes items as they are produced instead of all at the end. Items go
+    through a bounded queue to a thread that hands them to `write` in small
+    groups, so memory stays flat no matter how many items there are and
+    the producers wait whenever the writer falls behind.
+    """
+
+    def __init__(self, write, queue_size=100, flush_count=FLUSH_COUNT,
+                 flush_seconds=FLUSH_SECONDS):
+        """
+        Args:
+            write: Function called with a list of items to write
+            queue_size: Maximum number of items waiting to be written
+            flush_count: Write once this many items are waiting
+            flush_seconds: Write whatever is waiting after this many seconds
+        """
+
+        self.write = write
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.flush_count = max(1, flush_count)
+        self.flush_seconds = flush_seconds
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.written = 0
+
+    def start(self):
+        self.thread.start()
+
+    # Add an item, waiting if the queue is full
+    def put(self, item):
+        self.queue.put(item)
+
+    # Write anything left and wait for the writer thread to finish
+    def close(self):
+        self.queue.put(END)
+        self.thread.join()
+
+    def flush(self, items):
+        if not items:
+            return
+
+        try:
+            self.write(items)
+            self.written += len(items)
+        except Exception as e:
+            logging.error(f"StreamWriter.flush: {e}")
+
+    def run(self):
+        items = []
+        last_flush = time.monotonic()
+
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+
+            if item is END:
+                break
+
+            if item is not None:
+                items.append(item)
+
+            if len(items) >= self.flush_count or time.monotonic() - last_flush >= self.flush_seconds:
+                self.flush(items)
+                items = []
+                last_flush = time.monotonic()
+
+        self.flush(items)
@@ -0,0 +1,186 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SYNC_STATE_FILE = "sync-state.db"
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        account TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        uidvalidity INTEGER NOT NULL,
+        last_uid INTEGER NOT NULL,
+        updated INTEGER NOT NULL,
+        PRIMARY KEY (account, folder)
+    )
+"""
+
+CREATE_MESSAGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS seen_messages (
+        account TEXT NOT NULL,
+        message_id TEXT NOT NULL,
+        PRIMARY KEY (account, message_id)
+    )
+"""
+
+class SyncState:
+    """
+    Remembers, for each account and folder, the UIDVALIDITY of the folder and
+    the highest UID that was processed so later runs only need to look at
+    newer messages. It can also remember the Message-IDs processed so 
+    copies in other folders are skipped on later runs.
+
+    The state is kept in a small SQLite database next to the config files.
+    It can be shared by the threads fetching different folders.
+    """
+
+    def __init__(self, folder):
+        self.file_path = os.path.join(folder, SYNC_STATE_FILE)
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        """
+        Open the database, creating it if needed.
+
+        Returns:
+            bool: True if it was opened, False otherwise
+        """
+
+        try:
+            self.connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self.connection.execute(CREATE_TABLE)
+            self.connection.execute(CREATE_MESSAGES_TABLE)
+            self.connection.commit()
+        except Exception as e:
+            logging.error(f"SyncState.open: {self.file_path}. Error {e}")
+            self.connection = None
+            return False
+
+        return True
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    # Get the highest UID processed in a folder
+    def get_last_uid(self, account, folder, uidvalidity):
+        """
+        Get the highest UID processed in a folder on a previous run.
+
+        Args:
+            account: The email account e.g. "spongebob@ownmail.net"
+            folder: The folder name e.g. "INBOX"
+            uidvalidity: The current UIDVALIDITY of the folder
+
+        Returns:
+            int: The last UID or 0 if the folder needs a full rescan i.e.
+                 it was never processed or its UIDVALIDITY changed
+        """
+
+        if not self.connection:
+            return 0
+
+        try:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT uidvalidity, last_uid FROM sync_state WHERE account = ? AND folder = ?",
+                    (account, folder)).fetchone()
+        except Exception as e:
+            logging.error(f"SyncState.get_last_uid: {folder}. Error {e}")
+            return 0
+
+        if not row:
+            return 0
+
+        if row[0] != uidvalidity:
+            logging.info(f"Folder: {folder}  UIDVALIDITY changed from {row[0]} to {uidvalidity}, doing a full rescan")
+            return 0
+
+        return row[1]
+
+    # Record the highest UID processed in a folder
+    def set_last_uid(self, account, folder, uidvalidity, last_uid):
+        """
+        Record the highest UID processed in a folder.
+
+        Args:
+            account: The email account
+            folder: The folder name
+            uidvalidity: The UIDVALIDITY of the folder
+            last_uid: The highest UID processed
+
+        Returns:
+            bool: True if saved, False otherwise
+        """
+
+        if not self.connection:
+            return False
+
+        try:
+            with self.lock:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)",
+                    (account, folder, uidvalidity, last_uid, int(time.time())))
+                self.connection.commit()
+        except Exception as e:
+            logging.error(f"SyncState.set_last_uid: {folder}. Error {e}")
+            return False
+
+        return True
+
+    # Get the Message-IDs processed on previous runs
+    def get_message_ids(self, account):
+        """
+        Get the Message-IDs of the emails processed on previous runs.
+
+        Args:
+            account: The email account
+
+        Returns:
+            set: The Message-IDs, empty if there are none or on error
+        """
+
+        if not self.connection:
+            return set()
+
+        try:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT message_id FROM seen_messages WHERE account = ?", (account,)).fetchall()
+        except Exception as e:
+            logging.error(f"SyncState.get_message_ids: {account}. Error {e}")
+            return set()
+
+        return {row[0] for row in rows}
+
+    # Record the Message-IDs processed
+    def add_message_ids(self, account, message_ids):
+        """
+        Record the Message-IDs of emails that were processed.
+
+        Args:
+            account: The email account
+            message_ids: The Message-IDs
+
+        Returns:
+            bool: True if saved, False otherwise
+        """
+
+        if not self.connection:
+            return False
+
+        try:
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO seen_messages VALUES (?, ?)",
+                    [(account, message_id) for message_id in message_ids])
+                self.connection.commit()
+        except Exception as e:
+            logging.error(f"SyncState.add_message_ids: {account}. Error {e}")
+            return False
+
+        return True
@@ -0,0 +1,128 @@
+"""
+The FETCH responses imaplib returns are tokenized and parsed into nested
+lists, and the BODYSTRUCTURE in them is walked to find the parts to
+download. These check both on responses shaped like the ones servers
+send.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import body_structure
+import imap_utils
+
+HEADER = b'Subject: Hello\r\nFrom: bob@example.com\r\n\r\n'
+
+# a text and HTML alternative, a PDF and an inline image
+STRUCTURE = (
+    b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 120 4 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 480 10 NIL NIL NIL)'
+    b' "ALTERNATIVE" ("BOUNDARY" "b1") NIL NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "report.pdf") NIL NIL "BASE64" 4000 NIL'
+    b' ("ATTACHMENT" ("FILENAME" "report.pdf")) NIL)'
+    b'("IMAGE" "PNG" ("NAME" "logo.png") "<logo>" NIL "BASE64" 800 NIL'
+    b' ("INLINE" ("FILENAME" "logo.png")) NIL)'
+    b' "MIXED" ("BOUNDARY" "b0") NIL NIL)'
+)
+
+# What imaplib returns for one message, the header is a literal
+def response(uid=7, structure=STRUCTURE, header=HEADER):
+    line = b'1 (UID %d BODYSTRUCTURE %s BODY[HEADER] {%d}' % (uid, structure, len(header))
+    return [(line, header), b')']
+
+def test_tokenize_puts_literals_back():
+    tokens = imap_utils.tokenize(response())
+
+    assert tokens[:4] == [b'1', b'(', b'UID', b'7']
+    assert tokens[-3:] == [b'BODY[HEADER]', (imap_utils.LITERAL, HEADER), b')']
+    assert not any(isinstance(token, bytes) and token.startswith(b'{') for token in tokens)
+
+def test_tokenize_keeps_quoted_strings_whole():
+    tokens = imap_utils.tokenize([b'1 (FLAGS (\\Seen) X "a (b) \\"c\\"")'])
+
+    assert b'"a (b) \\"c\\""' in tokens
+    assert b'\\Seen' in tokens
+
+def test_tokenize_skips_what_isnt_bytes():
+    assert imap_utils.tokenize([None, b'1 (UID 3)']) == [b'1', b'(', b'UID', b'3', b')']
+
+def test_parse_tokens_builds_nested_lists():
+    values = imap_utils.parse_tokens(imap_utils.tokenize(response()))
+
+    number, items = values
+    assert number == "1"
+    assert items[:2] == ["UID", "7"]
+    assert items[2] == "BODYSTRUCTURE"
+    assert items[4] == "BODY[HEADER]"
+    assert items[5] == HEADER
+
+def test_parse_tokens_values():
+    tokens = imap_utils.tokenize([b'(NIL nil "say \\"hi\\"" atom (1 2))'])
+
+    assert imap_utils.parse_tokens(tokens) == [[None, None, 'say "hi"', "atom", ["1", "2"]]]
+
+def test_parse_tokens_closes_unbalanced_parentheses():
+    tokens = imap_utils.tokenize([b'(a (b'])
+
+    assert imap_utils.parse_tokens(tokens) == [["a", ["b"]]]
+    assert imap_utils.parse_tokens(imap_utils.tokenize([b'a) b'])) == ["a", "b"]
+
+# The BODYSTRUCTURE of the response, as nested lists
+def structure(data=STRUCTURE):
+    items = imap_utils.parse_tokens(imap_utils.tokenize(response(structure=data)))[1]
+    return items[items.index("BODYSTRUCTURE") + 1]
+
+def test_parse_lists_the_leaf_parts():
+    parts = body_structure.parse(structure())
+
+    assert [(p.section, p.content_type) for p in parts] == [
+        ("1.1", "text/plain"), ("1.2", "text/html"),
+        ("2", "application/pdf"), ("3", "image/png")]
+
+    text, html, pdf, image = parts
+    assert text.params == {"charset": "utf-8"}
+    assert (text.encoding, text.size) == ("7bit", 120)
+    assert html.encoding == "quoted-printable"
+    assert pdf.is_attachment() and pdf.filename == "report.pdf"
+    assert pdf.decoded_size == 3000
+    assert image.disposition == "inline" and not image.is_attachment()
+
+def test_parse_single_part():
+    parts = body_structure.parse(structure(
+        b'("TEXT" "PLAIN" ("CHARSET" "us-ascii") NIL NIL "7BIT" 12 1 NIL NIL NIL)'))
+
+    assert len(parts) == 1
+    assert (parts[0].section, parts[0].content_type, parts[0].size) == ("1", "text/plain", 12)
+
+def test_parse_keeps_a_forwarded_message_whole():
+    forwarded = (b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 900 (NIL "Hi" NIL NIL NIL NIL NIL NIL NIL NIL)'
+                 b' ("TEXT" "PLAIN" NIL NIL NIL "7BIT" 50 2 NIL NIL NIL) 20 NIL ("ATTACHMENT" NIL) NIL)')
+    parts = body_structure.parse(structure(
+        b'(("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL)' + forwarded + b' "MIXED")'))
+
+    assert [(p.section, p.content_type) for p in parts] == [("1", "text/plain"), ("2", "message/rfc822")]
+    assert parts[1].is_attachment() and parts[1].size == 900
+
+def test_parse_ignores_what_isnt_a_structure():
+    assert body_structure.parse(None) == []
+    assert body_structure.parse([]) == []
+
+def test_choose_bodies_and_filtered_attachments():
+    parts = body_structure.parse(structure())
+
+    wanted, skipped = body_structure.choose(parts, [], 0)
+    assert [p.section for p in wanted] == ["1.1", "1.2", "2"]
+    assert skipped == []
+
+    wanted, skipped = body_structure.choose(parts, ["image/*"], 0)
+    assert [p.section for p in wanted] == ["1.1", "1.2"]
+    assert [p.section for p in skipped] == ["2"]
+
+    # the limit is on the decoded size
+    wanted, skipped = body_structure.choose(parts, [], 3000)
+    assert [p.section for p in wanted] == ["1.1", "1.2", "2"]
+    wanted, skipped = body_structure.choose(parts, [], 2999)
+    assert [p.section for p in skipped] == ["2"]
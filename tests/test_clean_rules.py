@@ -0,0 +1,84 @@
+"""
+The cleaning rules rewritten to run in linear time must clean a body
+exactly like the regular expressions they replaced, byte for byte.
+Each one is compared to its old pattern, from `bench_cleaning.OLD_RULES`,
+on the bodies of the benchmark corpus with the text the rules look for 
+mixed in.
+"""
+
+import email
+import os
+import random
+import re
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# email_md needs message_md
+email_md = pytest.importorskip("email_md")
+
+import bench_cleaning
+import corpus
+
+# how many bodies to compare, the old patterns are slow on long ones
+BODIES = 1000
+MEAN_KB = 0.25
+
+# pieces of the text the rules look for, and the text around it
+FRAGMENTS = [
+    "On ", " wrote:", "wrote:", "WROTE:", "#", "{margin:0;}", "NoSpacing", 
+    "Forwarded message", "forwarded messag", "Original Message", "This e-mail",
+    "*", "**", "-", "--", "---", "-" * 32, ">", "> ", "\n", "\n\n", " ", "\t",
+    "\\", "\\s", "s", "S", "\\s>\\s--\\s", "\\swrote:", "<!-- c -- wrote:", 
+    "> --- Bob Smith wrote:", "Bob",
+]
+
+# Get the text of each part of each email in the corpus
+def corpus_bodies():
+    bodies = []
+
+    for folder, date, raw in corpus.Corpus(count=BODIES, mean_kb=MEAN_KB, attachment_ratio=0, seed=3).messages:
+        for part in email.message_from_bytes(raw).walk():
+            if part.get_content_maintype() == "text":
+                bodies.append(part.get_payload(decode=True).decode("utf-8", "replace"))
+
+    return bodies
+
+# Put random fragments in at random places
+def mix_in(text, rng):
+    for _ in range(rng.randrange(1, 12)):
+        position = rng.randrange(len(text) + 1)
+        fragment = ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randrange(1, 8)))
+        text = text[:position] + fragment + text[position:]
+
+    return text
+
+@pytest.fixture(scope="module")
+def bodies():
+    rng = random.Random(7)
+    found = corpus_bodies()
+
+    # the same again with the text the rules look for, and short bodies of 
+    # nothing but that text
+    mixed = [mix_in(body, rng) for body in found]
+    short = [''.join(rng.choice(FRAGMENTS) for _ in range(rng.randrange(40))) for _ in range(20000)]
+
+    return found + mixed + short
+
+@pytest.mark.parametrize("name", sorted(bench_cleaning.OLD_RULES))
+def test_same_as_old_pattern(name, bodies):
+    pattern, replacement, flags = bench_cleaning.OLD_RULES[name]
+    old = re.compile(pattern, flags)
+    rule = email_md.CLEAN_RULES.by_name[name]
+    different = 0
+
+    for body in bodies:
+        text, hits = rule.run(body)
+        if text != old.sub(replacement, body):
+            different += 1
+
+    assert different == 0, f"{name}: {different} of {len(bodies)} bodies differ"
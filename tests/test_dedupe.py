@@ -0,0 +1,80 @@
+"""
+With `dedupe_messages` and `remember_messages`, only the emails that were
+kept are remembered, so the ones left out for `max_messages` are kept on
+the next run instead of being skipped as copies forever.
+"""
+
+import collections
+import os
+import sys
+from concurrent.futures import Future
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# email_md needs message_md
+email_md = pytest.importorskip("email_md")
+
+import message_ids
+import sync_state
+
+ACCOUNT = "me@example.com"
+
+# 80 emails, every tenth one also in a second folder
+EMAILS = [f"<{i}@example.com>" for i in range(80)] + [f"<{i}@example.com>" for i in range(0, 80, 10)]
+
+# A finished parse of an email from a known person
+def parsed(message_id):
+    the_message = email_md.message.Message()
+    the_message.id = message_id
+    the_message.from_slug = "bob"
+    the_message.timestamp = None
+
+    future = Future()
+    future.set_result((True, the_message, collections.Counter(), ([], {}), {}))
+
+    return future
+
+# Keep the emails like `fetch_emails` does, remembering the IDs at the end
+def run(monkeypatch, folder, max_messages):
+    monkeypatch.setattr(email_md, "MESSAGE_IDS", message_ids.MessageIds())
+    monkeypatch.setattr(email_md, "messages_found", 0)
+    monkeypatch.setattr(email_md, "the_stream", None)
+    monkeypatch.setattr(email_md.the_config, "max_messages", max_messages, raising=False)
+    monkeypatch.setattr(email_md.the_settings, "dedupe_messages", True)
+
+    state = sync_state.SyncState(str(folder))
+    state.open()
+    email_md.MESSAGE_IDS.load(state.get_message_ids(ACCOUNT))
+
+    messages = []
+    for message_id in EMAILS:
+        email_md.keep_parsed(parsed(message_id), messages)
+
+    state.add_message_ids(ACCOUNT, email_md.MESSAGE_IDS.take_new())
+    remembered = state.get_message_ids(ACCOUNT)
+    state.close()
+
+    return [the_message.id for the_message in messages], remembered
+
+def test_only_kept_emails_are_remembered(monkeypatch, tmp_path):
+    kept, remembered = run(monkeypatch, tmp_path, 5)
+
+    assert len(kept) == 5
+    assert set(remembered) == {message_ids.MessageIds.normalize(message_id) for message_id in kept}
+
+def test_next_run_keeps_the_rest(monkeypatch, tmp_path):
+    first, remembered = run(monkeypatch, tmp_path, 5)
+    second, remembered = run(monkeypatch, tmp_path, 1000)
+
+    assert len(second) == 80 - 5
+    assert not set(first) & set(second)
+    assert len(remembered) == 80
+
+def test_copies_are_skipped(monkeypatch, tmp_path):
+    kept, remembered = run(monkeypatch, tmp_path, 1000)
+
+    assert len(kept) == 80
+    assert len(set(kept)) == 80
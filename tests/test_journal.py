@@ -0,0 +1,91 @@
+"""
+The journal must give back the UIDs done and the messages kept by an
+interrupted run, in order, for the folder's UIDVALIDITY only. What's
+saved is committed at most every `interval` seconds, and all of it once
+the journal is closed.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import journal
+
+ACCOUNT = "spongebob@ownmail.net"
+
+def open_journal(folder, interval=0):
+    the_journal = journal.Journal(str(folder), interval)
+    assert the_journal.open()
+    return the_journal
+
+# A kept message, anything that can be pickled will do
+def kept(uid):
+    return uid, {"id": f"<{uid}@example.com>", "body": "x" * uid}
+
+def test_save_and_get(tmp_path):
+    the_journal = open_journal(tmp_path)
+
+    assert the_journal.save(ACCOUNT, "INBOX", 100, [b'1', b'2', b'3'], [kept(1), kept(3)]) > 0
+    assert the_journal.save(ACCOUNT, "Sent", 7, [b'9'], [kept(9)]) > 0
+    assert the_journal.save(ACCOUNT, "INBOX", 100, [b'4'], []) == 0
+    the_journal.close()
+
+    the_journal = open_journal(tmp_path)
+    assert the_journal.get_uids(ACCOUNT, "INBOX", 100) == {1, 2, 3, 4}
+    assert the_journal.get_uids(ACCOUNT, "Sent", 7) == {9}
+    assert the_journal.get_uids(ACCOUNT, "INBOX", 101) == set()
+    assert the_journal.get_messages(ACCOUNT) == [kept(1)[1], kept(3)[1], kept(9)[1]]
+    assert the_journal.get_messages("other@ownmail.net") == []
+    the_journal.close()
+
+def test_saving_a_uid_twice(tmp_path):
+    the_journal = open_journal(tmp_path)
+
+    the_journal.save(ACCOUNT, "INBOX", 1, [b'1', b'2'], [])
+    the_journal.save(ACCOUNT, "INBOX", 1, [b'2', b'3'], [])
+
+    assert the_journal.get_uids(ACCOUNT, "INBOX", 1) == {1, 2, 3}
+    the_journal.close()
+
+def test_commits_every_interval(tmp_path):
+    the_journal = open_journal(tmp_path, interval=3600)
+    the_journal.save(ACCOUNT, "INBOX", 1, [b'1'], [kept(1)])
+
+    # another connection, like a run after this one is killed
+    reader = open_journal(tmp_path)
+    assert reader.get_uids(ACCOUNT, "INBOX", 1) == set()
+
+    the_journal.interval = 0
+    the_journal.save(ACCOUNT, "INBOX", 1, [b'2'], [])
+    assert reader.get_uids(ACCOUNT, "INBOX", 1) == {1, 2}
+    assert reader.get_messages(ACCOUNT) == [kept(1)[1]]
+
+    the_journal.interval = 3600
+    the_journal.save(ACCOUNT, "INBOX", 1, [b'3'], [])
+    the_journal.close()
+    assert reader.get_uids(ACCOUNT, "INBOX", 1) == {1, 2, 3}
+    reader.close()
+
+def test_clear(tmp_path):
+    the_journal = open_journal(tmp_path)
+    the_journal.save(ACCOUNT, "INBOX", 1, [b'1'], [kept(1)])
+    the_journal.save("other@ownmail.net", "INBOX", 1, [b'5'], [kept(5)])
+
+    assert the_journal.clear(ACCOUNT)
+
+    assert the_journal.get_uids(ACCOUNT, "INBOX", 1) == set()
+    assert the_journal.get_messages(ACCOUNT) == []
+    assert the_journal.get_uids("other@ownmail.net", "INBOX", 1) == {5}
+    the_journal.close()
+
+def test_not_open():
+    # e.g. the module default in email_md before `__main__` opens it
+    the_journal = journal.Journal("", 0)
+
+    assert the_journal.save(ACCOUNT, "INBOX", 1, [b'1'], [kept(1)]) == 0
+    assert the_journal.get_uids(ACCOUNT, "INBOX", 1) == set()
+    assert the_journal.get_messages(ACCOUNT) == []
+    assert not the_journal.clear(ACCOUNT)
+    the_journal.close()
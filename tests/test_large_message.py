@@ -0,0 +1,138 @@
+"""
+A large email split into spooled parts must give the same parts, with
+the same decoded bodies, as the email package parsing it in memory.
+Bodies decoded a piece at a time, cut to `max_bytes`, or with lines
+longer than `MAX_LINE` are checked too.
+"""
+
+import email
+import email.policy
+import os
+import random
+import sys
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import large_message
+
+# Build an email with text, HTML, attachments and a forwarded email
+def build(seed=1, attachment_kb=300):
+    rng = random.Random(seed)
+
+    forwarded = EmailMessage()
+    forwarded["Subject"] = "Forwarded"
+    forwarded.set_content("The forwarded text\n")
+
+    message = EmailMessage()
+    message["From"] = "bob@example.com"
+    message["Subject"] = "Large"
+    message.set_content("Plain text =é line\n" * 200)
+    message.add_alternative("<p>HTML text</p>\n" * 200, subtype="html")
+    message.add_attachment(rng.randbytes(attachment_kb * 1024), maintype="application",
+                           subtype="octet-stream", filename="data.bin")
+    message.add_attachment("café " * 5000, subtype="plain", filename="notes.txt", cte="quoted-printable")
+    message.add_attachment(forwarded)
+
+    return message.as_bytes(policy=email.policy.SMTP)
+
+def split(tmp_path, raw, max_bytes=0):
+    path = tmp_path / "large.eml"
+    path.write_bytes(raw)
+    parts_folder = tmp_path / "parts"
+    parts_folder.mkdir(exist_ok=True)
+    return large_message.split(str(path), str(parts_folder), max_bytes)
+
+# The leaf parts as the email package sees them, a forwarded email is a leaf
+def expected_leaves(raw):
+    result = []
+    for part in email.message_from_bytes(raw).walk():
+        if part.get_content_type() == 'message/rfc822':
+            result.append(part)
+        elif not part.is_multipart() and not any(
+                part is inner for forwarded in result for inner in forwarded.walk()):
+            result.append(part)
+    return result
+
+def test_split_matches_the_email_package(tmp_path):
+    raw = build()
+    header, parts = split(tmp_path, raw)
+    expected = expected_leaves(raw)
+
+    assert email.message_from_bytes(header)["Subject"] == "Large"
+    assert [p.get_content_type() for p in parts] == [p.get_content_type() for p in expected]
+    assert [p.get_content_type() for p in parts] == [
+        "text/plain", "text/html", "application/octet-stream", "text/plain", "message/rfc822"]
+
+    for part, other in zip(parts[:-1], expected[:-1]):
+        assert part.get_filename() == other.get_filename()
+        assert part.get_payload(decode=True) == other.get_payload(decode=True)
+        assert b''.join(large_message.decoded_chunks(part)) == other.get_payload(decode=True)
+        assert not part.cut
+
+    forwarded = email.message_from_bytes(open(parts[-1].body_path, 'rb').read())
+    assert forwarded["Subject"] == "Forwarded"
+
+def test_parts_are_only_read_when_asked_for(tmp_path):
+    header, parts = split(tmp_path, build())
+
+    assert all(os.path.isfile(part.body_path) for part in parts)
+    assert not any(part.loaded for part in parts)
+
+    parts[0].get_payload()
+    assert parts[0].loaded and not parts[1].loaded
+
+def test_decoded_chunks_across_pieces(tmp_path, monkeypatch):
+    raw = build(seed=2, attachment_kb=50)
+    header, parts = split(tmp_path, raw)
+    expected = expected_leaves(raw)
+
+    # odd sizes so the pieces end partway through a base64 group or a line
+    for size in (7, 1001, 4097):
+        monkeypatch.setattr(large_message, "DECODE_CHUNK", size)
+        for part, other in zip(parts[:-1], expected[:-1]):
+            assert b''.join(large_message.decoded_chunks(part)) == other.get_payload(decode=True)
+
+def test_max_bytes_cuts_the_payload(tmp_path):
+    raw = build(attachment_kb=100)
+    header, parts = split(tmp_path, raw, max_bytes=1000)
+    attachment = parts[2]
+    whole = expected_leaves(raw)[2].get_payload(decode=True)
+
+    data = attachment.get_payload(decode=True)
+
+    assert attachment.cut
+    assert 900 <= len(data) <= 1000
+    assert whole.startswith(data)
+
+def test_long_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(large_message, "MAX_LINE", 100)
+    line = "x" * 1000
+    raw = (b'Subject: Long\r\nMIME-Version: 1.0\r\n'
+           b'Content-Type: multipart/mixed; boundary="b"\r\n\r\npreamble\r\n'
+           b'--b\r\nContent-Type: text/plain\r\n\r\n' + line.encode() + b'\r\nend\r\n'
+           b'--b--\r\nepilogue\r\n')
+
+    header, parts = split(tmp_path, raw)
+
+    assert len(parts) == 1
+    assert parts[0].get_payload(decode=True) == (line + "\r\nend").encode()
+
+def test_unclosed_parts(tmp_path):
+    raw = (b'Subject: Cut\r\nContent-Type: multipart/mixed; boundary="outer"\r\n\r\n'
+           b'--outer\r\nContent-Type: multipart/alternative; boundary="inner"\r\n\r\n'
+           b'--inner\r\nContent-Type: text/plain\r\n\r\nfirst\r\n'
+           b'--outer\r\nContent-Type: text/html\r\n\r\n<p>second</p>\r\n')
+
+    header, parts = split(tmp_path, raw)
+
+    assert [p.get_content_type() for p in parts] == ["text/plain", "text/html"]
+    assert parts[0].get_payload(decode=True) == b'first'
+    assert parts[1].get_payload(decode=True) == b'<p>second</p>\r\n'
+
+def test_not_multipart(tmp_path):
+    header, parts = split(tmp_path, b'Subject: Short\r\n\r\nJust text\r\n')
+
+    assert len(parts) == 1
+    assert parts[0].get_payload(decode=True) == b'Just text\r\n'
@@ -0,0 +1,99 @@
+"""
+The message cache must give back the emails put in it, byte for byte,
+keyed by folder, UIDVALIDITY and UID, and drop the least recently used
+ones once it's over its limit.
+"""
+
+import itertools
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import message_cache
+
+ACCOUNT = "spongebob@ownmail.net"
+
+def open_cache(folder, max_bytes=10 * 1024 * 1024):
+    cache = message_cache.MessageCache(str(folder), max_bytes)
+    assert cache.open()
+    return cache
+
+# An email that doesn't compress, so its size in the cache is about `size`
+def message(uid, size=1000):
+    return f"Subject: {uid}\r\n\r\n".encode() + random.Random(uid).randbytes(size)
+
+def test_put_and_get(tmp_path):
+    cache = open_cache(tmp_path)
+    messages = {str(uid).encode(): message(uid) for uid in range(1, 6)}
+
+    assert cache.put(ACCOUNT, "INBOX", 100, messages)
+    cache.close()
+
+    cache = open_cache(tmp_path)
+    assert cache.get(ACCOUNT, "INBOX", 100, [b'2', b'4', b'9']) == {b'2': message(2), b'4': message(4)}
+    assert cache.get(ACCOUNT, "INBOX", 101, [b'2']) == {}
+    assert cache.get(ACCOUNT, "Sent", 100, [b'2']) == {}
+    assert cache.get("other@ownmail.net", "INBOX", 100, [b'2']) == {}
+    assert cache.get(ACCOUNT, "INBOX", 100, []) == {}
+    cache.close()
+
+def test_get_many(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_cache, "GET_CHUNK", 7)
+    cache = open_cache(tmp_path)
+    cache.put(ACCOUNT, "INBOX", 1, {str(uid).encode(): message(uid, 10) for uid in range(1, 31)})
+
+    found = cache.get(ACCOUNT, "INBOX", 1, [str(uid).encode() for uid in range(1, 41)])
+
+    assert sorted(int(uid) for uid in found) == list(range(1, 31))
+    cache.close()
+
+def test_replacing_an_email_keeps_the_total(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put(ACCOUNT, "INBOX", 1, {b'1': message(1)})
+    total = cache.total
+
+    cache.put(ACCOUNT, "INBOX", 1, {b'1': message(1)})
+
+    assert cache.total == total
+    cache.close()
+    assert open_cache(tmp_path).total == total
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(message_cache.time, "time", lambda: next(clock))
+    cache = open_cache(tmp_path, max_bytes=5500)
+
+    for uid in range(1, 6):
+        cache.put(ACCOUNT, "INBOX", 1, {str(uid).encode(): message(uid)})
+
+    # using the oldest keeps it
+    assert cache.get(ACCOUNT, "INBOX", 1, [b'1'])
+    cache.put(ACCOUNT, "INBOX", 1, {b'6': message(6)})
+
+    assert [uid for folder, uidvalidity, uid in cache.keys(ACCOUNT)] == [6, 5, 4, 3, 1]
+    assert cache.total <= 5500
+    cache.close()
+
+def test_keys_by_folder_newest_first(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put(ACCOUNT, "Sent", 7, {b'3': message(3), b'8': message(8)})
+    cache.put(ACCOUNT, "INBOX", 1, {b'2': message(2), b'5': message(5)})
+    cache.put("other@ownmail.net", "INBOX", 1, {b'9': message(9)})
+
+    assert cache.keys(ACCOUNT) == [("INBOX", 1, 5), ("INBOX", 1, 2), ("Sent", 7, 8), ("Sent", 7, 3)]
+    cache.close()
+
+def test_without_a_limit_or_not_open(tmp_path):
+    cache = open_cache(tmp_path, max_bytes=0)
+    assert not cache.put(ACCOUNT, "INBOX", 1, {b'1': message(1)})
+    assert cache.get(ACCOUNT, "INBOX", 1, [b'1']) == {}
+    cache.close()
+
+    # e.g. the module default in email_md before `__main__` opens it
+    cache = message_cache.MessageCache("", 0)
+    assert not cache.put(ACCOUNT, "INBOX", 1, {b'1': message(1)})
+    assert cache.get(ACCOUNT, "INBOX", 1, [b'1']) == {}
+    assert cache.keys(ACCOUNT) == []
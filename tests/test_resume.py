@@ -0,0 +1,122 @@
+"""
+A run interrupted by a failed fetch keeps its journal, and `resume`
+picks up from it: the emails it already got come back from the journal
+instead of the server, and the result is the same as a run that never
+failed. The stand-in IMAP server from the benchmarks serves the corpus.
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# email_md needs message_md
+email_md = pytest.importorskip("email_md")
+
+import corpus
+import imap_stand_in
+import imap_utils
+import journal
+import message_cache
+import message_ids
+import metrics
+import people_index
+import sync_state
+
+ACCOUNT = "me@example.com"
+
+# which body fetch fails on the interrupted run
+FAIL_AT = 3
+
+@pytest.fixture(scope="module")
+def server():
+    the_corpus = corpus.Corpus(count=120, seed=5, mean_kb=0.5, attachment_ratio=0)
+    mailbox = imap_stand_in.Mailbox()
+    for folder, date, raw in sorted(the_corpus.messages, key=lambda m: m[1]):
+        mailbox.add(folder, raw, date)
+
+    the_server = imap_stand_in.Server(mailbox)
+    the_server.start()
+
+    return the_server, the_corpus
+
+# Load the emails like `__main__` does, keeping what's between runs in `folder`
+def run(monkeypatch, server, folder, resume=False, fail_at=0):
+    the_server, the_corpus = server
+    people = {p["email"]: types.SimpleNamespace(slug=p["slug"], emails=[p["email"]], ignore=False)
+              for p in the_corpus.people}
+    people[corpus.MY_EMAIL] = types.SimpleNamespace(slug="me", emails=[corpus.MY_EMAIL], ignore=False)
+
+    the_config = email_md.the_config
+    for name, value in [("config_folder", str(folder)), ("output_folder", str(folder / "out")),
+                        ("imap_server", "127.0.0.1"), ("email_account", ACCOUNT), ("password", "x"),
+                        ("from_date", "2024-01-01"), ("max_messages", 10 ** 9),
+                        ("email_folders", []), ("not_email_folders", []),
+                        ("get_person_by_email", lambda address: people.get(address))]:
+        monkeypatch.setattr(the_config, name, value, raising=False)
+
+    the_settings = email_md.the_settings
+    for name, value in [("imap_port", the_server.port), ("imap_ssl", False),
+                        ("fetch_batch_size", 10), ("journal_seconds", 0.001), ("resume", resume)]:
+        monkeypatch.setattr(the_settings, name, value)
+
+    for name, value in [("the_people", people_index.PeopleIndex(the_config)),
+                        ("MESSAGE_IDS", message_ids.MessageIds()), ("METRICS", metrics.Metrics()),
+                        ("messages_found", 0), ("failed_folders", []), ("fetch_complete", False),
+                        ("the_sync_state", sync_state.SyncState(str(folder))),
+                        ("the_cache", message_cache.MessageCache(str(folder), 0)),
+                        ("the_journal", journal.Journal(str(folder), 0.001))]:
+        monkeypatch.setattr(email_md, name, value)
+
+    if fail_at:
+        fetch_batch = imap_utils.fetch_batch
+        calls = []
+
+        def failing_fetch_batch(imap, uids, *args, **kwargs):
+            calls.append(uids)
+            if len(calls) == fail_at:
+                raise imap_utils.FetchError("injected")
+            return fetch_batch(imap, uids, *args, **kwargs)
+
+        monkeypatch.setattr(imap_utils, "fetch_batch", failing_fetch_batch)
+
+    sent = the_server.stats.messages_sent
+    messages = []
+    email_md.load_messages(None, messages, [], the_config)
+    email_md.finish_journal()
+    monkeypatch.undo()
+
+    return sorted(the_message.id for the_message in messages), the_server.stats.messages_sent - sent
+
+def journal_uids(folder):
+    the_journal = journal.Journal(str(folder), 0)
+    the_journal.open()
+    uids = the_journal.get_uids(ACCOUNT, "INBOX", imap_stand_in.UIDVALIDITY)
+    the_journal.close()
+    return uids
+
+def test_resume_matches_a_clean_run(monkeypatch, server, tmp_path):
+    (tmp_path / "clean").mkdir()
+    (tmp_path / "failed").mkdir()
+    clean, clean_sent = run(monkeypatch, server, tmp_path / "clean")
+
+    interrupted, sent = run(monkeypatch, server, tmp_path / "failed", fail_at=FAIL_AT)
+    assert clean and len(interrupted) < len(clean)
+    assert journal_uids(tmp_path / "failed")
+
+    resumed, resumed_sent = run(monkeypatch, server, tmp_path / "failed", resume=True)
+    assert resumed == clean
+    assert resumed_sent < clean_sent
+
+    # the run is complete, so the journal is emptied
+    assert not journal_uids(tmp_path / "failed")
+
+def test_complete_run_empties_the_journal(monkeypatch, server, tmp_path):
+    run(monkeypatch, server, tmp_path)
+
+    assert not journal_uids(tmp_path)
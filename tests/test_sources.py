@@ -0,0 +1,102 @@
+"""
+Emails read from local files must come out as the raw messages that
+were stored: an mbox file split on its "From " lines with the escaping
+undone, and each file of a Maildir or folder of `.eml` files.
+"""
+
+import email
+import mailbox
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sources
+
+# Build a short message, its body can have "From " lines
+def message(number, body=None):
+    body = body or f"Body {number}\n"
+    return (f"From: bob{number}@example.com\nSubject: Message {number}\n"
+            f"Message-ID: <{number}@example.com>\n\n{body}").encode()
+
+def subjects(messages):
+    return [email.message_from_bytes(raw)["Subject"] for name, raw in messages]
+
+def write_mbox(path, raws):
+    box = mailbox.mbox(str(path))
+    for raw in raws:
+        box.add(raw)
+    box.flush()
+    box.close()
+
+def test_mbox_messages(tmp_path):
+    path = tmp_path / "Inbox"
+    write_mbox(path, [message(n) for n in range(5)])
+
+    messages = list(sources.mbox_messages(str(path)))
+
+    assert subjects(messages) == [f"Message {n}" for n in range(5)]
+    assert [name for name, raw in messages][0] == f"{path}:0"
+    assert all(not raw.startswith(b'From ') for name, raw in messages)
+
+# Lines are escaped the mboxrd way, one more ">" on each ">*From " line
+def test_mbox_unescapes_from_lines(tmp_path):
+    path = tmp_path / "Inbox"
+    body = "Hi\nFrom here on\n>From there\nend\n"
+    escaped = message(1, "Hi\n>From here on\n>>From there\nend\n")
+    path.write_bytes(b'From bob1@example.com Mon Jan  1 00:00:00 2024\n' + escaped + b'\n'
+                     b'From bob2@example.com Mon Jan  1 00:00:00 2024\n' + message(2) + b'\n')
+
+    messages = list(sources.mbox_messages(str(path)))
+
+    assert subjects(messages) == ["Message 1", "Message 2"]
+    text = email.message_from_bytes(messages[0][1]).get_payload()
+    assert text.startswith(body)
+
+def test_mbox_empty_and_garbage(tmp_path):
+    empty = tmp_path / "empty"
+    empty.write_bytes(b'')
+    garbage = tmp_path / "garbage"
+    garbage.write_bytes(b'not an mbox\nat all\n')
+
+    assert list(sources.mbox_messages(str(empty))) == []
+    assert list(sources.mbox_messages(str(garbage))) == []
+
+def test_mbox_files_finds_thunderbird_folders(tmp_path):
+    write_mbox(tmp_path / "Inbox", [message(1)])
+    write_mbox(tmp_path / "Sent", [message(2), message(3)])
+    (tmp_path / "Inbox.msf").write_bytes(b'// <!-- <mdb:mork:z v="1.4"/> -->')
+
+    files = sources.mbox_files(str(tmp_path))
+
+    assert [os.path.basename(f) for f in files] == ["Inbox", "Sent"]
+    assert subjects(sources.read_messages(sources.INPUT_MBOX, str(tmp_path))) == [
+        "Message 1", "Message 2", "Message 3"]
+
+def test_maildir_messages(tmp_path):
+    box = mailbox.Maildir(str(tmp_path / "mail"))
+    for n in range(3):
+        box.add(message(n))
+    work = box.add_folder("Work")
+    work.add(message(3))
+    (tmp_path / "mail" / "tmp" / "partial").write_bytes(message(9))
+
+    messages = list(sources.read_messages(sources.INPUT_MAILDIR, str(tmp_path / "mail")))
+
+    assert sorted(subjects(messages)) == [f"Message {n}" for n in range(4)]
+    assert all(os.path.isfile(name) for name, raw in messages)
+
+def test_eml_messages(tmp_path):
+    (tmp_path / "a.eml").write_bytes(message(1))
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.EML").write_bytes(message(2))
+    (tmp_path / "notes.txt").write_bytes(message(3))
+
+    messages = list(sources.read_messages(sources.INPUT_EML, str(tmp_path)))
+
+    assert subjects(messages) == ["Message 1", "Message 2"]
+    assert messages[0] == (str(tmp_path / "a.eml"), message(1))
+
+def test_unknown_format(tmp_path):
+    assert list(sources.read_messages("pst", str(tmp_path))) == []
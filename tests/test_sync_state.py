@@ -0,0 +1,106 @@
+"""
+The sync state must give back the last UID of each folder across runs,
+and start a folder over when its UIDVALIDITY changes. The last UID
+saved after a fetch must not pass an email that wasn't done. The
+Message-IDs remembered for `dedupe_messages` are kept per account.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sync_state
+
+ACCOUNT = "spongebob@ownmail.net"
+
+def open_state(folder):
+    state = sync_state.SyncState(str(folder))
+    assert state.open()
+    return state
+
+def test_last_uid_kept_across_runs(tmp_path):
+    state = open_state(tmp_path)
+    assert state.get_last_uid(ACCOUNT, "INBOX", 100) == 0
+
+    assert state.set_last_uid(ACCOUNT, "INBOX", 100, 42)
+    assert state.set_last_uid(ACCOUNT, "Sent", 7, 3)
+    assert state.set_last_uid(ACCOUNT, "INBOX", 100, 50)
+    state.close()
+
+    state = open_state(tmp_path)
+    assert state.get_last_uid(ACCOUNT, "INBOX", 100) == 50
+    assert state.get_last_uid(ACCOUNT, "Sent", 7) == 3
+    assert state.get_last_uid("other@ownmail.net", "INBOX", 100) == 0
+    assert os.path.isfile(tmp_path / sync_state.SYNC_STATE_FILE)
+    state.close()
+
+def test_uidvalidity_change_rescans(tmp_path):
+    state = open_state(tmp_path)
+    state.set_last_uid(ACCOUNT, "INBOX", 100, 42)
+
+    assert state.get_last_uid(ACCOUNT, "INBOX", 101) == 0
+
+    state.set_last_uid(ACCOUNT, "INBOX", 101, 5)
+    assert state.get_last_uid(ACCOUNT, "INBOX", 101) == 5
+    assert state.get_last_uid(ACCOUNT, "INBOX", 100) == 0
+    state.close()
+
+def test_message_ids(tmp_path):
+    state = open_state(tmp_path)
+    assert state.get_message_ids(ACCOUNT) == set()
+
+    assert state.add_message_ids(ACCOUNT, ["<1@x>", "<2@x>"])
+    assert state.add_message_ids(ACCOUNT, ["<2@x>", "<3@x>"])
+    assert state.add_message_ids("other@ownmail.net", ["<9@x>"])
+    state.close()
+
+    state = open_state(tmp_path)
+    assert state.get_message_ids(ACCOUNT) == {"<1@x>", "<2@x>", "<3@x>"}
+    assert state.get_message_ids("other@ownmail.net") == {"<9@x>"}
+    state.close()
+
+def test_shared_by_threads(tmp_path):
+    state = open_state(tmp_path)
+
+    def fetch(folder):
+        for uid in range(1, 51):
+            state.set_last_uid(ACCOUNT, folder, 1, uid)
+
+    threads = [threading.Thread(target=fetch, args=(f"Folder{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [state.get_last_uid(ACCOUNT, f"Folder{n}", 1) for n in range(4)] == [50] * 4
+    state.close()
+
+def test_not_open(tmp_path):
+    # e.g. the module default in email_md before `__main__` opens it
+    state = sync_state.SyncState("")
+
+    assert state.get_last_uid(ACCOUNT, "INBOX", 1) == 0
+    assert not state.set_last_uid(ACCOUNT, "INBOX", 1, 5)
+    assert state.get_message_ids(ACCOUNT) == set()
+    assert not state.add_message_ids(ACCOUNT, ["<1@x>"])
+
+def test_open_fails(tmp_path):
+    state = sync_state.SyncState(str(tmp_path / "missing"))
+
+    assert not state.open()
+    assert state.get_last_uid(ACCOUNT, "INBOX", 1) == 0
+
+def test_highest_done_stops_at_a_gap():
+    # email_md needs message_md
+    email_md = pytest.importorskip("email_md")
+    uids = [b'12', b'10', b'11', b'14', b'13']
+
+    assert email_md.highest_done(uids, {10, 11, 12, 13, 14}, 9) == 14
+    assert email_md.highest_done(uids, {10, 11, 13, 14}, 9) == 11
+    assert email_md.highest_done(uids, {11, 12, 13, 14}, 9) == 9
+    assert email_md.highest_done([], set(), 9) == 9